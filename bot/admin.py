@@ -1,20 +1,85 @@
 from django.contrib import admin
-from bot.models import Customer, Product, Category, Order, Cart
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from bot.models import Customer, Product, Category, Order, Cart, CartItem
+from bot.pagination import EstimatedCountPaginator
+from bot.search import filter_products
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Список для таблиц на миллионы строк: без COUNT(*) и поиска по LIKE '%...%'
+    Число строк оценивается по статистике PostgreSQL (EstimatedCountPaginator). Поиск
+    обслуживается индексами: поля search_fields с префиксом '^' ищутся по началу
+    значения без учета регистра (индекс по UPPER(поле) с text_pattern_ops), остальные -
+    на точное равенство. Каждое слово запроса должно совпасть с одним из полей.
+    Стандартный поиск админки (UPPER(...) LIKE '%...%', приведение чисел к тексту)
+    индексы не использует и читает всю таблицу.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def search_field(self, name):
+        """Поле модели по пути из search_fields ('customer__phone')"""
+        opts = self.model._meta
+        for part in name.split('__'):
+            field = opts.get_field(part)
+            if field.is_relation:
+                opts = field.related_model._meta
+        return field
+
+    def word_condition(self, search_fields, word):
+        """Условие на одно слово запроса: совпадение с любым из полей"""
+        condition = Q()
+        for name in search_fields:
+            if name.startswith('^'):
+                condition |= Q(**{f'{name[1:]}__istartswith': word})
+                continue
+            try:
+                value = self.search_field(name).to_python(word)
+            except ValidationError:
+                # Текст в числовом поле: такое поле не может совпасть
+                continue
+            condition |= Q(**{name: value})
+        return condition
+
+    def get_search_results(self, request, queryset, search_term):
+        words = search_term.split()
+        if not words:
+            return queryset, False
+
+        search_fields = self.get_search_fields(request)
+        for word in words:
+            condition = self.word_condition(search_fields, word)
+            if not condition:
+                return queryset.none(), False
+            queryset = queryset.filter(condition)
+        return queryset, False
 
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(LargeTableAdmin):
     fields = ['first_name', 'last_name', 'phone', 'address', 'telegram_id']
     list_display = ('id', 'first_name', 'last_name', 'phone', 'address', 'telegram_id')
-    search_fields = ('first_name', 'last_name', 'phone', 'address', 'telegram_id')
+    search_fields = ('^first_name', '^last_name', '^phone', 'telegram_id')
+    ordering = ('-id',)
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    fields = ['title', 'description', 'price', 'category', 'image']
-    list_display = ('id', 'title', 'category', 'price')
+class ProductAdmin(LargeTableAdmin):
+    fields = ['title', 'description', 'price', 'category', 'image', 'remainder']
+    list_display = ('id', 'title', 'category', 'price', 'remainder')
+    list_select_related = ('category',)
+    autocomplete_fields = ('category',)
     search_fields = ('title', 'description')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('search_vector')
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по индексу search_vector вместо ILIKE по title/description"""
+        return filter_products(queryset, search_term), False
+
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -24,15 +89,44 @@ class CategoryAdmin(admin.ModelAdmin):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     fields = ['order_number', 'customer', 'is_confirmed', 'delivery_method', 'status']
-    list_display = ('id', 'customer', 'order_date_time', 'is_confirmed', 'delivery_method', 'status')
-    search_fields = ('customer', 'product')
+    list_display = ('id', 'customer', 'order_date_time', 'is_confirmed', 'delivery_method', 'status',
+                    'total_items', 'total_price')
+    list_select_related = ('customer',)
+    autocomplete_fields = ('customer',)
+    search_fields = ('order_number', '^customer__first_name', '^customer__last_name', '^customer__phone',
+                     'customer__telegram_id')
     list_filter = ('is_confirmed', 'delivery_method', 'status')
+    # Сортировка по первичному ключу читает страницу по индексу; сортировка по итогам
+    # отключена: она вычисляет итоги всех заказов таблицы
+    ordering = ('-id',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(description='Товаров')
+    def total_items(self, obj):
+        return obj.total_items
+
+    @admin.display(description='Сумма')
+    def total_price(self, obj):
+        return obj.total_price
+
+
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    fields = ['product', 'quantity']
+    autocomplete_fields = ('product',)
+    extra = 0
 
 
 @admin.register(Cart)
-class CartAdmin(admin.ModelAdmin):
-    fields = ['customer', 'products']
+class CartAdmin(LargeTableAdmin):
+    fields = ['customer']
     list_display = ('id', 'customer')
-    search_fields = ('customer',)
+    list_select_related = ('customer',)
+    autocomplete_fields = ('customer',)
+    search_fields = ('^customer__first_name', '^customer__last_name', '^customer__phone', 'customer__telegram_id')
+    ordering = ('-id',)
+    inlines = [CartItemInline]
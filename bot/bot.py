@@ -1,85 +1,224 @@
 # bot.py (обновленный)
+import logging
 import os
 import django
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.fsm.context import FSMContext
 from django.conf import settings
-from asgiref.sync import sync_to_async
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, BotCommand, ReplyKeyboardMarkup, KeyboardButton, \
-    ReplyKeyboardRemove
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, BotCommand
 from .bot_utils import update_phone, update_address, get_profile, get_welcome_text, get_cart_data, add_item_in_cart, \
-    remove_item, change_cart_item_quantity, new_order
-from .models import Customer, Category, Product, Cart, Order
+    remove_item, change_cart_item_quantity, shift_cart_item_quantity, new_order
+from . import data
+from .catalog import catalog
+from .customers import CustomerMiddleware, customer_cache, registered
+from .db import warm_up_database
+from .inline import inline_results, results_page
+from .keyboards import MAIN_MENU, ADMIN_KEYBOARD, DELIVERY_MENU, ORDER_MENU, CART_ACTIONS, BACK_TO_CATEGORIES, \
+    NEW_SEARCH, categories_keyboard, products_keyboard, product_keyboard, build_orders_navigation, \
+    parse_order_cursor, search_results_keyboard
+from .media import send_product_photo
+from .models import Customer, Product, Cart
+from .sender import Outbox, OutboxMiddleware, ThrottlingRequestMiddleware
+from .states import CartStates, ClearInputOnCallbackMiddleware, SearchStates
+from .storage import build_storage
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 django.setup()
 
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
 
 class DjangoBot:
     def __init__(self):
-        self.bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-        self.dp = Dispatcher()
+        self.throttle = ThrottlingRequestMiddleware(
+            global_rate=settings.TELEGRAM_GLOBAL_RATE,
+            chat_rate=settings.TELEGRAM_CHAT_RATE,
+            chat_burst=settings.TELEGRAM_CHAT_BURST,
+        )
+        self.bot = self.create_bot()
+        self.dp = Dispatcher(storage=build_storage())
+        self.dp.update.outer_middleware(OutboxMiddleware())
+        self.dp.update.outer_middleware(CustomerMiddleware(customer_cache))
+        self.dp.callback_query.middleware(ClearInputOnCallbackMiddleware())
         self.setup_handlers()
 
+    def create_bot(self):
+        """Экземпляр Bot со своей HTTP-сессией и общими ограничителями частоты
+
+        Сессия aiohttp привязана к циклу событий: обработке в отдельном цикле
+        (WSGI-вебхук) нужен свой экземпляр, общий self.bot принадлежит циклу ASGI-сервера.
+        """
+        bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+        bot.session.middleware(self.throttle)
+        return bot
+
     def get_inline_menu(self):
         """Inline меню"""
-        return InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="🛒 Корзина", callback_data="cart")],
-                [InlineKeyboardButton(text="👤 Профиль", callback_data="profile")],
-                [InlineKeyboardButton(text="📦 Мои заказы", callback_data="orders")],
-                [InlineKeyboardButton(text='🗒️ Категории товаров', callback_data="categories")],
-            ]
-        )
+        return MAIN_MENU
+
+    def get_cart_view(self, cart_data, total_items, total_price):
+        """Корзина одним сообщением: текст и компактная клавиатура по товарам"""
+        if not cart_data:
+            return '🛒 Ваша корзина пуста', None
+
+        lines = ['🛒 Ваша корзина:', '']
+        buttons = []
+        for number, item in enumerate(cart_data, start=1):
+            product_id = item['product__id']
+            lines.append(f"{number}. {item['product__title']} - {item['product__price']} ₽ | {item['quantity']} шт.")
+            buttons.append([
+                InlineKeyboardButton(text='➖', callback_data=f'cart_dec_{product_id}'),
+                InlineKeyboardButton(text=f'✏️ {number}. {item["quantity"]} шт.',
+                                     callback_data=f'change_quantity_{product_id}'),
+                InlineKeyboardButton(text='➕', callback_data=f'cart_inc_{product_id}'),
+                InlineKeyboardButton(text='🗑️', callback_data=f'remove_from_cart_{product_id}'),
+            ])
+        lines += ['', f'Всего товаров: {total_items}, Сумма: {total_price} ₽']
+
+        buttons += CART_ACTIONS
+        return '\n'.join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
+    def get_orders_view(self, orders, has_older, has_newer):
+        """Страница заказов одним сообщением: текст, кнопки отмены и перехода между страницами"""
+        blocks = []
+        buttons = []
+        for order in orders:
+            blocks.append(f"""📦 *Заказ №{order.order_number}*
+🏠 Адрес: {order.address}
+🚚 Способ доставки: {order.get_delivery_method_display()}
+🛍️ Товаров: {order.total_items} шт.
+💰 Сумма: {order.total_price} ₽
+🛃 Статус: {order.get_order_status()}""")
+            if order.status == 'pending' and not order.is_confirmed:
+                buttons.append([InlineKeyboardButton(text=f'❌ Отменить заказ №{order.order_number}',
+                                                     callback_data=f'cancel_{order.id}')])
+
+        buttons += build_orders_navigation(orders, has_older, has_newer)
+        return '\n\n'.join(blocks), InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+
+    def get_search_retry(self):
+        """Кнопки после пустого результата поиска"""
+        return InlineKeyboardMarkup(inline_keyboard=[NEW_SEARCH, BACK_TO_CATEGORIES])
 
     def get_admin_keyboard(self):
         """Клавиатура администратора"""
-        return ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="📦 Управление заказами"), KeyboardButton(text="🛍️ Управление товарами")],
-                [KeyboardButton(text="🔙 Выйти из админки")]
-            ],
-            resize_keyboard=True
-        )
+        return ADMIN_KEYBOARD
 
     async def set_bot_commands(self):
         """Установка команд меню бота"""
         commands = [
             BotCommand(command="start", description="Запустить бота"),
             BotCommand(command="menu", description="Показать главное меню"),
+            BotCommand(command="search", description="Поиск товаров"),
         ]
         await self.bot.set_my_commands(commands)
 
     def setup_handlers(self):
+        async def render_cart(customer):
+            """Текст и клавиатура корзины пользователя"""
+            cart_data, total_items, total_price = await get_cart_data(customer)
+            return self.get_cart_view(cart_data, total_items, total_price)
+
+        async def edit_cart(customer, chat_id, message_id):
+            """Обновление сообщения с корзиной на месте"""
+            text, cart_menu = await render_cart(customer)
+            try:
+                await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=cart_menu)
+            except TelegramBadRequest as e:
+                # Корзина не изменилась - редактировать нечего
+                if 'message is not modified' not in str(e):
+                    raise
+
+        async def refresh_cart(callback: types.CallbackQuery, customer):
+            """Обновление корзины, из которой пришел callback"""
+            await edit_cart(customer, callback.message.chat.id, callback.message.message_id)
+
         @self.dp.message(Command("start"))
-        async def cmd_start(message: types.Message):
+        async def cmd_start(message: types.Message, outbox: Outbox):
             """Обработчик команды /start с сохранением в модель Customer"""
             user = message.from_user
             welcome_text = await get_welcome_text(user)
 
             if welcome_text.startswith('С возвращением'):
-                await message.answer(welcome_text, reply_markup=self.get_inline_menu())
+                await outbox.answer(welcome_text, reply_markup=self.get_inline_menu())
             else:
-                await message.answer(welcome_text)
+                await outbox.answer(welcome_text)
 
         @self.dp.message(Command("menu"))
-        async def cmd_menu(message: types.Message):
+        async def cmd_menu(message: types.Message, outbox: Outbox):
             """Показать главное меню"""
             menu_text = f"""
 Выберите действие:
                 """
-            await message.answer(menu_text, reply_markup=self.get_inline_menu())
+            await outbox.answer(menu_text, reply_markup=self.get_inline_menu())
+
+        @self.dp.message(CartStates.waiting_quantity, F.text.isdigit())
+        async def set_new_quantity(message: types.Message, customer: Customer | None, state: FSMContext,
+                                   outbox: Outbox):
+            """Новое количество товара, запрошенное change_quantity"""
+            quantity = int(message.text)
+            if quantity <= 0:
+                await outbox.answer('❌ Количество должно быть больше 0')
+                return
+
+            data = await state.get_data()
+            await state.clear()
+            try:
+                customer = registered(customer)
+                message_text = await change_cart_item_quantity(customer, data['product_id'], quantity)
+                await outbox.answer(message_text)
+                await edit_cart(customer, data['chat_id'], data['message_id'])
+            except Exception:
+                logger.exception("Ошибка при изменении количества")
+                await outbox.answer('❌ Ошибка при изменении количества')
+
+        # Команды (/search и другие) не считаются ответом на вопрос о количестве
+        @self.dp.message(CartStates.waiting_quantity, ~F.text.startswith('/'))
+        async def invalid_quantity(message: types.Message, outbox: Outbox):
+            """Ввод, не являющийся количеством"""
+            await outbox.answer('❌ Введите количество числом')
+
+        async def answer_search(text, outbox: Outbox):
+            """Результаты поиска товаров одним сообщением"""
+            products = await data.search_products(text, limit=settings.SEARCH_RESULTS_LIMIT)
+            if not products:
+                await outbox.answer(f'🔍 По запросу «{text}» ничего не найдено', reply_markup=self.get_search_retry())
+                return
+            await outbox.answer(f'🔍 Найдено по запросу «{text}»:', reply_markup=search_results_keyboard(products))
+
+        @self.dp.message(Command("search"))
+        async def cmd_search(message: types.Message, command: CommandObject, state: FSMContext, outbox: Outbox):
+            """Поиск товаров: /search <запрос> или запрос следующим сообщением"""
+            if command.args:
+                await state.clear()
+                await answer_search(command.args.strip(), outbox)
+                return
+            await state.set_state(SearchStates.waiting_query)
+            await outbox.answer('🔍 Введите название или описание товара')
+
+        @self.dp.message(SearchStates.waiting_query, F.text)
+        async def process_search_query(message: types.Message, state: FSMContext, outbox: Outbox):
+            """Свободный текст в режиме поиска"""
+            await state.clear()
+            try:
+                await answer_search(message.text.strip(), outbox)
+            except Exception:
+                logger.exception("Ошибка поиска")
+                await outbox.answer("❌ Ошибка поиска товаров")
 
-        @self.dp.message(F.text.regexp(r'^\+?[0-9]{10,15}$'))
-        async def process_phone(message: types.Message):
+        @self.dp.message(StateFilter(None), F.text.regexp(r'^\+?[0-9]{10,15}$'))
+        async def process_phone(message: types.Message, outbox: Outbox):
             """Обработка номера телефона"""
             user = message.from_user
             phone = message.text.strip()
             answer_text = await update_phone(user, phone)
-            await message.answer(answer_text)
+            await outbox.answer(answer_text)
 
-        @self.dp.message(F.text.len() > 5)
-        async def process_address(message: types.Message):
+        @self.dp.message(StateFilter(None), F.text.len() > 5)
+        async def process_address(message: types.Message, outbox: Outbox):
             """Обработка адреса"""
             # Проверяем, что это не команда и не другой текст
             if message.text.startswith('/') or any(
@@ -89,124 +228,137 @@ class DjangoBot:
             user = message.from_user
             address = message.text.strip()
             answer_text = await update_address(user, address)
-            await message.answer(answer_text)
+            await outbox.answer(answer_text)
             if answer_text.startswith("Регистрация завершена!"):
-                await message.answer("Выберите действие:", reply_markup=self.get_inline_menu())
+                await outbox.answer("Выберите действие:", reply_markup=self.get_inline_menu())
                 await self.set_bot_commands()
 
         @self.dp.callback_query(F.data == "profile")
-        async def cmd_profile(callback: types.CallbackQuery):
+        async def cmd_profile(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             """Показать профиль заказчика"""
             try:
-                customer = await sync_to_async(Customer.objects.get)(telegram_id=str(callback.from_user.id))
+                customer = registered(customer)
                 profile_info = await get_profile(customer)
                 await callback.answer()
-                await callback.message.answer(profile_info, parse_mode="Markdown")
+                await outbox.answer(profile_info, parse_mode="Markdown")
             except Customer.DoesNotExist:
                 await callback.answer("❌ Вы не зарегистрированы. Используйте /start")
 
+        @self.dp.inline_query()
+        async def inline_catalog(inline_query: types.InlineQuery):
+            """Inline-режим: @бот <запрос> возвращает карточки товаров страницами по offset"""
+            try:
+                results = await inline_results(inline_query.query)
+                page, next_offset = results_page(results, inline_query.offset, settings.INLINE_PAGE_SIZE)
+                await inline_query.answer(page, cache_time=settings.INLINE_CACHE_TIME, is_personal=False,
+                                          next_offset=next_offset)
+            except Exception:
+                logger.exception("Ошибка inline-запроса")
+                await inline_query.answer([], cache_time=0)
+
+        @self.dp.callback_query(F.data == "search")
+        async def start_search(callback: types.CallbackQuery, state: FSMContext, outbox: Outbox):
+            """Переход в режим поиска: следующее сообщение считается запросом"""
+            await state.set_state(SearchStates.waiting_query)
+            await callback.answer()
+            await outbox.answer('🔍 Введите название или описание товара')
+
         @self.dp.callback_query(F.data == "categories")
-        async def send_categories_list(callback: types.CallbackQuery):
+        async def send_categories_list(callback: types.CallbackQuery, outbox: Outbox):
             try:
-                categories = await sync_to_async(list)(Category.objects.all())
+                categories = await catalog.categories()
                 if not categories:
-                    await callback.message.answer("📭 Категории не найдены")
+                    await outbox.answer("📭 Категории не найдены")
                     await callback.answer()
                     return
 
-                categories_buttons = []
-                for category in categories:
-                    categories_buttons.append([
-                        InlineKeyboardButton(
-                            text=category.title,
-                            callback_data='category_' + str(category.id)
-                        )
-                    ])
-
-                categories_menu = InlineKeyboardMarkup(inline_keyboard=categories_buttons)
+                categories_menu = categories_keyboard(categories, catalog.generation)
                 await callback.answer()
-                await callback.message.answer("🗂️ Категории:", reply_markup=categories_menu)
+                await outbox.answer("🗂️ Категории:", reply_markup=categories_menu)
 
             except Exception as e:
                 print(f"Ошибка: {e}")
                 await callback.answer()
-                await callback.message.answer("❌ Ошибка загрузки категорий")
+                await outbox.answer("❌ Ошибка загрузки категорий")
+
+        def products_page_view(category_id, products, start, total):
+            """Текст и клавиатура страницы товаров категории"""
+            text = "📚 Товары:"
+            if len(products) < total:
+                text = f"📚 Товары {start + 1}–{start + len(products)} из {total}:"
+            return text, products_keyboard(category_id, products, start, total, catalog.generation)
 
         @self.dp.callback_query(F.data.startswith("category_"))
-        async def get_products_in_category(callback: types.CallbackQuery):
+        async def get_products_in_category(callback: types.CallbackQuery, outbox: Outbox):
             try:
-                category_id = callback.data.replace('category_', '')
-                products = await sync_to_async(list)(
-                    Product.objects.filter(category_id=category_id).values('id', 'title')
-                )
+                category_id = int(callback.data.replace('category_', ''))
+                products, start, total = await catalog.products_page(category_id, limit=settings.CATALOG_PAGE_SIZE)
                 if not products:
-                    await callback.message.answer("Товары в категории не найдены")
+                    await outbox.answer("Товары в категории не найдены")
                     return
 
-                products_buttons = []
-                for product in products:
-                    products_buttons.append([
-                        InlineKeyboardButton(
-                            text=product['title'],
-                            callback_data='product_' + str(product['id'])
-                        )
-                    ])
+                text, products_menu = products_page_view(category_id, products, start, total)
+                await callback.answer()
+                await outbox.answer(text, reply_markup=products_menu)
 
-                products_buttons.append([
-                    InlineKeyboardButton(
-                        text="⬅️ Назад к категориям",
-                        callback_data="categories"
-                    )
-                ])
-                products_menu = InlineKeyboardMarkup(inline_keyboard=products_buttons)
+            except Exception:
+                logger.exception("Ошибка при загрузке товаров категории")
+                await callback.answer()
+                await outbox.answer("❌ Ошибка загрузки товаров")
+
+        @self.dp.callback_query(F.data.startswith("cat_"))
+        async def page_products(callback: types.CallbackQuery, outbox: Outbox):
+            """Переход к соседней странице товаров с редактированием сообщения на месте"""
+            try:
+                _, category_id, direction, cursor = callback.data.split('_')
+                category_id = int(category_id)
+                products, start, total = await catalog.products_page(
+                    category_id, int(cursor), before=direction == 'prev', limit=settings.CATALOG_PAGE_SIZE)
+                if not products:
+                    await callback.answer("Товары в категории не найдены")
+                    return
+
+                text, products_menu = products_page_view(category_id, products, start, total)
+                await callback.message.edit_text(text, reply_markup=products_menu)
                 await callback.answer()
-                await callback.message.answer("📚 Товары:", reply_markup=products_menu)
 
             except Exception as e:
                 print(f"Ошибка: {e}")
                 await callback.answer()
-                await callback.message.answer("❌ Ошибка загрузки товаров")
+                await outbox.answer("❌ Ошибка загрузки товаров")
 
         @self.dp.callback_query(F.data.startswith("product_"))
-        async def get_product_info(callback: types.CallbackQuery):
+        async def get_product_info(callback: types.CallbackQuery, outbox: Outbox):
             try:
-                product_id = callback.data.replace('product_', '')
-                product = await sync_to_async(Product.objects.get)(id=product_id)
+                product_id = int(callback.data.replace('product_', ''))
+                product = await catalog.product(product_id)
+                if product is None:
+                    raise Product.DoesNotExist
 
-                category_id = await sync_to_async(lambda: product.category.id)()
+                product_menu = product_keyboard(product.id, product.category_id)
 
-                product_menu = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text='🛒 Добавить в корзину', callback_data=f'to_cart_{product.id}')],
-                    [InlineKeyboardButton(text='⬅️ Назад к товарам', callback_data=f'category_{category_id}')]
-                ])
-
-                caption = f"""
-📦 *{product.title}*
-💰 Цена: {product.price} ₽
-📝 {product.description or 'Описание отсутствует'}
-                """
+                caption = catalog.caption(product)
 
                 if product.image:
                     try:
-                        from aiogram.types import FSInputFile
-                        photo = FSInputFile(product.image.path)
                         await callback.answer()
-                        await callback.message.answer_photo(
-                            photo=photo,
+                        await send_product_photo(
+                            outbox.answer_photo,
+                            product,
                             caption=caption,
                             parse_mode="Markdown",
                             reply_markup=product_menu
                         )
                     except Exception as e:
                         print(f"Ошибка загрузки изображения: {e}")
-                        await callback.message.answer(
+                        await outbox.answer(
                             caption,
                             parse_mode="Markdown",
                             reply_markup=product_menu
                         )
                 else:
                     await callback.answer()
-                    await callback.message.answer(
+                    await outbox.answer(
                         caption,
                         parse_mode="Markdown",
                         reply_markup=product_menu
@@ -214,305 +366,246 @@ class DjangoBot:
 
             except Product.DoesNotExist:
                 await callback.answer()
-                await callback.message.answer("❌ Товар не найден")
+                await outbox.answer("❌ Товар не найден")
             except Exception as e:
                 print(f"Ошибка: {e}")
                 await callback.answer()
-                await callback.message.answer("❌ Ошибка загрузки информации о товаре")
+                await outbox.answer("❌ Ошибка загрузки информации о товаре")
 
         @self.dp.callback_query(F.data.startswith('to_cart_'))
-        async def add_to_cart(callback: types.CallbackQuery):
+        async def add_to_cart(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             try:
-                customer = await sync_to_async(Customer.objects.get)(telegram_id=str(callback.from_user.id))
-                cart, created = await sync_to_async(Cart.objects.get_or_create)(customer=customer)
-
+                customer = registered(customer)
                 product_id = callback.data.replace('to_cart_', '')
-                message = await add_item_in_cart(cart, product_id)
+                message = await add_item_in_cart(customer, product_id)
                 await callback.answer()
-                await callback.message.answer(message)
+                await outbox.answer(message)
 
             except Customer.DoesNotExist:
-                await callback.message.answer('❌ Сначала зарегистрируйтесь с помощью /start')
+                await outbox.answer('❌ Сначала зарегистрируйтесь с помощью /start')
             except Product.DoesNotExist:
-                await callback.message.answer('❌ Товар не найден')
+                await outbox.answer('❌ Товар не найден')
             except Exception as e:
                 print(f'Ошибка: {e}')
-                await callback.message.answer('❌ Ошибка при добавлении товара в корзину')
+                await outbox.answer('❌ Ошибка при добавлении товара в корзину')
 
         @self.dp.callback_query(F.data == 'cart')
-        async def get_cart(callback: types.CallbackQuery):
+        async def get_cart(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             try:
-                customer = await sync_to_async(Customer.objects.get)(telegram_id=str(callback.from_user.id))
-                cart_data, total_items, total_price = await get_cart_data(customer)
-
-                if not cart_data:
-                    await callback.message.answer('🛒 Ваша корзина пуста')
-                    await callback.answer()
-                    return
-
-                await callback.message.answer('🛒 Ваша корзина:\n')
-                for item in cart_data:
-                    cart_item_menu = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text='✏️ Изменить количество',
-                                              callback_data=f'change_quantity_{item["product__id"]}')],
-                        [InlineKeyboardButton(text='🗑️ Убрать из корзины',
-                                              callback_data=f'remove_from_cart_{item["product__id"]}')]
-                    ])
-                    await callback.message.answer(f"{item['product__title']} - "
-                                                  f"{item['product__price']} ₽ | {item['quantity']} шт.\n",
-                                                  reply_markup=cart_item_menu, parse_mode="Markdown")
-
-                total_text = f'Всего товаров: {total_items}, Сумма: {total_price} ₽'
-
-                cart_menu = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text='🗑️ Очистить корзину',
-                                          callback_data='clear_cart')],
-                    [InlineKeyboardButton(text='📦 Оформить заказ',
-                                          callback_data='take_order')]
-                ])
-
+                text, cart_menu = await render_cart(registered(customer))
                 await callback.answer()
-                await callback.message.answer(total_text, parse_mode="Markdown")
-                await callback.message.answer('Выберите действие:', parse_mode="Markdown", reply_markup=cart_menu)
+                await outbox.answer(text, reply_markup=cart_menu)
 
-            except Cart.DoesNotExist:
-                await callback.answer()
-                await callback.message.answer('Корзина пуста')
+            except Customer.DoesNotExist:
+                await callback.answer('❌ Сначала зарегистрируйтесь с помощью /start')
             except Exception as e:
                 print(f'Ошибка: {e}')
                 await callback.answer()
-                await callback.message.answer('❌ Ошибка при открытии корзины')
+                await outbox.answer('❌ Ошибка при открытии корзины')
 
         @self.dp.callback_query(F.data.startswith('remove_from_cart_'))
-        async def remove_cart_item(callback: types.CallbackQuery):
+        async def remove_cart_item(callback: types.CallbackQuery, customer: Customer | None):
             try:
-                customer = await sync_to_async(Customer.objects.get)(telegram_id=str(callback.from_user.id))
+                customer = registered(customer)
                 item_id = callback.data.replace('remove_from_cart_', '')
                 text_message = await remove_item(customer, item_id)
-                await callback.message.answer(text_message, parse_mode="Markdown")
-                await get_cart(callback)
+                await callback.answer(text_message)
+                await refresh_cart(callback, customer)
             except Exception as e:
                 print(f'Ошибка: {e}')
-                await callback.message.answer('❌ Ошибка при удалении товара')
-            finally:
-                await callback.answer()
+                await callback.answer('❌ Ошибка при удалении товара')
+
+        @self.dp.callback_query(F.data.startswith('cart_inc_') | F.data.startswith('cart_dec_'))
+        async def shift_quantity(callback: types.CallbackQuery, customer: Customer | None):
+            try:
+                customer = registered(customer)
+                delta = 1 if callback.data.startswith('cart_inc_') else -1
+                item_id = callback.data[len('cart_inc_'):]
+                text_message = await shift_cart_item_quantity(customer, item_id, delta)
+                await callback.answer(text_message)
+                await refresh_cart(callback, customer)
+            except Exception:
+                logger.exception("Ошибка при изменении количества")
+                await callback.answer('❌ Ошибка при изменении количества')
 
         @self.dp.callback_query(F.data.startswith('change_quantity_'))
-        async def change_quantity(callback: types.CallbackQuery):
+        async def change_quantity(callback: types.CallbackQuery, state: FSMContext, outbox: Outbox):
+            """Запрос нового количества: ввод обрабатывает set_new_quantity"""
             item_id = callback.data.replace('change_quantity_', '')
-            await callback.message.answer('Введите количество товара:')
-
-            # Временный обработчик для ввода количества
-            @self.dp.message(F.text.isdigit())
-            async def set_new_quantity(message: types.Message):
-                quantity = int(message.text)
-                if quantity <= 0:
-                    await message.answer('❌ Количество должно быть больше 0')
-                    return
-
-                try:
-                    customer = await sync_to_async(Customer.objects.get)(telegram_id=str(callback.from_user.id))
-                    message_text = await change_cart_item_quantity(customer, item_id, quantity)
-                    await message.answer(message_text, parse_mode="Markdown")
-                    await get_cart(callback)
-                except Exception as e:
-                    await message.answer('❌ Ошибка при изменении количества')
-
-                # Удаляем временный обработчик
-                self.dp.message.handlers = [h for h in self.dp.message.handlers if h.callback != set_new_quantity]
-
+            await state.set_state(CartStates.waiting_quantity)
+            await state.set_data({
+                'product_id': item_id,
+                'chat_id': callback.message.chat.id,
+                'message_id': callback.message.message_id,
+            })
+            await outbox.answer('Введите количество товара:')
             await callback.answer()
 
         @self.dp.callback_query(F.data == 'take_order')
-        async def take_order(callback: types.CallbackQuery):
+        async def take_order(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             try:
-                # Создаем клавиатуру с методами доставки
-                delivery_method_list = []
-                for delivery_method in Order.DELIVERY_METHOD_CHOICES:
-                    delivery_method_list.append([
-                        InlineKeyboardButton(
-                            text=delivery_method[1],
-                            callback_data=f"delivery_{delivery_method[0]}"
-                        )
-                    ])
-
-                delivery_method_menu = InlineKeyboardMarkup(inline_keyboard=delivery_method_list)
-
                 # Получаем данные пользователя
-                customer = await sync_to_async(Customer.objects.get)(
-                    telegram_id=str(callback.from_user.id)
-                )
-                cart = await sync_to_async(Cart.objects.get)(customer=customer)
+                customer = registered(customer)
+                if not await data.has_cart(customer):
+                    raise Cart.DoesNotExist
 
                 await callback.answer()
-                await callback.message.answer(
+                await outbox.answer(
                     'Выберите способ доставки:',
-                    reply_markup=delivery_method_menu,
+                    reply_markup=DELIVERY_MENU,
                     parse_mode="Markdown"
                 )
 
             except Cart.DoesNotExist as e:
                 print(f'⚠️ Ошибка: {e}')
                 await callback.answer()
-                await callback.message.answer('❌ Корзина пуста')
+                await outbox.answer('❌ Корзина пуста')
             except Customer.DoesNotExist as e:
                 print(f'⚠️ Ошибка: {e}')
                 await callback.answer()
-                await callback.message.answer('❌ Сначала зарегистрируйтесь с помощью /start')
+                await outbox.answer('❌ Сначала зарегистрируйтесь с помощью /start')
             except Exception as e:
                 print(f'⚠️ Ошибка: {e}')
                 await callback.answer()
-                await callback.message.answer('❌ Ошибка при создании заказа')
+                await outbox.answer('❌ Ошибка при создании заказа')
 
         @self.dp.callback_query(F.data.startswith('delivery_'))
-        async def create_order(callback: types.CallbackQuery):
+        async def create_order(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             try:
                 # Извлекаем метод доставки из callback_data
                 delivery_method = callback.data.replace('delivery_', '')
 
                 # Получаем данные пользователя
-                customer = await sync_to_async(Customer.objects.get)(
-                    telegram_id=str(callback.from_user.id)
-                )
-                cart = await sync_to_async(Cart.objects.get)(customer=customer)
-
-                order_message = await new_order(customer, cart, delivery_method)
-
-                order_menu = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text='✅ Подтвердить', callback_data='confirm_order')],
-                    [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_order')]
-                ])
+                customer = registered(customer)
+                order_message = await new_order(customer, delivery_method)
 
                 await callback.answer()
-                await callback.message.answer(order_message, reply_markup=order_menu, parse_mode="Markdown")
+                await outbox.answer(order_message, reply_markup=ORDER_MENU, parse_mode="Markdown")
 
             except Exception as e:
                 print(f'⚠️ Ошибка в create_order: {e}')
                 await callback.answer()
-                await callback.message.answer('❌ Ошибка при создании заказа')
+                await outbox.answer('❌ Ошибка при создании заказа')
 
         @self.dp.callback_query(F.data == 'confirm_order')
-        async def confirm_order(callback: types.CallbackQuery):
+        async def confirm_order(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             try:
-                customer = await sync_to_async(Customer.objects.get)(telegram_id=str(callback.from_user.id))
-                order = await sync_to_async(Order.objects.filter(customer=customer).latest)('order_date_time')
-                order.is_confirmed = True
-                order.status = 'pending'
-                await sync_to_async(order.save)()
-
-                # Очищаем корзину
-                cart = await sync_to_async(Cart.objects.get)(customer=customer)
-                await sync_to_async(cart.items.all().delete)()
+                customer = registered(customer)
+                # Подтверждение заказа и очистка корзины
+                result = await data.confirm_latest_order(customer)
+                if result != 'confirmed':
+                    await callback.answer()
+                    await outbox.answer({
+                        'expired': '❌ Время резерва истекло, оформите заказ заново',
+                        'already_confirmed': 'ℹ️ Заказ уже подтвержден',
+                        'cancelled': '❌ Заказ отменен, оформите заказ заново',
+                    }[result])
+                    return
 
                 await callback.answer()
-                await callback.message.answer('✅ Заказ подтвержден и передан в обработку', parse_mode="Markdown")
+                await outbox.answer('✅ Заказ подтвержден и передан в обработку', parse_mode="Markdown")
 
             except Exception as e:
                 print(f'Ошибка: {e}')
-                await callback.message.answer('❌ Ошибка при подтверждении заказа')
+                await outbox.answer('❌ Ошибка при подтверждении заказа')
 
         @self.dp.callback_query(F.data == 'cancel_order')
-        async def cancel_order(callback: types.CallbackQuery):
+        async def cancel_order(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             try:
-                customer = await sync_to_async(Customer.objects.get)(telegram_id=str(callback.from_user.id))
-                order = await sync_to_async(Order.objects.filter(customer=customer).latest)('order_date_time')
-                order.status = 'cancelled'
-                await sync_to_async(order.save)()
+                customer = registered(customer)
+                await data.cancel_latest_order(customer)
 
                 await callback.answer()
-                await callback.message.answer('❌ Заказ отменен', parse_mode="Markdown")
+                await outbox.answer('❌ Заказ отменен', parse_mode="Markdown")
 
             except Exception as e:
                 print(f'Ошибка: {e}')
-                await callback.message.answer('❌ Ошибка при отмене заказа')
+                await outbox.answer('❌ Ошибка при отмене заказа')
 
         @self.dp.callback_query(F.data == 'clear_cart')
-        async def clear_cart(callback: types.CallbackQuery):
+        async def clear_cart(callback: types.CallbackQuery, customer: Customer | None):
             try:
-                customer = await sync_to_async(Customer.objects.get)(telegram_id=str(callback.from_user.id))
-                cart = await sync_to_async(Cart.objects.get)(customer=customer)
-                await sync_to_async(cart.items.all().delete)()
+                customer = registered(customer)
+                await data.clear_cart(customer)
 
-                await callback.answer()
-                await callback.message.answer('✅ Корзина очищена', parse_mode="Markdown")
+                await callback.answer('✅ Корзина очищена')
+                await refresh_cart(callback, customer)
 
             except Exception as e:
                 print(f'Ошибка: {e}')
-                await callback.message.answer('❌ Ошибка при очистке корзины')
+                await callback.answer('❌ Ошибка при очистке корзины')
 
         @self.dp.callback_query(F.data == 'orders')
-        async def show_orders(callback: types.CallbackQuery):
+        async def show_orders(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             try:
-                customer = await sync_to_async(Customer.objects.get)(
-                    telegram_id=str(callback.from_user.id)
-                )
+                customer = registered(customer)
 
-                orders = await sync_to_async(list)(
-                    Order.objects.filter(customer=customer)
-                    .select_related('customer')
-                    .prefetch_related('items__product')
-                    .order_by('-order_date_time')
-                )
+                orders, has_older, has_newer = await data.customer_orders_page(
+                    customer, limit=settings.ORDERS_PAGE_SIZE)
 
                 if not orders:
-                    await callback.message.answer("📭 У вас пока нет заказов")
+                    await outbox.answer("📭 У вас пока нет заказов")
                     await callback.answer()
                     return
 
-                for order in orders:
-                    delivery_method = await sync_to_async(order.get_delivery_method_display)()
-                    status = await sync_to_async(order.get_order_status)()
+                text, orders_menu = self.get_orders_view(orders, has_older, has_newer)
+                await outbox.answer(text, reply_markup=orders_menu, parse_mode="Markdown")
+                await callback.answer()
 
-                    order_info = f"""
-📦 *Заказ №{order.order_number}*
+            except Customer.DoesNotExist:
+                await outbox.answer("❌ Сначала зарегистрируйтесь с помощью /start")
+                await callback.answer()
+            except Exception:
+                logger.exception("Ошибка при загрузке заказов")
+                await outbox.answer("❌ Ошибка при загрузке заказов")
+                await callback.answer()
 
-🏠 Адрес: {order.address}
-🚚 Способ доставки: {delivery_method}
-🛍️ Товаров: {order.total_items} шт.
-💰 Сумма: {order.total_price} ₽
-🛃 Статус: {status}
-                    """
+        @self.dp.callback_query(F.data.startswith('orders_older_') | F.data.startswith('orders_newer_'))
+        async def page_orders(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
+            """Переход к соседней странице заказов с редактированием сообщения на месте"""
+            try:
+                customer = registered(customer)
+                direction, cursor = callback.data.removeprefix('orders_').split('_', 1)
 
-                    if order.status == 'pending' and not order.is_confirmed:
-                        order_menu = InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text='❌ Отменить заказ', callback_data=f'cancel_{order.id}')],
-                        ])
-                        await callback.message.answer(order_info, reply_markup=order_menu, parse_mode="Markdown")
-                    else:
-                        await callback.message.answer(order_info, parse_mode="Markdown")
+                orders, has_older, has_newer = await data.customer_orders_page(
+                    customer, parse_order_cursor(cursor), newer=direction == 'newer',
+                    limit=settings.ORDERS_PAGE_SIZE)
 
+                if not orders:
+                    await callback.answer("📭 Больше заказов нет")
+                    return
+
+                text, orders_menu = self.get_orders_view(orders, has_older, has_newer)
+                await callback.message.edit_text(text, reply_markup=orders_menu, parse_mode="Markdown")
                 await callback.answer()
 
             except Customer.DoesNotExist:
-                await callback.message.answer("❌ Сначала зарегистрируйтесь с помощью /start")
+                await outbox.answer("❌ Сначала зарегистрируйтесь с помощью /start")
                 await callback.answer()
             except Exception as e:
                 print(f"Ошибка при загрузке заказов: {e}")
-                await callback.message.answer("❌ Ошибка при загрузке заказов")
+                await outbox.answer("❌ Ошибка при загрузке заказов")
                 await callback.answer()
 
         @self.dp.callback_query(F.data.startswith('cancel_'))
-        async def cancel_user_order(callback: types.CallbackQuery):
+        async def cancel_user_order(callback: types.CallbackQuery, customer: Customer | None, outbox: Outbox):
             try:
                 order_id = callback.data.replace('cancel_', '')
-                order = await sync_to_async(Order.objects.get)(id=order_id)
-
-                if order.customer.telegram_id != str(callback.from_user.id):
+                if not await data.cancel_customer_order(customer, order_id):
                     await callback.answer("❌ Нельзя отменить чужой заказ")
                     return
 
-                order.status = 'cancelled'
-                await sync_to_async(order.save)()
                 await callback.answer()
-                await callback.message.answer('✅ Заказ отменен', parse_mode="Markdown")
+                await outbox.answer('✅ Заказ отменен', parse_mode="Markdown")
 
             except Exception as e:
                 print(f'Ошибка: {e}')
-                await callback.message.answer('❌ Ошибка при отмене заказа')
+                await outbox.answer('❌ Ошибка при отмене заказа')
 
 
     async def start_polling(self):
         """Запуск бота в режиме polling"""
         print("🤖 Telegram бот запущен")
+        await warm_up_database()
         await self.set_bot_commands()
         await self.dp.start_polling(self.bot)
\ No newline at end of file
@@ -1,8 +1,9 @@
 # bot_utils.py (обновленный)
 import logging
-from asgiref.sync import sync_to_async
-from bot.models import Customer, Product, CartItem, Cart, OrderItem, Order
-from bot.services import order_number_generator
+from bot import data
+from bot.catalog import catalog
+from bot.inventory import OutOfStock
+from bot.models import Customer, Product, Cart
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -11,7 +12,7 @@ async def get_welcome_text(user) -> str:
     """Получение приветственного текста в зависимости от статуса пользователя"""
     try:
         logger.info(f"Получение приветственного текста для пользователя {user.id}")
-        customer = await sync_to_async(Customer.objects.get)(telegram_id=str(user.id))
+        customer = await data.get_customer(user.id)
         welcome_text = f"""С возвращением, {customer.first_name}!
 ✅ Вы уже зарегистрированы в системе как заказчик.
 📞 Телефон: {customer.phone}
@@ -36,27 +37,14 @@ async def update_phone(user, phone) -> str:
     try:
         logger.info(f"Обновление телефона для пользователя {user.id}: {phone}")
 
-        # Проверяем, не занят ли телефон другим пользователем
-        phone_exists = await sync_to_async(
-            lambda: Customer.objects.filter(phone=phone).exclude(telegram_id=str(user.id)).exists()
-        )()
+        # Проверка занятости телефона и создание пользователя за один переход
+        registration = await data.register_phone(user, phone)
 
-        if phone_exists:
+        if registration is None:
             logger.warning(f"Телефон {phone} уже используется другим пользователем")
             return "❌ Этот номер телефона уже используется другим пользователем."
 
-        # Создаем или получаем пользователя
-        customer, created = await sync_to_async(
-            lambda: Customer.objects.get_or_create(
-                telegram_id=str(user.id),
-                defaults={
-                    'first_name': user.first_name or 'Неизвестно',
-                    'last_name': user.last_name or 'Неизвестно',
-                    'phone': phone,
-                    'address': 'Не указан'
-                }
-            )
-        )()
+        customer, created = registration
 
         if created:
             logger.info(f"Создан новый клиент: {customer.first_name} {customer.last_name}")
@@ -78,9 +66,7 @@ async def update_address(user, address) -> str:
     """Обновление адреса пользователя"""
     try:
         logger.info(f"Обновление адреса для пользователя {user.id}: {address}")
-        customer = await sync_to_async(Customer.objects.get)(telegram_id=str(user.id))
-        customer.address = address
-        await sync_to_async(customer.save)()
+        customer = await data.save_address(user.id, address)
 
         logger.info(f"Адрес успешно обновлен для пользователя {user.id}")
         success_text = f"""
@@ -111,26 +97,18 @@ async def get_profile(customer):
 """
     return profile_info
 
-async def add_item_in_cart(cart, product_id):
+async def add_item_in_cart(customer, product_id):
     """Добавление товара в корзину"""
     try:
-        logger.info(f"Добавление товара {product_id} в корзину {cart.id}")
-        product = await sync_to_async(Product.objects.get)(id=product_id)
+        logger.info(f"Добавление товара {product_id} в корзину клиента {customer.id}")
+        product, created = await data.add_to_cart(customer, product_id)
 
-        cart_item_exists = await sync_to_async(
-            lambda: CartItem.objects.filter(cart=cart, product=product).exists()
-        )()
-
-        if cart_item_exists:
-            cart_item = await sync_to_async(CartItem.objects.get)(cart=cart, product=product)
-            cart_item.quantity += 1
-            await sync_to_async(cart_item.save)()
-            logger.info(f"Увеличено количество товара {product.title} в корзине")
-            message = f"✅ Добавлена еще 1 шт. товара \"{product.title}\""
-        else:
-            await sync_to_async(CartItem.objects.create)(cart=cart, product=product, quantity=1)
+        if created:
             logger.info(f"Добавлен новый товар {product.title} в корзину")
             message = f"✅ Товар \"{product.title}\" добавлен в корзину"
+        else:
+            logger.info(f"Увеличено количество товара {product.title} в корзине")
+            message = f"✅ Добавлена еще 1 шт. товара \"{product.title}\""
 
         return message
 
@@ -145,21 +123,11 @@ async def get_cart_data(customer):
     """Получение данных корзины"""
     try:
         logger.info(f"Получение данных корзины для клиента {customer.id}")
-        cart = await sync_to_async(Cart.objects.get)(customer=customer)
-        cart_data = await sync_to_async(
-            lambda: list(cart.items.select_related('product').values(
-                'product__id', 'product__title', 'product__price', 'quantity'
-            ))
-        )()
-        total_items = await sync_to_async(lambda: cart.total_items)()
-        total_price = await sync_to_async(lambda: cart.total_price)()
+        cart_data, total_items, total_price = await data.cart_summary(customer)
 
         logger.info(f"Корзина клиента {customer.id}: {total_items} товаров на сумму {total_price}")
         return cart_data, total_items, total_price
 
-    except Cart.DoesNotExist:
-        logger.warning(f"Корзина не найдена для клиента {customer.id}")
-        return [], 0, 0
     except Exception as e:
         logger.error(f"Ошибка при получении данных корзины: {e}")
         return [], 0, 0
@@ -169,26 +137,13 @@ async def remove_item(customer, product_id):
     error_message = '❌ Ошибка при удалении товара из корзины'
     try:
         logger.info(f"Удаление товара {product_id} из корзины клиента {customer.id}")
-        cart = await sync_to_async(Cart.objects.get)(customer=customer)
-        product = await sync_to_async(Product.objects.get)(id=product_id)
-        cart_item = await sync_to_async(CartItem.objects.get)(cart=cart, product=product)
-        await sync_to_async(cart_item.delete)()
+        if not await data.remove_from_cart(customer, product_id):
+            logger.error(f"Элемент корзины не найден для товара {product_id}")
+            return error_message
 
         logger.info(f"Товар {product_id} успешно удален из корзины")
         return '✅ Товар удален из корзины'
 
-    except Customer.DoesNotExist:
-        logger.error(f"Клиент {customer.id} не найден при удалении товара")
-        return error_message
-    except Cart.DoesNotExist:
-        logger.error(f"Корзина не найдена для клиента {customer.id}")
-        return error_message
-    except Product.DoesNotExist:
-        logger.error(f"Товар {product_id} не найден при удалении")
-        return error_message
-    except CartItem.DoesNotExist:
-        logger.error(f"Элемент корзины не найден для товара {product_id}")
-        return error_message
     except Exception as e:
         logger.error(f'Ошибка при удалении товара: {e}')
         return error_message
@@ -198,65 +153,54 @@ async def change_cart_item_quantity(customer, product_id, quantity):
     error_message = '❌ Ошибка при изменении количества товара в корзине'
     try:
         logger.info(f"Изменение количества товара {product_id} на {quantity} для клиента {customer.id}")
-        cart = await sync_to_async(Cart.objects.get)(customer=customer)
-        product = await sync_to_async(Product.objects.get)(id=product_id)
-        cart_item = await sync_to_async(CartItem.objects.get)(cart=cart, product=product)
-        cart_item.quantity = quantity
-        await sync_to_async(cart_item.save)()
+        if not await data.set_cart_item_quantity(customer, product_id, quantity):
+            logger.error(f"Элемент корзины не найден для товара {product_id}")
+            return error_message
 
         logger.info(f"Количество товара {product_id} изменено на {quantity}")
         return '✅ Количество изменено'
 
-    except Customer.DoesNotExist:
-        logger.error(f"Клиент {customer.id} не найден при изменении количества")
-        return error_message
-    except Cart.DoesNotExist:
-        logger.error(f"Корзина не найдена для клиента {customer.id}")
-        return error_message
-    except Product.DoesNotExist:
-        logger.error(f"Товар {product_id} не найден при изменении количества")
-        return error_message
-    except CartItem.DoesNotExist:
-        logger.error(f"Элемент корзины не найден для товара {product_id}")
-        return error_message
     except Exception as e:
         logger.error(f'Ошибка при изменении количества товара: {e}')
         return error_message
 
-async def new_order(customer, cart, delivery_method):
+async def shift_cart_item_quantity(customer, product_id, delta):
+    """Изменение количества товара в корзине на delta, при нуле товар удаляется"""
+    try:
+        logger.info(f"Изменение количества товара {product_id} на {delta:+d} для клиента {customer.id}")
+        result = await data.shift_cart_item(customer, product_id, delta)
+        if result == 'removed':
+            return '✅ Товар удален из корзины'
+        if result == 'changed':
+            return '✅ Количество изменено'
+        return '❌ Товар не найден в корзине'
+
+    except Exception as e:
+        logger.error(f'Ошибка при изменении количества товара: {e}')
+        return '❌ Ошибка при изменении количества товара в корзине'
+
+async def new_order(customer, delivery_method):
     """Создание нового заказа"""
     try:
         logger.info(f"Создание нового заказа для клиента {customer.id}, способ доставки: {delivery_method}")
 
-        # Генерируем номер заказа
-        order_number = await sync_to_async(order_number_generator)()
-        logger.info(f"Сгенерирован номер заказа: {order_number}")
-
-        # Создаем заказ
-        order = await sync_to_async(Order.objects.create)(
-            customer=customer,
-            order_number=order_number,
-            delivery_method=delivery_method,
-            address=customer.address
-        )
-
-        # Получаем элементы корзины
-        cart_items = await sync_to_async(list)(CartItem.objects.filter(cart=cart).select_related('product'))
-
-        # Создаем элементы заказа
-        for item in cart_items:
-            await sync_to_async(OrderItem.objects.create)(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-            )
-
-        logger.info(f"Заказ {order_number} успешно создан, товаров: {len(cart_items)}")
+        # Заказ и его элементы создаются одной транзакцией за один переход в поток
+        order, items_count = await data.place_order(customer, delivery_method)
+
+        logger.info(f"Заказ {order.order_number} успешно создан, товаров: {items_count}")
         return (f'✅ Заказ успешно создан.\n'
                 f'📦 Номер заказа: {order.order_number}\n'
                 f'🏠 Адрес доставки: {customer.address}\n'
                 f'🚚 Способ доставки: {order.get_delivery_method_display()}')
 
+    except Cart.DoesNotExist:
+        logger.warning(f"Корзина не найдена для клиента {customer.id}")
+        return '❌ Корзина пуста'
+    except OutOfStock as e:
+        logger.warning(f"Заказ клиента {customer.id} не создан: {e}")
+        product = await catalog.product(e.product_id)
+        title = product.title if product is not None else e.product_id
+        return f'❌ Товара "{title}" недостаточно на складе'
     except Exception as e:
         logger.error(f"Критическая ошибка при создании заказа: {e}")
         return '❌ Ошибка при создании заказа'
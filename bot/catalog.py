@@ -0,0 +1,128 @@
+# catalog.py
+import asyncio
+import logging
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+
+from bot.db import run_db
+from bot.models import Category, Product
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def product_caption(product):
+    """Подпись карточки товара"""
+    return f"""
+📦 *{product.title}*
+💰 Цена: {product.price} ₽
+📝 {product.description or 'Описание отсутствует'}
+                """
+
+
+class Catalog:
+    """Кеш каталога в памяти процесса: категории, товары категорий и подписи карточек
+
+    Данные загружаются лениво: список категорий одним запросом, товары - по одной
+    категории при первом обращении к ней, подписи - при первом показе карточки.
+    Одновременные запросы одних и тех же данных ждут одну загрузку. Сигналы
+    post_save/post_delete для Category и Product повышают версию, и следующий
+    запрос начинает кеш заново. Изменения из других процессов (например, из
+    админки) подхватываются не позже чем через ttl секунд.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.version = 0
+        self.generation = 0  # номер наполнения кеша, ключ для производных кешей (клавиатур)
+        self._cached_version = None
+        self._started_at = 0.0
+        self._loaded = {}
+        self._captions = {}
+        self._loading = {}
+
+    def invalidate(self):
+        """Пометить каталог устаревшим"""
+        self.version += 1
+
+    def _refresh(self):
+        """Начать кеш заново, если каталог изменился или устарел по ttl"""
+        if self._cached_version == self.version and time.monotonic() - self._started_at <= self.ttl:
+            return
+        self._cached_version = self.version
+        self._started_at = time.monotonic()
+        self.generation += 1
+        # Новые словари: загрузки, начатые до сброса, дописывают результат в старые
+        self._loaded = {}
+        self._captions = {}
+
+    async def _load_once(self, key, load):
+        """Результат load() из потока БД; одновременные запросы одного ключа ждут одну загрузку"""
+        key = (self.generation, key)
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(run_db(load))
+            self._loading[key] = future
+            future.add_done_callback(lambda _: self._loading.pop(key, None))
+        # shield: отмена одного ожидающего не прерывает загрузку для остальных
+        return await asyncio.shield(future)
+
+    async def _get(self, key, load):
+        self._refresh()
+        loaded = self._loaded
+        if key not in loaded:
+            loaded[key] = await self._load_once(key, load)
+        return loaded[key]
+
+    async def categories(self):
+        """Список категорий"""
+        return await self._get('categories', lambda: list(Category.objects.all()))
+
+    async def _category(self, category_id):
+        """Товары категории в порядке id и список их id (для поиска границы страницы)"""
+        def load():
+            products = list(Product.objects.filter(category_id=category_id).defer('search_vector').order_by('id'))
+            logger.info(f"Загружены товары категории {category_id}: {len(products)}")
+            return products, [product.id for product in products]
+
+        loaded = self._loaded
+        products, ids = await self._get(('category', category_id), load)
+        for product in products:
+            loaded.setdefault(('product', product.id), product)
+        return products, ids
+
+    async def products(self, category_id):
+        """Товары категории"""
+        products, _ = await self._category(category_id)
+        return products
+
+    async def products_page(self, category_id, cursor=None, before=False, limit=10):
+        """
+        Страница товаров категории по ключу id: товары после cursor, а при before=True - перед ним
+        Возвращает товары страницы, позицию первого из них и число товаров категории
+        """
+        products, ids = await self._category(category_id)
+        if cursor is None:
+            start = 0
+        elif before:
+            start = max(bisect_left(ids, cursor) - limit, 0)
+        else:
+            start = bisect_right(ids, cursor)
+        return products[start:start + limit], start, len(products)
+
+    async def product(self, product_id):
+        """Товар по id или None"""
+        return await self._get(('product', product_id),
+                               lambda: Product.objects.defer('search_vector').filter(id=product_id).first())
+
+    def caption(self, product):
+        """Подпись карточки товара, подготовленная при первом показе"""
+        caption = self._captions.get(product.id)
+        if caption is None:
+            caption = self._captions[product.id] = product_caption(product)
+        return caption
+
+
+catalog = Catalog(ttl=settings.CATALOG_CACHE_TTL)
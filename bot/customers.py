@@ -0,0 +1,81 @@
+# customers.py
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from django.conf import settings
+
+from bot.db import run_db
+from bot.models import Customer
+
+
+class CustomerCache:
+    """Ограниченный TTL/LRU-кеш заказчиков по telegram_id
+
+    Кешируется и отсутствие заказчика, чтобы незарегистрированные
+    пользователи не обращались к БД на каждом обновлении. Записи сбрасываются
+    при сохранении и удалении Customer в этом процессе (сигналы), изменения
+    из других процессов подхватываются не позже чем через ttl секунд.
+    """
+
+    def __init__(self, ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version = 0
+        self._customers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, telegram_id):
+        """Заказчик по telegram_id или None для незарегистрированного пользователя"""
+        entry = self._customers.get(telegram_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self._customers.move_to_end(telegram_id)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        version = self.version
+        customer = await run_db(Customer.objects.filter(telegram_id=telegram_id).order_by().first)
+        # Запись, сброшенная во время загрузки, не сохраняется устаревшей
+        if version == self.version:
+            self._customers[telegram_id] = (customer, time.monotonic() + self.ttl)
+            self._customers.move_to_end(telegram_id)
+            if len(self._customers) > self.max_size:
+                self._customers.popitem(last=False)
+        return customer
+
+    def invalidate(self, telegram_id):
+        """Сброс записи заказчика"""
+        self.version += 1
+        self._customers.pop(telegram_id, None)
+
+    def clear(self):
+        self.version += 1
+        self._customers.clear()
+
+
+def registered(customer):
+    """Заказчик из CustomerMiddleware; для незарегистрированного пользователя - Customer.DoesNotExist"""
+    if customer is None:
+        raise Customer.DoesNotExist('Пользователь не зарегистрирован')
+    return customer
+
+
+class CustomerMiddleware(BaseMiddleware):
+    """Загружает заказчика один раз на обновление и передает обработчикам как customer"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        # Inline-запросам заказчик не нужен: они обслуживаются из кеша без обращений к БД
+        if user is None or getattr(event, 'inline_query', None) is not None:
+            data['customer'] = None
+        else:
+            data['customer'] = await self.cache.get(user.id)
+        return await handler(event, data)
+
+
+customer_cache = CustomerCache(ttl=settings.CUSTOMER_CACHE_TTL, max_size=settings.CUSTOMER_CACHE_SIZE)
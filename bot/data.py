@@ -0,0 +1,223 @@
+# data.py
+import functools
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum, Window
+
+from bot import search
+from bot.db import run_db
+from bot.inventory import commit_reservation, release_expired_reservations, release_reservation
+from bot.models import Cart, CartItem, Customer, Order, Product
+from bot.services import create_order_from_cart
+
+
+def use_case(func):
+    """Синхронная функция доступа к данным, выполняемая целиком за один переход в поток БД
+
+    Асинхронные методы ORM (aget, aupdate, ...) не используются: они выполняются
+    через sync_to_async в общем потоке, минуя пул потоков БД (bot.db).
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+@use_case
+def get_customer(telegram_id):
+    """Заказчик по telegram_id, иначе Customer.DoesNotExist"""
+    return Customer.objects.get(telegram_id=telegram_id)
+
+
+@use_case
+def has_cart(customer):
+    """Есть ли у заказчика корзина"""
+    return Cart.objects.filter(customer=customer).exists()
+
+
+@use_case
+def remove_from_cart(customer, product_id):
+    """Удаляет товар из корзины. Возвращает False, если его там не было"""
+    deleted, _ = CartItem.objects.filter(cart__customer=customer, product_id=product_id).delete()
+    return bool(deleted)
+
+
+@use_case
+def set_cart_item_quantity(customer, product_id, quantity):
+    """Задает количество товара в корзине. Возвращает False, если товара там нет"""
+    return bool(CartItem.objects.filter(cart__customer=customer, product_id=product_id).update(quantity=quantity))
+
+
+@use_case
+def clear_cart(customer):
+    """Удаляет все товары из корзины заказчика"""
+    CartItem.objects.filter(cart__customer=customer).delete()
+
+
+@use_case
+def register_phone(user, phone):
+    """
+    Создает заказчика с номером телефона
+    Возвращает (заказчик, создан) или None, если номер занят другим пользователем
+    """
+    if Customer.objects.filter(phone=phone).exclude(telegram_id=user.id).exists():
+        return None
+    return Customer.objects.get_or_create(
+        telegram_id=user.id,
+        defaults={
+            'first_name': user.first_name or 'Неизвестно',
+            'last_name': user.last_name or 'Неизвестно',
+            'phone': phone,
+            'address': 'Не указан'
+        }
+    )
+
+
+@use_case
+def save_address(telegram_id, address):
+    """Сохраняет адрес заказчика, иначе Customer.DoesNotExist"""
+    customer = Customer.objects.get(telegram_id=telegram_id)
+    customer.address = address
+    customer.save(update_fields=['address'])
+    return customer
+
+
+@use_case
+def add_to_cart(customer, product_id):
+    """
+    Добавляет одну штуку товара в корзину заказчика
+    Возвращает товар и признак новой позиции в корзине
+    """
+    cart, _ = Cart.objects.get_or_create(customer=customer)
+    product = Product.objects.get(id=product_id)
+    if CartItem.objects.filter(cart=cart, product=product).update(quantity=F('quantity') + 1):
+        return product, False
+    CartItem.objects.create(cart=cart, product=product, quantity=1)
+    return product, True
+
+
+@use_case
+def shift_cart_item(customer, product_id, delta):
+    """
+    Меняет количество товара в корзине на delta, при нуле удаляет позицию
+    Возвращает 'removed', 'changed' или None, если товара нет в корзине
+    """
+    cart_items = CartItem.objects.filter(cart__customer=customer, product_id=product_id)
+    if delta < 0 and cart_items.filter(quantity__lte=-delta).delete()[0]:
+        return 'removed'
+    if cart_items.update(quantity=F('quantity') + delta):
+        return 'changed'
+    return None
+
+
+@use_case
+def cart_summary(customer):
+    """Товары корзины и итоги одним запросом: суммы считаются оконными функциями"""
+    rows = list(
+        CartItem.objects.filter(cart__customer=customer)
+        .order_by('id')
+        .values('product__id', 'product__title', 'product__price', 'quantity')
+        .annotate(
+            total_items=Window(Sum('quantity')),
+            total_price=Window(Sum(F('quantity') * F('product__price'),
+                                   output_field=DecimalField(max_digits=12, decimal_places=2))),
+        )
+    )
+    if not rows:
+        return [], 0, 0
+
+    total_items, total_price = rows[0]['total_items'], rows[0]['total_price']
+    cart_data = [
+        {key: row[key] for key in ('product__id', 'product__title', 'product__price', 'quantity')}
+        for row in rows
+    ]
+    return cart_data, total_items, total_price
+
+
+@use_case
+def place_order(customer, delivery_method):
+    """Заказ из корзины заказчика: заказ и количество позиций, иначе Cart.DoesNotExist"""
+    cart = Cart.objects.get(customer=customer)
+    return create_order_from_cart(customer, cart, delivery_method)
+
+
+@use_case
+def confirm_latest_order(customer):
+    """
+    Подтверждает последний заказ и очищает корзину
+    Возвращает 'confirmed', 'already_confirmed', 'cancelled' или 'expired' - резерв истек,
+    заказ отменяется сразу, не дожидаясь команды release_reservations
+    """
+    order = Order.objects.filter(customer=customer).latest('order_date_time')
+    if not commit_reservation(order):
+        order.refresh_from_db(fields=['is_confirmed', 'status'])
+        if order.is_confirmed:
+            return 'already_confirmed'
+        if order.status == 'cancelled':
+            return 'cancelled'
+        release_expired_reservations(Order.objects.filter(pk=order.pk))
+        return 'expired'
+    order.status = 'pending'
+    order.save(update_fields=['status'])
+    CartItem.objects.filter(cart__customer=customer).delete()
+    return 'confirmed'
+
+
+def cancel_order(order):
+    """Отменяет заказ и возвращает его остатки на склад"""
+    with transaction.atomic():
+        release_reservation(order)
+        order.status = 'cancelled'
+        order.save(update_fields=['status'])
+
+
+@use_case
+def cancel_latest_order(customer):
+    """Отменяет последний заказ заказчика"""
+    cancel_order(Order.objects.filter(customer=customer).latest('order_date_time'))
+
+
+@use_case
+def cancel_customer_order(customer, order_id):
+    """Отменяет заказ по id. Возвращает False для чужого заказа"""
+    order = Order.objects.get(id=order_id)
+    if customer is None or order.customer_id != customer.id:
+        return False
+    cancel_order(order)
+    return True
+
+
+@use_case
+def customer_orders_page(customer, cursor=None, newer=False, limit=5):
+    """
+    Страница заказов заказчика, новые первыми, с постраничным переходом по ключу (order_date_time, id)
+    cursor - ключ крайнего заказа текущей страницы: от него берутся более старые заказы,
+    а при newer=True - более новые. Итоги считаются только для заказов страницы.
+    Возвращает заказы страницы и признаки наличия более старых и более новых заказов
+    """
+    keys = Order.objects.filter(customer=customer)
+    if cursor is not None:
+        date_time, order_id = cursor
+        # Условие на order_date_time ограничивает диапазон индекса, exclude отсекает ключи по другую сторону курсора
+        if newer:
+            keys = keys.filter(order_date_time__gte=date_time).exclude(order_date_time=date_time, id__lte=order_id)
+        else:
+            keys = keys.filter(order_date_time__lte=date_time).exclude(order_date_time=date_time, id__gte=order_id)
+    keys = keys.order_by(*(('order_date_time', 'id') if newer else ('-order_date_time', '-id')))
+
+    # Лишний заказ сверх limit показывает, что за страницей есть еще заказы
+    orders = list(
+        Order.objects.filter(id__in=keys.values('id')[:limit + 1])
+        .with_totals()
+        .order_by('-order_date_time', '-id')
+    )
+    more = len(orders) > limit
+    if newer:
+        return orders[-limit:], True, more
+    return orders[:limit], more, cursor is not None
+
+
+@use_case
+def search_products(text, limit=10):
+    """Товары по свободному запросу (bot.search)"""
+    return search.search_products(text, limit)
@@ -0,0 +1,201 @@
+# db.py
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, connections
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def open_connection():
+    """Открытие соединения текущего потока
+
+    Функция, а не connection.ensure_connection: связанный метод захватил бы
+    соединение вызывающего потока, а не потока, в котором выполняется.
+    """
+    connection.ensure_connection()
+
+
+class DatabaseExecutor:
+    """Пул потоков для синхронной работы с БД
+
+    По умолчанию sync_to_async выполняет весь ORM-код процесса в одном общем
+    потоке (thread_sensitive=True), и запросы параллельных обновлений идут
+    строго по одному. Здесь запросы выполняются в threads потоках, у каждого
+    потока свое соединение Django. Перед задачей и после нее соединение
+    проверяется (close_old_connections): устаревшие по CONN_MAX_AGE и
+    сломанные соединения закрываются и открываются заново, при
+    CONN_HEALTH_CHECKS переиспользуемое соединение проверяется запросом.
+    Число потоков не должно превышать доступное процессу число соединений с БД.
+    """
+
+    def __init__(self, threads=8):
+        self.threads = threads
+        self._executor = None
+        self._lock = threading.Lock()
+        # Счетчики меняются из цикла событий и из потоков пула
+        self._counters_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='db')
+                    logger.info(f"Запущен пул потоков БД: {self.threads}")
+        return self._executor
+
+    def _call(self, func, args, kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            with self._counters_lock:
+                self.failed += 1
+            raise
+        finally:
+            close_old_connections()
+            with self._counters_lock:
+                self.completed += 1
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнение синхронной функции в потоке пула"""
+        with self._counters_lock:
+            self.submitted += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(self._call, func, args, kwargs))
+
+    def _in_each_thread(self, func):
+        """Задачи func по одной в каждый поток пула; барьер не дает одному потоку взять две"""
+        barrier = threading.Barrier(self.threads)
+
+        def task():
+            try:
+                barrier.wait(timeout=5)
+            except threading.BrokenBarrierError:
+                pass
+            func()
+
+        return [self._get_executor().submit(task) for _ in range(self.threads)]
+
+    async def warm_up(self):
+        """Запуск всех потоков пула и открытие их соединений с БД"""
+        if self.threads:
+            await asyncio.gather(*map(asyncio.wrap_future, self._in_each_thread(open_connection)))
+
+    def shutdown(self):
+        """Остановка пула после завершения начатых задач и закрытие соединений потоков"""
+        if self._executor is None:
+            return
+        self._in_each_thread(connections.close_all)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def stats(self):
+        """Размер пула и счетчики задач"""
+        with self._counters_lock:
+            return {
+                'threads': self.threads,
+                'in_flight': self.submitted - self.completed,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+
+db_executor = DatabaseExecutor(threads=settings.DB_EXECUTOR_THREADS)
+
+
+def executor_enabled():
+    """Включен ли пул потоков БД
+
+    Настройка читается при вызове: тесты отключают пул через override_settings.
+    """
+    return bool(settings.DB_EXECUTOR_THREADS and db_executor.threads)
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполнение синхронного ORM-кода: в пуле потоков БД или, если пул
+    отключен (DB_EXECUTOR_THREADS=0), в общем потоке sync_to_async"""
+    if executor_enabled():
+        return await db_executor.run(func, *args, **kwargs)
+    return await sync_to_async(func)(*args, **kwargs)
+
+
+def connection_pool():
+    """Пул соединений psycopg (профиль DB_POOL) или None"""
+    return getattr(connection, 'pool', None)
+
+
+def database_stats():
+    """Метрики соединений с БД: ожидание соединения из пула и его заполненность"""
+    pool = connection_pool()
+    if pool is None:
+        return {'pool': False, 'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE', 0)}
+
+    stats = pool.get_stats()
+    requests = stats.get('requests_num', 0)
+    size, available = stats.get('pool_size', 0), stats.get('pool_available', 0)
+    return {
+        'pool': True,
+        'min_size': stats.get('pool_min', 0),
+        'max_size': stats.get('pool_max', 0),
+        'size': size,
+        'in_use': size - available,
+        # Доля соединений, выданных из пула, от его максимального размера
+        'saturation': round((size - available) / stats['pool_max'], 3) if stats.get('pool_max') else 0,
+        'waiting': stats.get('requests_waiting', 0),
+        'requests': requests,
+        'queued': stats.get('requests_queued', 0),
+        'timeouts': stats.get('requests_errors', 0),
+        'acquire_wait_ms_total': stats.get('requests_wait_ms', 0),
+        'acquire_wait_ms_avg': round(stats.get('requests_wait_ms', 0) / requests, 3) if requests else 0,
+        'connections_opened': stats.get('connections_num', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+    }
+
+
+async def warm_up_database():
+    """Открывает соединения с БД до первого обновления
+
+    В профиле DB_POOL пул заполняется до min_size соединений, иначе постоянные
+    соединения открывают потоки пула БД. Без пула соединений и пула потоков
+    прогревать нечего: соединение, открытое во временном потоке, бот не
+    использует. Ошибка прогрева не мешает запуску: соединения откроются при
+    первом запросе.
+    """
+    pool = connection_pool()
+    if pool is None and not executor_enabled():
+        return
+    start = time.perf_counter()
+    try:
+        if pool is not None:
+            # Потоки берут соединения из пула на время задачи, держать их заранее не нужно
+            await asyncio.to_thread(pool.open, wait=True, timeout=settings.DB_POOL_TIMEOUT)
+        else:
+            await db_executor.warm_up()
+    except Exception as e:
+        logger.error(f"Ошибка прогрева соединений с БД: {e}")
+        return
+    logger.info(f"Соединения с БД прогреты за {(time.perf_counter() - start) * 1000:.1f} мс")
+
+
+def warm_up_database_blocking():
+    """Прогрев из синхронной точки входа (wsgi.py, asgi.py)
+
+    Выполняется в отдельном потоке: ASGI-сервер может импортировать приложение
+    внутри уже запущенного цикла событий.
+    """
+    if not settings.DB_WARM_UP or (connection_pool() is None and not executor_enabled()):
+        return
+    thread = threading.Thread(target=asyncio.run, args=(warm_up_database(),), name='db-warm-up')
+    thread.start()
+    thread.join()
@@ -0,0 +1,83 @@
+# dedup.py
+import logging
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Отсекает повторные доставки обновлений Telegram по update_id
+
+    Сначала проверяется локальный ограниченный TTL/LRU-кеш процесса. Если
+    задан cache_alias, дополнительно используется общий кеш Django (например,
+    Redis), чтобы повторы отсекались между процессами. Без Redis в роли общего
+    кеша выступает LocMemCache.
+    """
+
+    def __init__(self, ttl=3600, max_size=10000, cache_alias=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        self._seen = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _seen_locally(self, update_id) -> bool:
+        now = time.monotonic()
+        # Записи добавляются по порядку с одинаковым TTL, поэтому устаревшие - в начале
+        while self._seen and next(iter(self._seen.values())) <= now:
+            self._seen.popitem(last=False)
+
+        if update_id in self._seen:
+            return True
+
+        self._seen[update_id] = now + self.ttl
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return False
+
+    async def _seen_in_cache(self, update_id) -> bool:
+        cache = caches[self.cache_alias]
+        try:
+            return not await cache.aadd(f'tg_update:{update_id}', 1, self.ttl)
+        except Exception as e:
+            logger.error(f"Ошибка общего кеша при проверке обновления {update_id}: {e}")
+            return False
+
+    async def is_duplicate(self, update_id) -> bool:
+        """Отмечает обновление как полученное. Возвращает True для повторной доставки"""
+        duplicate = self._seen_locally(update_id)
+        if not duplicate and self.cache_alias:
+            duplicate = await self._seen_in_cache(update_id)
+
+        if duplicate:
+            self.hits += 1
+            logger.warning(f"Повторная доставка обновления {update_id} отброшена")
+        else:
+            self.misses += 1
+        return duplicate
+
+    async def forget(self, update_id):
+        """Снимает отметку с обновления, которое не было принято в обработку
+
+        Следующая доставка того же update_id будет обработана, а не отброшена.
+        """
+        self._seen.pop(update_id, None)
+        if self.cache_alias:
+            try:
+                await caches[self.cache_alias].adelete(f'tg_update:{update_id}')
+            except Exception as e:
+                logger.error(f"Ошибка общего кеша при снятии отметки обновления {update_id}: {e}")
+
+    def stats(self):
+        """Счетчики попаданий (повторов) и промахов"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._seen),
+            'shared': bool(self.cache_alias),
+        }
@@ -0,0 +1,122 @@
+# inline.py
+import logging
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin
+
+from aiogram.types import InlineQueryResultArticle, InlineQueryResultCachedPhoto, InputTextMessageContent
+from django.conf import settings
+
+from bot import data
+from bot.catalog import catalog
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class InlineResultsCache:
+    """Ограниченный TTL/LRU-кеш готовых результатов inline-запросов
+
+    Ключ включает версию каталога: изменение товаров в этом процессе сразу
+    делает старые записи недостижимыми, изменения из других процессов
+    подхватываются не позже чем через ttl секунд.
+    """
+
+    def __init__(self, ttl=300, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, build):
+        """Результаты по ключу; при промахе собираются вызовом await build()"""
+        entry = self._results.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._results.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        results = await build()
+        self._results[key] = (results, time.monotonic() + self.ttl)
+        self._results.move_to_end(key)
+        if len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+        return results
+
+    def clear(self):
+        self._results.clear()
+
+
+def normalize_query(text):
+    """Запрос без различий в регистре и пробелах: одинаковые запросы попадают в одну запись кеша"""
+    return ' '.join(text.lower().split())
+
+
+def thumbnail_url(product):
+    """Публичный адрес картинки товара (SITE_URL + MEDIA_URL) или None, если адрес сайта не задан"""
+    if not product.image or not settings.SITE_URL:
+        return None
+    return urljoin(settings.SITE_URL, product.image.url)
+
+
+def render_result(product, caption):
+    """Результат inline-запроса для товара
+
+    Если фото товара уже загружено в Telegram (image_file_id), оно служит
+    миниатюрой и отправляется с подписью; иначе отправляется текстовая карточка
+    с миниатюрой по публичному адресу картинки.
+    """
+    description = f'{product.price} ₽'
+    if product.image_file_id:
+        return InlineQueryResultCachedPhoto(id=str(product.id), photo_file_id=product.image_file_id,
+                                            title=product.title, description=description,
+                                            caption=caption, parse_mode='Markdown')
+    return InlineQueryResultArticle(id=str(product.id), title=product.title, description=description,
+                                    thumbnail_url=thumbnail_url(product),
+                                    input_message_content=InputTextMessageContent(message_text=caption,
+                                                                                  parse_mode='Markdown'))
+
+
+async def find_products(query):
+    """Товары для inline-запроса: найденные поиском или, для пустого запроса, первые товары каталога"""
+    if not query:
+        # Категории загружаются по очереди, пока не наберется INLINE_MAX_RESULTS товаров
+        products = []
+        for category in await catalog.categories():
+            page, _, _ = await catalog.products_page(category.id, limit=settings.INLINE_MAX_RESULTS - len(products))
+            products += page
+            if len(products) >= settings.INLINE_MAX_RESULTS:
+                break
+        return products
+
+    found = await data.search_products(query, limit=settings.INLINE_MAX_RESULTS)
+    # Карточки собираются из кеша каталога, поиск возвращает только порядок товаров
+    products = [await catalog.product(product.id) for product in found]
+    return [product for product in products if product is not None]
+
+
+async def inline_results(text):
+    """Готовые результаты inline-запроса из кеша"""
+    query = normalize_query(text)
+
+    async def build():
+        return [render_result(product, catalog.caption(product)) for product in await find_products(query)]
+
+    return await inline_results_cache.get((query, catalog.version), build)
+
+
+def results_page(results, offset, page_size):
+    """Страница результатов по offset из inline-запроса и offset следующей страницы"""
+    try:
+        start = max(int(offset or 0), 0)
+    except ValueError:
+        start = 0
+    page = results[start:start + page_size]
+    end = start + len(page)
+    return page, str(end) if end < len(results) else ''
+
+
+inline_results_cache = InlineResultsCache(ttl=settings.INLINE_RESULTS_CACHE_TTL,
+                                          max_size=settings.INLINE_RESULTS_CACHE_SIZE)
@@ -0,0 +1,96 @@
+# inventory.py
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from bot.models import Order, Product
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class OutOfStock(Exception):
+    """Остатка товара не хватает для резерва"""
+
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f'Недостаточно остатка товара {product_id}')
+
+
+def reserve_stock(items):
+    """
+    Списывает остатки под заказ. items - пары (product_id, quantity)
+
+    Каждое списание - отдельный условный UPDATE ... WHERE remainder >= quantity
+    в режиме автокоммита, поэтому блокировка строки товара держится не дольше
+    одного запроса даже при сотнях одновременных заказов одного товара.
+    Если какого-то товара не хватает, уже списанное возвращается и
+    выбрасывается OutOfStock.
+    """
+    reserved = []
+    for product_id, quantity in sorted(items):
+        updated = Product.objects.filter(pk=product_id, remainder__gte=quantity).update(
+            remainder=F('remainder') - quantity
+        )
+        if not updated:
+            return_stock(reserved)
+            raise OutOfStock(product_id)
+        reserved.append((product_id, quantity))
+
+
+def return_stock(items):
+    """Возвращает списанные остатки"""
+    for product_id, quantity in sorted(items):
+        Product.objects.filter(pk=product_id).update(remainder=F('remainder') + quantity)
+
+
+def reservation_deadline(ttl):
+    """Срок действия резерва, созданного сейчас"""
+    return timezone.now() + timedelta(seconds=ttl)
+
+
+def commit_reservation(order):
+    """
+    Подтверждает заказ и делает его резерв постоянным
+    Заказ без резерва (STOCK_RESERVATION выключен при его создании) подтверждается как есть.
+    Возвращает False, если резерв уже истек, заказ отменен или уже подтвержден
+    """
+    return bool(Order.objects.filter(
+        Q(stock_reserved=False) | Q(reserved_until__gt=timezone.now()),
+        pk=order.pk, is_confirmed=False,
+    ).exclude(status='cancelled').update(is_confirmed=True, reserved_until=None))
+
+
+def release_reservation(order):
+    """
+    Возвращает остатки товаров заказа на склад
+    Условный UPDATE флага гарантирует, что остатки вернутся ровно один раз
+    """
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order.pk, stock_reserved=True).update(stock_reserved=False,
+                                                                             reserved_until=None):
+            return False
+        return_stock(order.items.values_list('product_id', 'quantity'))
+    logger.info(f"Остатки по заказу {order.order_number} возвращены на склад")
+    return True
+
+
+def release_expired_reservations(orders=None):
+    """Отменяет неподтвержденные заказы с истекшим резервом (из orders или всех) и возвращает их остатки"""
+    released = 0
+    orders = Order.objects.all() if orders is None else orders
+    expired = orders.filter(is_confirmed=False, stock_reserved=True, reserved_until__lte=timezone.now())
+    for order in expired:
+        # Возврат остатков и отмена - одной транзакцией: commit_reservation не увидит
+        # заказ без резерва, но еще не отмененный
+        with transaction.atomic():
+            if not release_reservation(order):
+                continue
+            Order.objects.filter(pk=order.pk, is_confirmed=False).update(status='cancelled')
+        released += 1
+    if released:
+        logger.info(f"Освобождено истекших резервов: {released}")
+    return released
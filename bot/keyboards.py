@@ -0,0 +1,172 @@
+# keyboards.py
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from django.conf import settings
+
+from bot.models import Order
+
+
+class KeyboardCache:
+    """Ограниченный LRU-кеш собранных клавиатур
+
+    Объекты клавиатур aiogram неизменяемы, поэтому один экземпляр можно
+    отправлять сколько угодно раз.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._keyboards = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """Клавиатура по ключу; при промахе собирается вызовом build()"""
+        keyboard = self._keyboards.get(key)
+        if keyboard is not None:
+            self._keyboards.move_to_end(key)
+            self.hits += 1
+            return keyboard
+
+        self.misses += 1
+        keyboard = self._keyboards[key] = build()
+        if len(self._keyboards) > self.max_size:
+            self._keyboards.popitem(last=False)
+        return keyboard
+
+    def clear(self):
+        self._keyboards.clear()
+
+
+def build_main_menu():
+    """Inline меню"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="🛒 Корзина", callback_data="cart")],
+            [InlineKeyboardButton(text="👤 Профиль", callback_data="profile")],
+            [InlineKeyboardButton(text="📦 Мои заказы", callback_data="orders")],
+            [InlineKeyboardButton(text='🗒️ Категории товаров', callback_data="categories")],
+            [InlineKeyboardButton(text='🔍 Поиск товаров', callback_data="search")],
+        ]
+    )
+
+
+def build_admin_keyboard():
+    """Клавиатура администратора"""
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="📦 Управление заказами"), KeyboardButton(text="🛍️ Управление товарами")],
+            [KeyboardButton(text="🔙 Выйти из админки")]
+        ],
+        resize_keyboard=True
+    )
+
+
+def build_delivery_menu():
+    """Выбор способа доставки"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=title, callback_data=f"delivery_{method}")]
+        for method, title in Order.DELIVERY_METHOD_CHOICES
+    ])
+
+
+def build_order_menu():
+    """Подтверждение или отмена созданного заказа"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text='✅ Подтвердить', callback_data='confirm_order')],
+        [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_order')]
+    ])
+
+
+def build_product_keyboard(product_id, category_id):
+    """Клавиатура карточки товара"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text='🛒 Добавить в корзину', callback_data=f'to_cart_{product_id}')],
+        [InlineKeyboardButton(text='⬅️ Назад к товарам', callback_data=f'category_{category_id}')]
+    ])
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def order_cursor(order):
+    """Ключ заказа (order_date_time, id) для callback_data: микросекунды от эпохи и id"""
+    return f'{(order.order_date_time - EPOCH) // timedelta(microseconds=1)}_{order.id}'
+
+
+def parse_order_cursor(value):
+    """Ключ заказа из callback_data"""
+    microseconds, order_id = value.split('_')
+    return EPOCH + timedelta(microseconds=int(microseconds)), int(order_id)
+
+
+def build_orders_navigation(orders, has_older, has_newer):
+    """Кнопки перехода к более новым и более старым заказам"""
+    row = []
+    if has_newer:
+        row.append(InlineKeyboardButton(text='⬅️ Новее', callback_data=f'orders_newer_{order_cursor(orders[0])}'))
+    if has_older:
+        row.append(InlineKeyboardButton(text='Старее ➡️', callback_data=f'orders_older_{order_cursor(orders[-1])}'))
+    return [row] if row else []
+
+
+# Статичные клавиатуры собираются один раз при загрузке модуля
+MAIN_MENU = build_main_menu()
+ADMIN_KEYBOARD = build_admin_keyboard()
+DELIVERY_MENU = build_delivery_menu()
+ORDER_MENU = build_order_menu()
+CART_ACTIONS = (
+    [InlineKeyboardButton(text='🗑️ Очистить корзину', callback_data='clear_cart')],
+    [InlineKeyboardButton(text='📦 Оформить заказ', callback_data='take_order')],
+)
+BACK_TO_CATEGORIES = [InlineKeyboardButton(text="⬅️ Назад к категориям", callback_data="categories")]
+NEW_SEARCH = [InlineKeyboardButton(text="🔍 Новый поиск", callback_data="search")]
+
+keyboard_cache = KeyboardCache(max_size=settings.KEYBOARD_CACHE_SIZE)
+
+
+def product_keyboard(product_id, category_id):
+    """Клавиатура карточки товара из кеша"""
+    return keyboard_cache.get(('product', product_id, category_id),
+                              lambda: build_product_keyboard(product_id, category_id))
+
+
+def categories_keyboard(categories, generation):
+    """Список категорий для загрузки каталога generation"""
+    return keyboard_cache.get(('categories', generation), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=category.title, callback_data=f'category_{category.id}')]
+        for category in categories
+    ]))
+
+
+def products_keyboard(category_id, products, start, total, generation):
+    """Страница товаров категории для загрузки каталога generation
+
+    callback_data перехода: cat_<категория>_next_<id последнего товара> или
+    cat_<категория>_prev_<id первого товара>.
+    """
+    def build():
+        navigation = []
+        if start > 0:
+            navigation.append(InlineKeyboardButton(text='⬅️', callback_data=f'cat_{category_id}_prev_{products[0].id}'))
+        if start + len(products) < total:
+            navigation.append(InlineKeyboardButton(text='➡️', callback_data=f'cat_{category_id}_next_{products[-1].id}'))
+        return InlineKeyboardMarkup(inline_keyboard=[
+            *([InlineKeyboardButton(text=product.title, callback_data=f'product_{product.id}')]
+              for product in products),
+            *([navigation] if navigation else []),
+            BACK_TO_CATEGORIES,
+        ])
+
+    return keyboard_cache.get(('products', category_id, start, len(products), total, generation), build)
+
+
+def search_results_keyboard(products):
+    """Найденные товары; клавиатура зависит от запроса и не кешируется"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        *([InlineKeyboardButton(text=f'{product.title} - {product.price} ₽', callback_data=f'product_{product.id}')]
+          for product in products),
+        NEW_SEARCH,
+        BACK_TO_CATEGORIES,
+    ])
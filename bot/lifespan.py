@@ -0,0 +1,37 @@
+# lifespan.py
+import logging
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class LifespanMiddleware:
+    """ASGI-обертка с протоколом lifespan, который обработчик Django не поддерживает
+
+    При остановке сервера (после завершения текущих запросов) вызывает
+    on_shutdown: например, дожидается обработки обновлений, уже принятых
+    в режиме ack-first, и закрывает HTTP-сессию бота.
+    """
+
+    def __init__(self, app, on_shutdown=()):
+        self.app = app
+        self.on_shutdown = list(on_shutdown)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await self.app(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    for callback in self.on_shutdown:
+                        await callback()
+                except Exception as e:
+                    logger.exception("Ошибка при остановке приложения")
+                    await send({'type': 'lifespan.shutdown.failed', 'message': str(e)})
+                else:
+                    await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,384 @@
+import asyncio
+import json
+import logging
+import random
+import string
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+from django.core.management.base import BaseCommand
+from asgiref.sync import SyncToAsync
+from django.test import RequestFactory, override_settings
+
+from bot.sender import TokenBucket
+
+
+FAKE_MESSAGE = {
+    'message_id': 1,
+    'date': 0,
+    'chat': {'id': 1, 'type': 'private'},
+    'text': 'OK',
+}
+
+
+def legacy_order_number():
+    """Прежний номер заказа AB1234DDMMYY из случайных букв и числа (базовая линия замера)
+
+    Уникальность не гарантируется: номера одного дня совпадают с вероятностью
+    парадокса дней рождения, и вставка заказа падает на unique.
+    """
+    now = datetime.now()
+    letters = ''.join(random.choices(string.ascii_uppercase, k=2))
+    return f"{letters}{random.randint(1000, 9999)}{now.day:02d}{now.month:02d}{now.year % 100:02d}"
+
+
+def make_callback_update(update_id, data, user_id=1):
+    """Собирает тестовое обновление Telegram с нажатием inline-кнопки"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'chat_instance': '1',
+            'data': data,
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': 'OK'},
+        },
+    }
+
+
+def make_update(update_id, text='/menu', user_id=1):
+    """Собирает тестовое обновление Telegram с текстовым сообщением"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+        },
+    }
+
+
+class FakeTelegramAPI:
+    """Локальный HTTP-сервер, отвечающий на любые методы Bot API"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request):
+        # Методы, которые Bot API завершает ответом true, а не сообщением
+        method = request.path.rsplit('/', 1)[-1].lower()
+        result = True if method in ('answercallbackquery', 'setmycommands', 'deletemessage') else FAKE_MESSAGE
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return TelegramAPIServer.from_base(f'http://127.0.0.1:{self.port}')
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарки горячих путей бота'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=['webhook', 'keyboards', 'orders', 'handlers', 'db', 'search'])
+        parser.add_argument('--count', type=int, default=200, help='Количество итераций')
+        parser.add_argument('--products', type=int, default=500000, help='Размер каталога для поиска')
+
+    def handle(self, *args, **options):
+        logging.disable(logging.WARNING)
+        extra = {'products': options['products']} if options['scenario'] == 'search' else {}
+        try:
+            getattr(self, f'bench_{options["scenario"]}')(options['count'], **extra)
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def report(self, title, count, elapsed):
+        self.stdout.write(f'{title}: {count} за {elapsed:.3f} с, {count / elapsed:.1f} обновлений/с')
+
+    def disable_throttle(self, bot):
+        """Отключает лимиты Bot API, чтобы измерять только накладные расходы бота"""
+        throttle = bot.throttle
+        throttle.global_bucket = TokenBucket(10 ** 6, 10 ** 6)
+        throttle.chat_rate = throttle.chat_burst = 10 ** 6
+
+    def bench_webhook(self, count):
+        """Сравнение WSGI-вебхука (asyncio.run на обновление) и ASGI-вебхука"""
+        from bot import views
+
+        self.disable_throttle(views.bot)
+
+        fake_api = FakeTelegramAPI()
+        views.bot.bot.session.api = fake_api.start()
+        factory = RequestFactory()
+
+        def make_request(update_id):
+            return factory.post('/webhook/', data=json.dumps(make_update(update_id)),
+                                content_type='application/json')
+
+        try:
+            start = time.perf_counter()
+            for i in range(count):
+                views.webhook(make_request(i))
+            self.report('WSGI webhook (asyncio.run)', count, time.perf_counter() - start)
+
+            async def run_async():
+                start = time.perf_counter()
+                for i in range(count):
+                    await views.async_webhook(make_request(count + i))
+                elapsed = time.perf_counter() - start
+                await views.bot.bot.session.close()
+                return elapsed
+
+            self.report('ASGI webhook (постоянный цикл)', count, asyncio.run(run_async()))
+        finally:
+            fake_api.stop()
+
+    def bench_keyboards(self, count):
+        """Аллокации на обновление: сборка клавиатур заново против реестра"""
+        from bot import keyboards
+
+        def build():
+            keyboards.build_main_menu()
+            keyboards.build_delivery_menu()
+            keyboards.build_order_menu()
+            keyboards.build_product_keyboard(1, 1)
+
+        def cached():
+            keyboards.MAIN_MENU, keyboards.DELIVERY_MENU, keyboards.ORDER_MENU
+            keyboards.product_keyboard(1, 1)
+
+        for title, func in (('Сборка на каждый вызов', build), ('Реестр клавиатур', cached)):
+            func()
+            start = time.perf_counter()
+            for _ in range(count):
+                func()
+            elapsed = time.perf_counter() - start
+
+            # Пик памяти за один вызов - объем, выделяемый на одно обновление
+            tracemalloc.start()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(f'{title}: {elapsed / count * 10 ** 6:.1f} мкс и {peak} байт на обновление')
+
+    def bench_orders(self, count):
+        """Создание заказа: отдельный переход в поток на каждый запрос против одной транзакции"""
+        from asgiref.sync import sync_to_async
+
+        from bot.bot_utils import new_order
+        from bot.models import Cart, CartItem, Category, Customer, Order, OrderItem, Product
+
+        async def legacy_new_order(customer, delivery_method):
+            # Прежняя реализация: корзина, номер, заказ, элементы корзины и каждая позиция по отдельности
+            cart = await sync_to_async(Cart.objects.get)(customer=customer)
+            order_number = await sync_to_async(legacy_order_number)()
+            order = await sync_to_async(Order.objects.create)(
+                customer=customer, order_number=order_number,
+                delivery_method=delivery_method, address=customer.address,
+            )
+            cart_items = await sync_to_async(list)(CartItem.objects.filter(cart=cart).select_related('product'))
+            for item in cart_items:
+                await sync_to_async(OrderItem.objects.create)(order=order, product=item.product, quantity=item.quantity)
+
+        category = Category.objects.create(title=f'bench-{time.time_ns()}')
+        customer = Customer.objects.create(first_name='Bench', last_name='Bench', phone=f'bench-{time.time_ns()}',
+                                           address='Bench', telegram_id=time.time_ns())
+        # Остатков хватает на все заказы: иначе new_order замеряет отказ OutOfStock, а не создание заказа
+        products = [Product(title=f'Bench {i}', category=category, price=10, image='bench.jpg', remainder=10 ** 6)
+                    for i in range(100)]
+        Product.objects.bulk_create(products)
+        try:
+            # Замеряется полный путь заказа, включая резерв остатков
+            with override_settings(STOCK_RESERVATION=True):
+                for size in (1, 10, 30, 100):
+                    cart = Cart.objects.create(customer=customer)
+                    CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=1)
+                                                 for product in products[:size])
+                    for title, func in (('по запросу', legacy_new_order), ('одной транзакцией', new_order)):
+                        async def run():
+                            start = time.perf_counter()
+                            for _ in range(count):
+                                await func(customer, 'courier')
+                            return time.perf_counter() - start
+
+                        elapsed = asyncio.run(run())
+                        # Резерв заказов возвращается на склад, следующий замер начинается с тех же остатков
+                        Product.objects.filter(category=category).update(remainder=10 ** 6)
+                        self.stdout.write(f'Корзина {size} поз., {title}: {elapsed / count * 1000:.2f} мс на заказ')
+                    cart.delete()
+        finally:
+            # Заказы и корзины удаляются каскадно
+            customer.delete()
+            category.delete()
+
+    def bench_handlers(self, count):
+        """Переходы в поток (sync_to_async) и задержка на вызов обработчиков корзины и заказов"""
+        from aiogram import types
+
+        from bot import views
+        from bot.models import Category, Customer, Product
+
+        self.disable_throttle(views.bot)
+        fake_api = FakeTelegramAPI()
+        views.bot.bot.session.api = fake_api.start()
+
+        category = Category.objects.create(title=f'bench-{time.time_ns()}')
+        product = Product.objects.create(title='Bench', category=category, price=10, image='bench.jpg',
+                                         remainder=10 ** 6)
+        user_id = 10 ** 12 + time.time_ns() % 10 ** 6
+        customer = Customer.objects.create(first_name='Bench', last_name='Bench', phone=f'bench-{user_id}',
+                                           address='Bench', telegram_id=user_id)
+        scenario = ['profile', f'to_cart_{product.id}', 'cart', f'cart_inc_{product.id}', 'take_order',
+                    'delivery_courier', 'confirm_order', f'to_cart_{product.id}', 'clear_cart', 'orders']
+        hops = dict.fromkeys(scenario, 0)
+        elapsed = dict.fromkeys(scenario, 0.0)
+
+        # Подсчет переходов в поток: каждый вызов SyncToAsync - один переход
+        original_call = SyncToAsync.__call__
+        current = []
+
+        async def counting_call(self, *args, **kwargs):
+            if current:
+                hops[current[0]] += 1
+            return await original_call(self, *args, **kwargs)
+
+        async def run():
+            update_id = 0
+            for _ in range(count):
+                for data in scenario:
+                    update_id += 1
+                    update = types.Update(**make_callback_update(update_id, data, user_id))
+                    current[:] = [data]
+                    start = time.perf_counter()
+                    await views.bot.dp.feed_update(views.bot.bot, update)
+                    elapsed[data] += time.perf_counter() - start
+                    current.clear()
+            await views.bot.bot.session.close()
+
+        SyncToAsync.__call__ = counting_call
+        try:
+            asyncio.run(run())
+        finally:
+            SyncToAsync.__call__ = original_call
+            fake_api.stop()
+            customer.delete()
+            category.delete()
+
+        for data in hops:
+            # Обработчики, вызванные дважды за сценарий, учитываются по каждому вызову
+            calls = count * scenario.count(data)
+            self.stdout.write(f'{data:<20} {hops[data] / calls:5.1f} переходов, '
+                              f'{elapsed[data] / calls * 1000:6.2f} мс на вызов')
+
+    def bench_db(self, count):
+        """Пропускная способность запросов к БД при параллельных обновлениях в зависимости от размера пула"""
+        from asgiref.sync import sync_to_async
+        from django.db import connection
+
+        from bot.db import DatabaseExecutor
+
+        def query():
+            # Запрос с задержкой 2 мс имитирует сетевую задержку до сервера БД
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_sleep(0.002)')
+
+        async def run(call):
+            # 64 обновления одновременно ждут БД
+            semaphore = asyncio.Semaphore(64)
+
+            async def task():
+                async with semaphore:
+                    await call(query)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(task() for _ in range(count)))
+            return time.perf_counter() - start
+
+        elapsed = asyncio.run(run(lambda func: sync_to_async(func)()))
+        self.stdout.write(f'sync_to_async (общий поток): {count / elapsed:8.1f} запросов/с')
+        for threads in (1, 2, 4, 8, 16):
+            executor = DatabaseExecutor(threads=threads)
+            try:
+                elapsed = asyncio.run(run(executor.run))
+            finally:
+                executor.shutdown()
+            self.stdout.write(f'Пул БД, {threads:>2} потоков:          {count / elapsed:8.1f} запросов/с')
+
+    def bench_search(self, count, products=500000):
+        """Поиск товаров: ILIKE по title/description против индекса search_vector на большом каталоге"""
+        from django.db import connection
+        from django.db.models import Q
+
+        from bot import search
+        from bot.models import Category, Product
+
+        adjectives = ['Крепкий', 'Мягкий', 'Ароматный', 'Свежий', 'Молотый', 'Зерновой', 'Растворимый',
+                      'Элитный', 'Горький', 'Сладкий', 'Ванильный', 'Ореховый', 'Шоколадный']
+        nouns = ['кофе', 'чай', 'какао', 'эспрессо', 'капучино', 'латте', 'раф', 'мокко', 'пуэр', 'улун',
+                 'матча', 'сироп', 'десерт', 'круассан', 'чизкейк', 'штрудель', 'маффин']
+        origins = ['из Бразилии', 'из Колумбии', 'из Кении', 'из Эфиопии', 'из Китая', 'из Индии',
+                   'с Явы', 'с Суматры', 'из Вьетнама', 'из Перу', 'из Гватемалы']
+        queries = ['эспрессо', 'крепкий кофе', 'кения', 'ореховый латте', 'капуч', 'суматра',
+                   'шоколадные маффины', 'пуэрр']
+
+        category = Category.objects.create(title=f'bench-{time.time_ns()}')
+        try:
+            start = time.perf_counter()
+            with connection.cursor() as cursor:
+                # Каталог генерируется на стороне БД: перебор сочетаний слов по номеру строки
+                cursor.execute(
+                    """
+                    INSERT INTO bot_product (title, description, category_id, price, image, image_file_id, remainder)
+                    SELECT a[1 + i %% array_length(a, 1)] || ' ' || n[1 + (i / 13) %% array_length(n, 1)]
+                               || ' №' || i,
+                           'Товар ' || o[1 + (i / 221) %% array_length(o, 1)] || ', партия ' || i,
+                           %s, 100 + i %% 900, 'bench.jpg', '', 10
+                    FROM generate_series(1, %s) AS i,
+                         (SELECT %s::text[] AS a, %s::text[] AS n, %s::text[] AS o) AS words
+                    """,
+                    [category.id, products, adjectives, nouns, origins],
+                )
+                cursor.execute("SELECT gin_clean_pending_list('product_search_idx')")
+                cursor.execute('ANALYZE bot_product')
+            self.stdout.write(f'Каталог {products} товаров создан за {time.perf_counter() - start:.1f} с, '
+                              f'pg_trgm: {"есть" if search.trigram_available() else "нет"}')
+
+            def ilike(text):
+                # Прежний поиск админки: ILIKE по каждому слову в title и description
+                queryset = Product.objects.all()
+                for term in search.search_terms(text):
+                    queryset = queryset.filter(Q(title__icontains=term) | Q(description__icontains=term))
+                return list(queryset.only(*search.RESULT_FIELDS)[:10])
+
+            for text in queries:
+                for title, func in (('ILIKE', ilike), ('индекс', search.search_products)):
+                    found = func(text)
+                    start = time.perf_counter()
+                    for _ in range(count):
+                        func(text)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f'{text:<20} {title:<7} {elapsed / count * 1000:8.2f} мс, найдено {len(found)}')
+        finally:
+            # Товары удаляются каскадно
+            category.delete()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bot.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Отменяет неподтвержденные заказы с истекшим резервом и возвращает остатки на склад'
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f'✅ Освобождено резервов: {released}'))
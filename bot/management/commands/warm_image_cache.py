@@ -0,0 +1,37 @@
+import asyncio
+from functools import partial
+
+from aiogram import Bot
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bot.media import send_product_photo
+from bot.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Загружает изображения товаров в Telegram и сохраняет их file_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chat-id', type=int, required=True,
+                            help='Служебный чат, в который временно отправляются фото')
+
+    def handle(self, *args, **options):
+        warmed = asyncio.run(self.warm(options['chat_id']))
+        self.stdout.write(self.style.SUCCESS(f'✅ Сохранено file_id: {warmed}'))
+
+    async def warm(self, chat_id):
+        bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+        send_photo = partial(bot.send_photo, chat_id)
+        warmed = 0
+        try:
+            async for product in Product.objects.exclude(image='').filter(image_file_id=''):
+                try:
+                    message = await send_product_photo(send_photo, product)
+                    await bot.delete_message(chat_id, message.message_id)
+                    warmed += 1
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'❌ Товар {product.pk}: {e}'))
+        finally:
+            await bot.session.close()
+        return warmed
@@ -0,0 +1,36 @@
+# media.py
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+from bot.db import run_db
+from bot.models import Product
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+async def remember_file_id(product, file_id):
+    """Сохранение file_id, выданного Telegram для изображения товара"""
+    product.image_file_id = file_id
+    # Условие по image защищает от записи file_id старой картинки после ее замены
+    await run_db(Product.objects.filter(pk=product.pk, image=product.image.name).update, image_file_id=file_id)
+    logger.info(f"Сохранен file_id изображения товара {product.pk}")
+
+
+async def send_product_photo(send_photo, product, **kwargs):
+    """Отправка фото товара по сохраненному file_id или загрузкой файла с диска
+
+    send_photo - корутина отправки (например, Outbox.answer_photo), принимающая photo.
+    После первой загрузки file_id сохраняется в товаре и используется повторно.
+    """
+    if product.image_file_id:
+        try:
+            return await send_photo(photo=product.image_file_id, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning(f"file_id изображения товара {product.pk} недействителен: {e}")
+
+    message = await send_photo(photo=FSInputFile(product.image.path), **kwargs)
+    await remember_file_id(product, message.photo[-1].file_id)
+    return message
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0010_delete_manager"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="image_file_id",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0011_product_image_file_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="reserved_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="stock_reserved",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0012_order_stock_reservation"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE SEQUENCE IF NOT EXISTS bot_order_number_seq",
+            reverse_sql="DROP SEQUENCE IF EXISTS bot_order_number_seq",
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.6 on 2026-10-17 17:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0013_order_number_sequence"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="cart",
+            name="customer",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="bot.customer",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="cartitem",
+            name="cart",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="items",
+                to="bot.cart",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="customer",
+            name="telegram_id",
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name="order",
+            name="customer",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="bot.customer",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="cart",
+            index=models.Index(
+                fields=["customer"], include=("id",), name="cart_customer_covering_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="cartitem",
+            index=models.Index(
+                fields=["cart", "id"],
+                include=("product", "quantity"),
+                name="cartitem_cart_covering_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["customer", "order_date_time", "id"],
+                name="order_customer_date_idx",
+            ),
+        ),
+    ]
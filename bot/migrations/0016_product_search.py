@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-17 17:52
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0014_indexes_and_bigint_telegram_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.CombinedSearchVector(
+                    django.contrib.postgres.search.SearchVector(
+                        "title", config="russian", weight="A"
+                    ),
+                    "||",
+                    django.contrib.postgres.search.SearchVector(
+                        "description", config="russian", weight="B"
+                    ),
+                    django.contrib.postgres.search.SearchConfig("russian"),
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="product_search_idx"
+            ),
+        ),
+        # Триграммный индекс для поиска с опечатками создается, только если расширение pg_trgm
+        # доступно на сервере и его можно установить; иначе поиск обходится без него
+        migrations.RunSQL(
+            """
+            DO $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                    CREATE INDEX IF NOT EXISTS product_title_trgm_idx ON bot_product USING gin (title gin_trgm_ops);
+                END IF;
+            EXCEPTION WHEN insufficient_privilege THEN
+                RAISE NOTICE 'pg_trgm не установлен: недостаточно прав';
+            END
+            $$;
+            """,
+            reverse_sql="DROP INDEX IF EXISTS product_title_trgm_idx",
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:17
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0016_product_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("first_name"),
+                    name="text_pattern_ops",
+                ),
+                name="customer_first_name_upper_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("last_name"),
+                    name="text_pattern_ops",
+                ),
+                name="customer_last_name_upper_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("phone"),
+                    name="text_pattern_ops",
+                ),
+                name="customer_phone_upper_idx",
+            ),
+        ),
+    ]
@@ -1,5 +1,11 @@
+from decimal import Decimal
+
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Upper
 
 
 class Category(models.Model):
@@ -24,13 +30,24 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='media/products/')
+    image_file_id = models.CharField(max_length=255, blank=True, default='')  # file_id загруженного в Telegram фото
     remainder = models.IntegerField(default=1)
+    # Поисковый вектор (русская морфология): название весомее описания. Вычисляется БД
+    search_vector = models.GeneratedField(
+        expression=SearchVector('title', weight='A', config='russian')
+        + SearchVector('description', weight='B', config='russian'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     def __str__(self):
         return (f"{self.title} | {self.category} | {self.price}")
 
     class Meta:
         ordering = ['id', 'title']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_idx'),
+        ]
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
 
@@ -41,17 +58,46 @@ class Customer(models.Model):
     last_name = models.CharField(max_length=100)
     phone = models.CharField(max_length=100, unique=True)
     address = models.CharField(max_length=100)
-    telegram_id = models.CharField(max_length=100, unique=True)
+    telegram_id = models.BigIntegerField(unique=True)  # id пользователя Telegram, до 52 бит
 
     def __str__(self):
         return f'{self.first_name} {self.last_name} {self.phone}'
 
     class Meta:
         ordering = ['id', 'first_name', 'last_name']
+        indexes = [
+            # Поиск в админке по началу имени, фамилии и телефона без учета регистра
+            # (istartswith: UPPER(поле) LIKE 'ПРЕФИКС%')
+            models.Index(OpClass(Upper('first_name'), name='text_pattern_ops'), name='customer_first_name_upper_idx'),
+            models.Index(OpClass(Upper('last_name'), name='text_pattern_ops'), name='customer_last_name_upper_idx'),
+            models.Index(OpClass(Upper('phone'), name='text_pattern_ops'), name='customer_phone_upper_idx'),
+        ]
         verbose_name = 'Заказчик'
         verbose_name_plural = 'Заказчики'
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        '''Итоги заказа, посчитанные в БД одним запросом вместе с заказами
+
+        Итоги считаются коррелированными подзапросами, а не GROUP BY: при LIMIT
+        (страница заказов, список в админке) они вычисляются только для
+        выбранных заказов, а не для всей таблицы.
+        '''
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        return self.annotate(
+            annotated_total_items=Coalesce(
+                Subquery(items.annotate(total=Sum('quantity')).values('total')),
+                Value(0),
+            ),
+            annotated_total_price=Coalesce(
+                Subquery(items.annotate(total=Sum(F('quantity') * F('product__price'))).values('total')),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+
 class Order(models.Model):
     '''Модель заказа'''
     DELIVERY_METHOD_CHOICES = (('self_pickup', 'Самовывоз'),
@@ -65,19 +111,29 @@ class Order(models.Model):
                       ('cancelled', 'Отменен'))
 
     order_number = models.CharField(max_length=100, unique=True)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    # Отдельный индекс не нужен: customer - первый столбец индекса order_customer_date_idx
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
     delivery_method = models.CharField(max_length=100, choices=DELIVERY_METHOD_CHOICES, default='self_pickup')
     is_confirmed = models.BooleanField(default=False)
     order_date_time = models.DateTimeField(auto_now=False, auto_now_add=True)
     address = models.CharField(max_length=200, default='Не указан')
     status = models.CharField(max_length=100, choices=STATUS_CHOICES, default='created')
+    stock_reserved = models.BooleanField(default=False)  # остатки товаров списаны под заказ
+    reserved_until = models.DateTimeField(null=True, blank=True)  # срок резерва неподтвержденного заказа
+
+    objects = OrderQuerySet.as_manager()
 
     @property
     def total_price(self):
+        # Итог из with_totals(), иначе подсчет по элементам заказа
+        if hasattr(self, 'annotated_total_price'):
+            return self.annotated_total_price
         return sum(item.product.price * item.quantity for item in self.items.all())
 
     @property
     def total_items(self):
+        if hasattr(self, 'annotated_total_items'):
+            return self.annotated_total_items
         return sum(item.quantity for item in self.items.all())
 
     def get_delivery_method_display(self):
@@ -93,13 +149,19 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['order_date_time', 'order_number']
+        indexes = [
+            # Заказы заказчика по дате: постраничный список по ключу (order_date_time, id)
+            # и latest('order_date_time')
+            models.Index(fields=['customer', 'order_date_time', 'id'], name='order_customer_date_idx'),
+        ]
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
 
 
 class Cart(models.Model):
     '''Модель корзины'''
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    # Отдельный индекс не нужен: customer - первый столбец покрывающего индекса
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
 
     def __str__(self):
         return f'Корзина {self.customer}'
@@ -114,12 +176,17 @@ class Cart(models.Model):
 
     class Meta:
         ordering = ['id']
+        indexes = [
+            # Поиск корзины заказчика (cart__customer) без обращения к таблице
+            models.Index(fields=['customer'], include=['id'], name='cart_customer_covering_idx'),
+        ]
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
 
 class CartItem(models.Model):
     '''Модель элемента корзины'''
-    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    # Отдельный индекс не нужен: cart - первый столбец индексов ниже
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items', db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
@@ -131,6 +198,10 @@ class CartItem(models.Model):
         verbose_name = 'Элемент корзины'
         verbose_name_plural = 'Элементы корзины'
         unique_together = ['cart', 'product']  # Уникальная пара корзина-товар
+        indexes = [
+            # Покрывающий индекс содержимого корзины: строки читаются без обращения к таблице
+            models.Index(fields=['cart', 'id'], include=['product', 'quantity'], name='cartitem_cart_covering_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -0,0 +1,61 @@
+# pagination.py
+import json
+import logging
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def table_rows_estimate(model, using='default'):
+    """Оценка числа строк таблицы из статистики pg_class (обновляется ANALYZE и autovacuum)
+
+    Возвращает None, если статистики еще нет.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def query_rows_estimate(queryset):
+    """Оценка числа строк запроса планировщиком (EXPLAIN без выполнения)"""
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц: число строк берется из статистики PostgreSQL вместо COUNT(*)
+    Для списка без фильтров - оценка размера таблицы, для отфильтрованного - оценка
+    планировщика. Если оценка меньше exact_count_limit, строки считаются точно:
+    на небольших таблицах COUNT(*) дешев, а оценка может заметно ошибаться.
+    """
+
+    exact_count_limit = settings.ADMIN_EXACT_COUNT_LIMIT
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        if estimate is None or estimate < self.exact_count_limit:
+            return super().count
+        return estimate
+
+    def estimate(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or connections[queryset.db].vendor != 'postgresql':
+            return None
+        try:
+            if not queryset.query.where and not queryset.query.distinct:
+                return table_rows_estimate(queryset.model, queryset.db)
+            return query_rows_estimate(queryset)
+        except Exception as e:
+            logger.warning(f"Не удалось оценить число строк {queryset.model.__name__}: {e}")
+            return None
@@ -0,0 +1,87 @@
+# search.py
+import functools
+import logging
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F
+
+from bot.models import Product
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = 'russian'
+MAX_TERMS = 8
+RESULT_FIELDS = ('id', 'title', 'price', 'category_id')
+
+
+def search_terms(text):
+    """Слова запроса без знаков препинания, не больше MAX_TERMS"""
+    return re.findall(r'[^\W_]+', text.lower())[:MAX_TERMS]
+
+
+def full_text_query(text):
+    """Запрос в синтаксисе поисковых систем: слова, "фразы", -исключения"""
+    return SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+
+
+def prefix_query(terms):
+    """Запрос по началу слов: находит товары по недописанным словам ("эспр" -> "эспрессо")"""
+    return SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG)
+
+
+@functools.cache
+def trigram_available():
+    """Установлено ли расширение pg_trgm (миграция 0016 ставит его, только если оно доступно)"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        available = cursor.fetchone()[0]
+    if not available:
+        logger.info("Расширение pg_trgm не установлено, поиск с опечатками отключен")
+    return available
+
+
+def ranked(query, limit):
+    """Товары, подходящие под запрос, по убыванию релевантности (индекс product_search_idx)"""
+    return list(
+        Product.objects.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', 'id')
+        .only(*RESULT_FIELDS)[:limit]
+    )
+
+
+def similar(text, limit):
+    """Товары с похожим названием по триграммам (индекс product_title_trgm_idx)"""
+    return list(
+        Product.objects.filter(title__trigram_word_similar=text)
+        .annotate(similarity=TrigramWordSimilarity(text, 'title'))
+        .order_by('-similarity', 'id')
+        .only(*RESULT_FIELDS)[:limit]
+    )
+
+
+def search_products(text, limit=10):
+    """
+    Товары по свободному запросу
+    Сначала полнотекстовый поиск с русской морфологией, если ничего не найдено - по началу
+    слов, затем по похожим названиям (опечатки), если установлен pg_trgm
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+
+    products = ranked(full_text_query(text), limit) or ranked(prefix_query(terms), limit)
+    if products or not trigram_available():
+        return products
+    return similar(' '.join(terms), limit)
+
+
+def filter_products(queryset, text):
+    """Товары queryset, подходящие под запрос полностью или по началу слов (для админки)"""
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+    return queryset.filter(search_vector=full_text_query(text) | prefix_query(terms))
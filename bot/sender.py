@@ -0,0 +1,135 @@
+# sender.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не более capacity подряд"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        """Ожидание свободного токена"""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ThrottlingRequestMiddleware(BaseRequestMiddleware):
+    """Ограничение частоты запросов к Bot API и повтор после RetryAfter
+
+    Методы с chat_id (отправка и редактирование сообщений) проходят через общий
+    ограничитель бота и ограничитель конкретного чата. При ответе 429 запрос
+    повторяется после паузы, указанной Telegram.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chat_buckets = OrderedDict()
+        self.retries = 0
+
+    def chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self.chat_bucket(chat_id).acquire()
+                await self.global_bucket.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(f"Превышен лимит Bot API для {type(method).__name__}, "
+                               f"повтор через {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+
+
+class Outbox:
+    """Буфер исходящих сообщений в чат в рамках одного обновления
+
+    Подряд идущие тексты с одинаковым parse_mode склеиваются в одно сообщение.
+    Сообщение с клавиатурой отправляется сразу вместе с накопленными текстами,
+    остальное отправляется при flush в конце обработки обновления.
+    """
+
+    MAX_LENGTH = 4096
+
+    def __init__(self, bot, chat_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self._texts = []
+        self._parse_mode = None
+
+    async def answer(self, text, parse_mode=None, reply_markup=None):
+        """Отправка текста в чат с объединением подряд идущих сообщений"""
+        if self._texts and (parse_mode != self._parse_mode or
+                            len('\n'.join(self._texts + [text])) > self.MAX_LENGTH):
+            await self.flush()
+
+        self._texts.append(text)
+        self._parse_mode = parse_mode
+        if reply_markup is not None:
+            return await self.flush(reply_markup=reply_markup)
+
+    async def answer_photo(self, photo, **kwargs):
+        """Отправка фото после накопленных текстов"""
+        await self.flush()
+        return await self.bot.send_photo(self.chat_id, photo, **kwargs)
+
+    async def flush(self, reply_markup=None):
+        """Отправка накопленных текстов одним сообщением"""
+        if not self._texts:
+            return None
+
+        text = '\n'.join(self._texts)
+        self._texts = []
+        return await self.bot.send_message(self.chat_id, text, parse_mode=self._parse_mode,
+                                           reply_markup=reply_markup)
+
+
+class OutboxMiddleware(BaseMiddleware):
+    """Передает обработчикам Outbox текущего чата и отправляет остаток буфера"""
+
+    async def __call__(self, handler, event, data):
+        chat = data.get('event_chat')
+        if chat is None:
+            return await handler(event, data)
+
+        outbox = data['outbox'] = Outbox(data['bot'], chat.id)
+        try:
+            return await handler(event, data)
+        finally:
+            await outbox.flush()
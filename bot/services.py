@@ -1,38 +1,106 @@
 # services.py (обновленный с логированием)
-import random
 import string
+import threading
+from collections import deque
 from datetime import datetime
 import logging
 
+from django.conf import settings
+from django.db import connection, transaction
+
+from bot.inventory import reservation_deadline, reserve_stock, return_stock
+from bot.models import CartItem, Order, OrderItem
+
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
 
-def order_number_generator() -> str:
+ORDER_NUMBER_SEQUENCE = 'bot_order_number_seq'
+# Букв AA-ZZ и чисел 0000-9999: столько номеров в сутки различимы
+ORDER_NUMBER_SPACE = 26 * 26 * 10000
+# Множитель, взаимно простой с ORDER_NUMBER_SPACE: соседние значения
+# последовательности дают непохожие номера, а отображение остается взаимно однозначным
+ORDER_NUMBER_STEP = 7919
+
+
+def format_order_number(value, date) -> str:
     """
-    Генерирует уникальный номер заказа в формате AB1234DMY
-    где AB - случайные буквы, 1234 - случайное число, DMY - дата
+    Номер заказа в формате AB1234DDMMYY по значению последовательности.
+    Номера одного дня совпадают, только если между значениями
+    больше ORDER_NUMBER_SPACE заказов
     """
-    try:
-        # Генерация случайных букв (AB)
-        letters = ''.join(random.choices(string.ascii_uppercase, k=2))
+    code = value * ORDER_NUMBER_STEP % ORDER_NUMBER_SPACE
+    letters, numbers = divmod(code, 10000)
+    first, second = divmod(letters, 26)
+    return (f"{string.ascii_uppercase[first]}{string.ascii_uppercase[second]}{numbers:04d}"
+            f"{date.day:02d}{date.month:02d}{date.year % 100:02d}")
+
 
-        # Генерация случайного числа (1234)
-        numbers = str(random.randint(1000, 9999))
+class OrderNumberAllocator:
+    """
+    Выдает уникальные номера заказов из последовательности PostgreSQL
 
-        # Получение текущей даты (DMY)
-        now = datetime.now()
-        day = str(now.day).zfill(2)  # День с ведущим нулем
-        month = str(now.month).zfill(2)  # Месяц с ведущим нулем
-        year = str(now.year % 100).zfill(2)  # Последние 2 цифры года
+    Значения забираются из БД блоками по block_size одним запросом и
+    кешируются в процессе, поэтому обычно выдача номера не обращается к БД.
+    nextval не откатывается вместе с транзакцией, и один и тот же номер
+    не достается двум процессам. Неиспользованный остаток блока при
+    перезапуске процесса пропускается.
+    """
 
-        # Формирование полного номера
-        order_number = f"{letters}{numbers}{day}{month}{year}"
+    def __init__(self, block_size=50):
+        self.block_size = block_size
+        self._values = deque()
+        self._lock = threading.Lock()
 
-        logger.info(f"Сгенерирован номер заказа: {order_number}")
+    def _fetch_block(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT nextval('{ORDER_NUMBER_SEQUENCE}') FROM generate_series(1, %s)",
+                           [self.block_size])
+            self._values.extend(row[0] for row in cursor.fetchall())
+        logger.info(f"Получен блок из {self.block_size} номеров заказов")
+
+    def allocate(self) -> str:
+        """Следующий номер заказа"""
+        with self._lock:
+            if not self._values:
+                self._fetch_block()
+            value = self._values.popleft()
+        order_number = format_order_number(value, datetime.now())
+        logger.info(f"Выдан номер заказа: {order_number}")
         return order_number
 
-    except Exception as e:
-        logger.error(f"Ошибка при генерации номера заказа: {e}")
-        # Резервный вариант генерации
-        return f"EM{random.randint(1000, 9999)}{int(datetime.now().timestamp())}"
\ No newline at end of file
+
+order_numbers = OrderNumberAllocator(block_size=settings.ORDER_NUMBER_BLOCK_SIZE)
+
+
+def create_order_from_cart(customer, cart, delivery_method):
+    """
+    Создает заказ из корзины: сначала резервирует остатки товаров (если включен
+    STOCK_RESERVATION), затем одной транзакцией сохраняет заказ и все его
+    элементы. Если заказ сохранить не удалось, резерв возвращается на склад
+    Возвращает заказ и количество позиций в нем
+    """
+    items = list(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+    reserve = settings.STOCK_RESERVATION
+    if reserve:
+        reserve_stock(items)
+    try:
+        order_number = order_numbers.allocate()
+        with transaction.atomic():
+            order = Order.objects.create(
+                customer=customer,
+                order_number=order_number,
+                delivery_method=delivery_method,
+                address=customer.address,
+                stock_reserved=reserve,
+                reserved_until=reservation_deadline(settings.ORDER_RESERVATION_TTL) if reserve else None,
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product_id=product_id, quantity=quantity)
+                for product_id, quantity in items
+            )
+    except Exception:
+        if reserve:
+            return_stock(items)
+        raise
+    return order, len(items)
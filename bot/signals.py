@@ -0,0 +1,31 @@
+# signals.py
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from bot.catalog import catalog
+from bot.customers import customer_cache
+from bot.models import Category, Customer, Product
+
+
+@receiver(pre_save, sender=Product)
+def reset_image_file_id(sender, instance, **kwargs):
+    """Сброс file_id Telegram при замене изображения товара"""
+    if not instance.pk or not instance.image_file_id:
+        return
+
+    old_image = Product.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+    if old_image != instance.image.name:
+        instance.image_file_id = ''
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog(sender, **kwargs):
+    """Сброс кеша каталога при изменении категорий и товаров"""
+    catalog.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidate_customer(sender, instance, **kwargs):
+    """Сброс кеша заказчика при изменении его данных"""
+    customer_cache.invalidate(instance.telegram_id)
@@ -0,0 +1,27 @@
+# states.py
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State, StatesGroup
+
+
+class CartStates(StatesGroup):
+    """Состояния диалога корзины"""
+    waiting_quantity = State()
+
+
+class SearchStates(StatesGroup):
+    """Состояния поиска товаров"""
+    waiting_query = State()
+
+
+class ClearInputOnCallbackMiddleware(BaseMiddleware):
+    """Сбрасывает ожидание ввода (количества, поискового запроса) при нажатии кнопки
+
+    Пользователь ушел из диалога, и следующий текст уже не ответ на вопрос бота.
+    Кнопки, которые начинают ввод, ставят состояние заново в своих обработчиках.
+    """
+
+    async def __call__(self, handler, event, data):
+        state = data.get('state')
+        if state is not None and await state.get_state() is not None:
+            await state.clear()
+        return await handler(event, data)
@@ -0,0 +1,93 @@
+# storage.py
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from django.conf import settings
+
+
+class StateRecord:
+    """Состояние диалога одного чата"""
+
+    __slots__ = ('state', 'data', 'expires_at')
+
+    def __init__(self):
+        self.state = None
+        self.data = {}
+        self.expires_at = 0.0
+
+
+class ExpiringMemoryStorage(BaseStorage):
+    """Хранилище состояний FSM в памяти процесса с истечением через ttl секунд
+
+    Записи упорядочены по времени последнего изменения, поэтому устаревшие
+    удаляются с начала очереди за O(1) на запись. Пустые записи не хранятся.
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._records = OrderedDict()
+
+    def _purge(self):
+        now = time.monotonic()
+        while self._records and next(iter(self._records.values())).expires_at <= now:
+            self._records.popitem(last=False)
+
+    def _get(self, key):
+        self._purge()
+        return self._records.get(key)
+
+    def _touch(self, key):
+        self._purge()
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = StateRecord()
+        else:
+            self._records.move_to_end(key)
+        record.expires_at = time.monotonic() + self.ttl
+        return record
+
+    def _drop_if_empty(self, key, record):
+        if record.state is None and not record.data:
+            del self._records[key]
+
+    async def set_state(self, key, state=None):
+        record = self._touch(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._drop_if_empty(key, record)
+
+    async def get_state(self, key):
+        record = self._get(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = self._touch(key)
+        record.data = data.copy()
+        self._drop_if_empty(key, record)
+
+    async def get_data(self, key):
+        record = self._get(key)
+        return record.data.copy() if record is not None else {}
+
+    async def close(self):
+        self._records.clear()
+
+    def __len__(self):
+        return len(self._records)
+
+
+def build_storage():
+    """Хранилище состояний FSM по настройке TELEGRAM_FSM_STORAGE: memory или redis"""
+    if settings.TELEGRAM_FSM_STORAGE == 'redis':
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            settings.REDIS_URL,
+            state_ttl=settings.TELEGRAM_FSM_STATE_TTL,
+            data_ttl=settings.TELEGRAM_FSM_STATE_TTL,
+        )
+    return ExpiringMemoryStorage(ttl=settings.TELEGRAM_FSM_STATE_TTL)
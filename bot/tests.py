@@ -1,18 +1,64 @@
 # tests.py
+import asyncio
+import json
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 import pytest
 import logging
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
-from django.test import TestCase, RequestFactory
-from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from asgiref.sync import SyncToAsync, async_to_sync, sync_to_async
+from aiogram import Bot, types
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.methods import AnswerInlineQuery, EditMessageText, SendMessage
 
 from bot.bot import DjangoBot
 from bot.bot_utils import (
     get_welcome_text, update_phone, update_address, get_profile,
-    add_item_in_cart, get_cart_data, remove_item, change_cart_item_quantity, new_order
+    add_item_in_cart, get_cart_data, remove_item, change_cart_item_quantity, shift_cart_item_quantity,
+    new_order
 )
-from bot.models import Customer, Product, Cart, CartItem, Order
-from bot.services import order_number_generator
-from bot.views import webhook
+from bot.models import Customer, Category, Product, Cart, CartItem, Order, OrderItem
+from bot.services import OrderNumberAllocator, create_order_from_cart, format_order_number
+from bot import data
+from bot.catalog import Catalog
+from bot.data import cart_summary
+from bot.db import DatabaseExecutor, database_stats, warm_up_database, warm_up_database_blocking
+from bot.customers import CustomerCache, CustomerMiddleware, registered
+from bot.dedup import UpdateDeduplicator
+from bot.inventory import OutOfStock, commit_reservation, release_expired_reservations, release_reservation, \
+    reserve_stock
+from bot.inline import InlineResultsCache, inline_results_cache, render_result, results_page
+from bot.lifespan import LifespanMiddleware
+from bot.keyboards import DELIVERY_MENU, KeyboardCache, order_cursor, parse_order_cursor, product_keyboard, \
+    products_keyboard
+from bot.media import send_product_photo
+from bot.pagination import EstimatedCountPaginator
+from bot import search
+from bot.sender import Outbox, ThrottlingRequestMiddleware, TokenBucket
+from bot.states import CartStates
+from bot.storage import ExpiringMemoryStorage
+from bot.views import bot, webhook, async_webhook
+from bot.workers import UpdateWorkerPool, update_lane_key
+
+# Пул потоков БД в тестах отключен: TestCase держит данные в транзакции своего
+# соединения, а потоки пула работают в отдельных соединениях и их не видят
+no_db_executor = override_settings(DB_EXECUTOR_THREADS=0)
+
+
+def setUpModule():
+    no_db_executor.enable()
+
+
+def tearDownModule():
+    no_db_executor.disable()
 
 
 class TestBotUtils(TestCase):
@@ -36,30 +82,15 @@ class TestBotUtils(TestCase):
         mock_customer.phone = "+79991234567"
         mock_customer.address = "Test Address"
 
-        with patch('bot.bot_utils.Customer.objects.get') as mock_get:
-            # Настраиваем мок для синхронной функции
-            mock_get.return_value = mock_customer
-
-            # Используем sync_to_async для мока
-            with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                mock_sync.return_value = AsyncMock(return_value=mock_customer)
-
-                text = await get_welcome_text(self.user)
-                self.assertIn("С возвращением", text)
-                self.assertIn("Test", text)
+        with patch('bot.bot_utils.data.get_customer', AsyncMock(return_value=mock_customer)):
+            text = await get_welcome_text(self.user)
+            self.assertIn("С возвращением", text)
+            self.assertIn("Test", text)
 
     @pytest.mark.asyncio
     async def test_get_welcome_text_new_customer(self):
         """Тест приветственного текста для нового клиента"""
-        # Мокаем sync_to_async чтобы вызывать исключение Customer.DoesNotExist
-        with patch('bot.bot_utils.sync_to_async') as mock_sync:
-            # Создаем асинхронную функцию-заглушку, которая вызывает исключение
-            async def mock_async_func(*args, **kwargs):
-                from bot.models import Customer
-                raise Customer.DoesNotExist()
-
-            mock_sync.return_value = mock_async_func
-
+        with patch('bot.bot_utils.data.get_customer', AsyncMock(side_effect=Customer.DoesNotExist())):
             text = await get_welcome_text(self.user)
             self.assertIn("Добро пожаловать", text)
             self.assertIn("номер телефона", text)
@@ -67,38 +98,21 @@ class TestBotUtils(TestCase):
     @pytest.mark.asyncio
     async def test_update_phone_success(self):
         """Тест успешного обновления телефона"""
-        # Мокаем проверку существования телефона
-        with patch('bot.bot_utils.Customer.objects.filter') as mock_filter:
-            mock_filter.return_value.exclude.return_value.exists.return_value = False
-
-            # Мокаем get_or_create
-            mock_customer = Mock()
-            mock_customer.first_name = "Test"
-            mock_customer.last_name = "User"
-            mock_customer.phone = "+79991234567"
-            mock_customer.address = "Не указан"
-
-            with patch('bot.bot_utils.Customer.objects.get_or_create') as mock_get_or_create:
-                mock_get_or_create.return_value = (mock_customer, True)  # created = True
-
-                # Мокаем sync_to_async
-                with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                    # Первый вызов - проверка exists
-                    # Второй вызов - get_or_create
-                    mock_sync.side_effect = [
-                        AsyncMock(return_value=False),  # phone_exists = False
-                        AsyncMock(return_value=(mock_customer, True))  # get_or_create
-                    ]
+        mock_customer = Mock()
+        mock_customer.first_name = "Test"
+        mock_customer.last_name = "User"
+        mock_customer.phone = "+79991234567"
+        mock_customer.address = "Не указан"
 
-                    result = await update_phone(self.user, "+79991234567")
-                    self.assertIn("Номер телефона сохранен", result)
+        # Проверка телефона и get_or_create выполняются одним вызовом
+        with patch('bot.bot_utils.data.register_phone', AsyncMock(return_value=(mock_customer, True))):
+            result = await update_phone(self.user, "+79991234567")
+            self.assertIn("Номер телефона сохранен", result)
 
     @pytest.mark.asyncio
     async def test_update_phone_already_used(self):
         """Тест обновления телефона, который уже используется"""
-        with patch('bot.bot_utils.sync_to_async') as mock_sync:
-            mock_sync.return_value = AsyncMock(return_value=True)  # phone_exists = True
-
+        with patch('bot.bot_utils.data.register_phone', AsyncMock(return_value=None)):  # телефон занят
             result = await update_phone(self.user, "+79991234567")
             self.assertIn("уже используется", result)
 
@@ -111,31 +125,18 @@ class TestBotUtils(TestCase):
         mock_customer.phone = "+79991234567"
         mock_customer.address = "Old Address"
 
-        with patch('bot.bot_utils.Customer.objects.get') as mock_get:
-            mock_get.return_value = mock_customer
-
-            with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                # Первый вызов - get
-                # Второй вызов - save
-                mock_sync.side_effect = [
-                    AsyncMock(return_value=mock_customer),
-                    AsyncMock(return_value=None)  # save
-                ]
+        mock_customer.address = "New Address"
 
-                result = await update_address(self.user, "New Address")
-                self.assertIn("Регистрация завершена", result)
+        with patch('bot.bot_utils.data.save_address', AsyncMock(return_value=mock_customer)):
+            result = await update_address(self.user, "New Address")
+            self.assertIn("Регистрация завершена", result)
 
     @pytest.mark.asyncio
     async def test_update_address_customer_not_found(self):
         """Тест обновления адреса для несуществующего клиента"""
-        with patch('bot.bot_utils.Customer.objects.get') as mock_get:
-            mock_get.side_effect = Customer.DoesNotExist()
-
-            with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                mock_sync.return_value = AsyncMock(side_effect=Customer.DoesNotExist())
-
-                result = await update_address(self.user, "New Address")
-                self.assertIn("Сначала введите номер телефона", result)
+        with patch('bot.bot_utils.data.save_address', AsyncMock(side_effect=Customer.DoesNotExist())):
+            result = await update_address(self.user, "New Address")
+            self.assertIn("Сначала введите номер телефона", result)
 
 
 class TestCartFunctions(TestCase):
@@ -152,82 +153,724 @@ class TestCartFunctions(TestCase):
     @pytest.mark.asyncio
     async def test_add_item_to_cart_new(self):
         """Тест добавления нового товара в корзину"""
-        with patch('bot.bot_utils.Product.objects.get') as mock_product_get:
-            mock_product_get.return_value = self.product
+        with patch('bot.bot_utils.data.add_to_cart', AsyncMock(return_value=(self.product, True))):
+            result = await add_item_in_cart(self.customer, "1")
+            self.assertIn("добавлен в корзину", result)
+
+    @pytest.mark.asyncio
+    async def test_add_item_to_cart_existing(self):
+        """Тест добавления существующего товара в корзину"""
+        # Товар уже в корзине - количество увеличивается
+        with patch('bot.bot_utils.data.add_to_cart', AsyncMock(return_value=(self.product, False))):
+            result = await add_item_in_cart(self.customer, "1")
+            self.assertIn("Добавлена еще 1 шт.", result)
+
+    @pytest.mark.asyncio
+    async def test_remove_item_success(self):
+        """Тест успешного удаления товара из корзины"""
+        with patch('bot.bot_utils.data.remove_from_cart', AsyncMock(return_value=True)):
+            result = await remove_item(self.customer, "1")
+            self.assertIn("Товар удален из корзины", result)
+
+    @pytest.mark.asyncio
+    async def test_remove_item_not_found(self):
+        """Тест удаления несуществующего товара"""
+        with patch('bot.bot_utils.data.remove_from_cart', AsyncMock(side_effect=Exception("Not found"))):
+            result = await remove_item(self.customer, "999")
+            self.assertIn("Ошибка при удалении", result)
 
-            with patch('bot.bot_utils.CartItem.objects.filter') as mock_filter:
-                mock_filter.return_value.exists.return_value = False  # Товара нет в корзине
 
-                with patch('bot.bot_utils.CartItem.objects.create') as mock_create:
-                    with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                        mock_sync.side_effect = [
-                            AsyncMock(return_value=self.product),  # Product.objects.get
-                            AsyncMock(return_value=False),  # exists
-                            AsyncMock(return_value=None)  # create
-                        ]
+class TestCartView(TestCase):
+    """Тесты корзины одним сообщением"""
 
-                        result = await add_item_in_cart(self.cart, "1")
-                        self.assertIn("добавлен в корзину", result)
+    def setUp(self):
+        self.customer = Customer.objects.create(first_name='Test', last_name='User', phone='+79991234567',
+                                                address='Test Address', telegram_id=123456)
+        category = Category.objects.create(title='Кофе')
+        self.product = Product.objects.create(title='Эспрессо', category=category, price=100, image='coffee.jpg')
+        cart = Cart.objects.create(customer=self.customer)
+        self.cart_item = CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+
+    def test_cart_summary_single_query(self):
+        """Тест получения товаров и итогов корзины одним запросом при любом размере корзины"""
+        category = Category.objects.get(title='Кофе')
+        cart = Cart.objects.get(customer=self.customer)
+        for number in range(20):
+            product = Product.objects.create(title=f'Чай {number}', category=category, price='10.50', image='tea.jpg')
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+        with self.assertNumQueries(1):
+            cart_data, total_items, total_price = async_to_sync(cart_summary)(self.customer)
+
+        self.assertEqual(len(cart_data), 21)
+        self.assertEqual(cart_data[0], {'product__id': self.product.id, 'product__title': 'Эспрессо',
+                                        'product__price': Decimal('100.00'), 'quantity': 2})
+        self.assertEqual(total_items, 42)
+        self.assertEqual(total_price, Decimal('620.00'))
+
+    def test_cart_summary_empty(self):
+        """Тест итогов пустой корзины"""
+        self.cart_item.delete()
+        self.assertEqual(async_to_sync(cart_summary)(self.customer), ([], 0, 0))
+
+    def test_cart_view_is_single_message(self):
+        """Тест рендера корзины одним текстом с рядом кнопок на товар"""
+        cart_data = [
+            {'product__id': 1, 'product__title': 'Эспрессо', 'product__price': 100, 'quantity': 2},
+            {'product__id': 2, 'product__title': 'Латте', 'product__price': 150, 'quantity': 1},
+        ]
+        text, cart_menu = bot.get_cart_view(cart_data, 3, 350)
+
+        self.assertIn('1. Эспрессо - 100 ₽ | 2 шт.', text)
+        self.assertIn('Всего товаров: 3, Сумма: 350 ₽', text)
+        self.assertEqual(len(cart_menu.inline_keyboard), 4)
+        self.assertEqual(cart_menu.inline_keyboard[0][0].callback_data, 'cart_dec_1')
+
+    def test_empty_cart_view(self):
+        """Тест рендера пустой корзины"""
+        text, cart_menu = bot.get_cart_view([], 0, 0)
+        self.assertIn('пуста', text)
+        self.assertIsNone(cart_menu)
 
     @pytest.mark.asyncio
-    async def test_add_item_to_cart_existing(self):
-        """Тест добавления существующего товара в корзину"""
-        mock_cart_item = Mock()
-        mock_cart_item.quantity = 1
+    async def test_shift_quantity(self):
+        """Тест увеличения количества товара на единицу"""
+        result = await shift_cart_item_quantity(self.customer, self.product.id, 1)
 
-        with patch('bot.bot_utils.Product.objects.get') as mock_product_get:
-            mock_product_get.return_value = self.product
+        self.assertIn('Количество изменено', result)
+        await self.cart_item.arefresh_from_db()
+        self.assertEqual(self.cart_item.quantity, 3)
 
-            with patch('bot.bot_utils.CartItem.objects.filter') as mock_filter:
-                mock_filter.return_value.exists.return_value = True  # Товар уже в корзине
+    @pytest.mark.asyncio
+    async def test_shift_quantity_to_zero_removes_item(self):
+        """Тест удаления товара при уменьшении количества до нуля"""
+        await shift_cart_item_quantity(self.customer, self.product.id, -1)
+        result = await shift_cart_item_quantity(self.customer, self.product.id, -1)
 
-                with patch('bot.bot_utils.CartItem.objects.get') as mock_get:
-                    mock_get.return_value = mock_cart_item
+        self.assertIn('удален', result)
+        self.assertFalse(await CartItem.objects.filter(pk=self.cart_item.pk).aexists())
 
-                    with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                        mock_sync.side_effect = [
-                            AsyncMock(return_value=self.product),  # Product.objects.get
-                            AsyncMock(return_value=True),  # exists
-                            AsyncMock(return_value=mock_cart_item),  # get
-                            AsyncMock(return_value=None)  # save
-                        ]
 
-                        result = await add_item_in_cart(self.cart, "1")
-                        self.assertIn("Добавлена еще 1 шт.", result)
+    @pytest.mark.asyncio
+    async def test_change_quantity_uses_conversation_state(self):
+        """Тест ввода количества через состояние диалога без регистрации обработчиков"""
+        user = {'id': 123456, 'is_bot': False, 'first_name': 'Test'}
+        chat = {'id': 123456, 'type': 'private'}
+        callback_update = types.Update(update_id=1, callback_query={
+            'id': '1', 'from': user, 'chat_instance': '1', 'data': f'change_quantity_{self.product.id}',
+            'message': {'message_id': 10, 'date': 0, 'chat': chat, 'text': 'Корзина'},
+        })
+        message_update = types.Update(update_id=2, message={
+            'message_id': 11, 'date': 0, 'chat': chat, 'from': user, 'text': '5',
+        })
+        handlers_count = len(bot.dp.message.handlers)
+
+        with patch.object(Bot, '__call__', new_callable=AsyncMock) as api_call:
+            await bot.dp.feed_update(bot.bot, callback_update)
+            await bot.dp.feed_update(bot.bot, message_update)
+
+        await self.cart_item.arefresh_from_db()
+        self.assertEqual(self.cart_item.quantity, 5)
+        self.assertEqual(len(bot.dp.message.handlers), handlers_count)
+        edited = [call.args[0] for call in api_call.await_args_list if isinstance(call.args[0], EditMessageText)]
+        self.assertEqual(edited[0].message_id, 10)
+
+
+class TestDataAccess(TestCase):
+    """Тесты функций доступа к данным"""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(first_name='Test', last_name='User', phone='+79991234567',
+                                                address='Test Address', telegram_id=123456)
+        category = Category.objects.create(title='Кофе')
+        self.product = Product.objects.create(title='Эспрессо', category=category, price=100, image='coffee.jpg',
+                                              remainder=10)
+
+    def count_hops(self, use_case, *args):
+        """Вызов функции доступа к данным с подсчетом переходов в поток"""
+        with patch('asgiref.sync.SyncToAsync.__call__', autospec=True,
+                   side_effect=SyncToAsync.__call__) as hops:
+            result = async_to_sync(use_case)(*args)
+        return result, hops.call_count
+
+    def test_add_to_cart_single_hop(self):
+        """Тест добавления товара в корзину за один переход"""
+        (product, created), hops = self.count_hops(data.add_to_cart, self.customer, self.product.id)
+        self.assertTrue(created)
+        self.assertEqual(hops, 1)
+
+        (product, created), hops = self.count_hops(data.add_to_cart, self.customer, self.product.id)
+        self.assertFalse(created)
+        self.assertEqual(CartItem.objects.get(cart__customer=self.customer).quantity, 2)
+
+    def test_confirm_latest_order_clears_cart(self):
+        """Тест подтверждения заказа с очисткой корзины за один переход"""
+        async_to_sync(data.add_to_cart)(self.customer, self.product.id)
+        order, _ = async_to_sync(data.place_order)(self.customer, 'courier')
+
+        confirmed, hops = self.count_hops(data.confirm_latest_order, self.customer)
+
+        self.assertEqual(confirmed, 'confirmed')
+        self.assertEqual(hops, 1)
+        order.refresh_from_db()
+        self.assertEqual((order.is_confirmed, order.status), (True, 'pending'))
+        self.assertFalse(CartItem.objects.filter(cart__customer=self.customer).exists())
+
+    def test_cancel_customer_order_checks_owner(self):
+        """Тест запрета отмены чужого заказа"""
+        async_to_sync(data.add_to_cart)(self.customer, self.product.id)
+        order, _ = async_to_sync(data.place_order)(self.customer, 'courier')
+        stranger = Customer.objects.create(first_name='Other', last_name='User', phone='+79990000000',
+                                           address='Other Address', telegram_id=654321)
+
+        self.assertFalse(async_to_sync(data.cancel_customer_order)(stranger, order.id))
+        self.assertTrue(async_to_sync(data.cancel_customer_order)(self.customer, order.id))
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.remainder, 10)
+
+
+class TestStateStorage(TestCase):
+    """Тесты хранилища состояний диалогов"""
+
+    key = StorageKey(bot_id=1, chat_id=2, user_id=3)
 
     @pytest.mark.asyncio
-    async def test_remove_item_success(self):
-        """Тест успешного удаления товара из корзины"""
-        mock_cart_item = Mock()
+    async def test_state_and_data_roundtrip(self):
+        """Тест сохранения и очистки состояния"""
+        storage = ExpiringMemoryStorage(ttl=60)
+        await storage.set_state(self.key, CartStates.waiting_quantity)
+        await storage.set_data(self.key, {'product_id': '1'})
 
-        with patch('bot.bot_utils.Cart.objects.get') as mock_cart_get:
-            mock_cart_get.return_value = self.cart
+        self.assertEqual(await storage.get_state(self.key), CartStates.waiting_quantity.state)
+        self.assertEqual(await storage.get_data(self.key), {'product_id': '1'})
 
-            with patch('bot.bot_utils.Product.objects.get') as mock_product_get:
-                mock_product_get.return_value = self.product
+        await storage.set_state(self.key, None)
+        await storage.set_data(self.key, {})
+        self.assertEqual(len(storage), 0)
 
-                with patch('bot.bot_utils.CartItem.objects.get') as mock_cart_item_get:
-                    mock_cart_item_get.return_value = mock_cart_item
+    @pytest.mark.asyncio
+    async def test_reads_do_not_create_records(self):
+        """Тест отсутствия записей для чатов без состояния"""
+        storage = ExpiringMemoryStorage(ttl=60)
+        for user_id in range(100):
+            await storage.get_state(StorageKey(bot_id=1, chat_id=user_id, user_id=user_id))
+
+        self.assertEqual(len(storage), 0)
+
+    @pytest.mark.asyncio
+    async def test_state_expires(self):
+        """Тест истечения брошенного состояния"""
+        storage = ExpiringMemoryStorage(ttl=0)
+        await storage.set_state(self.key, CartStates.waiting_quantity)
 
-                    with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                        mock_sync.side_effect = [
-                            AsyncMock(return_value=self.cart),  # Cart.objects.get
-                            AsyncMock(return_value=self.product),  # Product.objects.get
-                            AsyncMock(return_value=mock_cart_item),  # CartItem.objects.get
-                            AsyncMock(return_value=None)  # delete
-                        ]
+        self.assertIsNone(await storage.get_state(self.key))
+        self.assertEqual(len(storage), 0)
 
-                        result = await remove_item(self.customer, "1")
-                        self.assertIn("Товар удален из корзины", result)
+
+class TestPendingInput(TestCase):
+    """Тесты ожидания ввода количества товара"""
+
+    user = {'id': 123456, 'is_bot': False, 'first_name': 'Test'}
+    chat = {'id': 123456, 'type': 'private'}
+
+    def context(self):
+        return bot.dp.fsm.get_context(bot.bot, chat_id=123456, user_id=123456)
+
+    def feed(self, update):
+        async def run():
+            await self.context().set_state(CartStates.waiting_quantity)
+            with patch.object(Bot, '__call__', new_callable=AsyncMock) as api_call:
+                await bot.dp.feed_update(bot.bot, update)
+            state = await self.context().get_state()
+            await self.context().clear()
+            return [call.args[0] for call in api_call.await_args_list], state
+
+        return async_to_sync(run)()
+
+    def test_command_is_not_taken_for_quantity(self):
+        """Тест: /search во время запроса количества выполняет поиск"""
+        update = types.Update(update_id=1, message={
+            'message_id': 1, 'date': 0, 'chat': self.chat, 'from': self.user, 'text': '/search арабика',
+        })
+        with patch('bot.bot.data.search_products', new_callable=AsyncMock, return_value=[]):
+            calls, state = self.feed(update)
+
+        texts = [call.text for call in calls if isinstance(call, SendMessage)]
+        self.assertIn('арабика', texts[-1])
+        self.assertNotIn('числом', texts[-1])
+        self.assertIsNone(state)
+
+    def test_non_numeric_text_is_rejected(self):
+        """Тест: текст вместо числа - подсказка, состояние сохраняется"""
+        update = types.Update(update_id=2, message={
+            'message_id': 2, 'date': 0, 'chat': self.chat, 'from': self.user, 'text': 'пять',
+        })
+        calls, state = self.feed(update)
+
+        self.assertIn('числом', calls[-1].text)
+        self.assertEqual(state, CartStates.waiting_quantity.state)
+
+    def test_other_button_clears_pending_input(self):
+        """Тест: нажатие другой кнопки сбрасывает ожидание количества"""
+        update = types.Update(update_id=3, callback_query={
+            'id': '3', 'from': self.user, 'chat_instance': '1', 'data': 'categories',
+            'message': {'message_id': 10, 'date': 0, 'chat': self.chat, 'text': 'Меню'},
+        })
+        _, state = self.feed(update)
+
+        self.assertIsNone(state)
+
+
+class TestProductImageCache(TestCase):
+    """Тесты кеша file_id изображений товаров"""
+
+    def setUp(self):
+        category = Category.objects.create(title='Кофе')
+        self.product = Product.objects.create(title='Эспрессо', category=category, price=100,
+                                              image='media/products/coffee.jpg')
 
     @pytest.mark.asyncio
-    async def test_remove_item_not_found(self):
-        """Тест удаления несуществующего товара"""
-        with patch('bot.bot_utils.sync_to_async') as mock_sync:
-            mock_sync.side_effect = Exception("Not found")
+    async def test_first_view_uploads_and_remembers_file_id(self):
+        """Тест загрузки файла и сохранения file_id при первом просмотре"""
+        message = Mock()
+        message.photo = [Mock(file_id='small'), Mock(file_id='large')]
+        send_photo = AsyncMock(return_value=message)
 
-            result = await remove_item(self.customer, "999")
-            self.assertIn("Ошибка при удалении", result)
+        await send_product_photo(send_photo, self.product, caption='Эспрессо')
+
+        self.assertNotIsInstance(send_photo.await_args.kwargs['photo'], str)
+        await self.product.arefresh_from_db()
+        self.assertEqual(self.product.image_file_id, 'large')
+
+    @pytest.mark.asyncio
+    async def test_next_view_sends_file_id(self):
+        """Тест отправки по сохраненному file_id без загрузки файла"""
+        self.product.image_file_id = 'cached'
+        send_photo = AsyncMock()
+
+        await send_product_photo(send_photo, self.product)
+
+        send_photo.assert_awaited_once_with(photo='cached')
+
+    def test_image_change_resets_file_id(self):
+        """Тест сброса file_id при замене изображения"""
+        Product.objects.filter(pk=self.product.pk).update(image_file_id='cached')
+        product = Product.objects.get(pk=self.product.pk)
+        product.image = 'media/products/5070.jpg'
+        product.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.image_file_id, '')
+
+    def test_other_changes_keep_file_id(self):
+        """Тест сохранения file_id при изменении других полей"""
+        Product.objects.filter(pk=self.product.pk).update(image_file_id='cached')
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = 200
+        product.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.image_file_id, 'cached')
+
+
+class TestCatalog(TestCase):
+    """Тесты кеша каталога"""
+
+    def setUp(self):
+        self.category = Category.objects.create(title='Кофе')
+        self.product = Product.objects.create(title='Эспрессо', category=self.category, price=100,
+                                              image='media/products/coffee.jpg')
+        self.catalog = Catalog()
+
+    def test_browsing_does_not_touch_db_after_load(self):
+        """Тест просмотра каталога без запросов к БД после загрузки"""
+        async_to_sync(self.catalog.categories)()
+        async_to_sync(self.catalog.products)(self.category.id)
+
+        with self.assertNumQueries(0):
+            categories = async_to_sync(self.catalog.categories)()
+            products = async_to_sync(self.catalog.products)(self.category.id)
+            product = async_to_sync(self.catalog.product)(self.product.id)
+            caption = self.catalog.caption(product)
+
+        self.assertEqual([category.title for category in categories], ['Кофе'])
+        self.assertEqual([product.id for product in products], [self.product.id])
+        self.assertEqual(product.category_id, self.category.id)
+        self.assertIn('Эспрессо', caption)
+
+    @pytest.mark.asyncio
+    async def test_invalidate_reloads_catalog(self):
+        """Тест перезагрузки каталога после сброса версии"""
+        await self.catalog.categories()
+        await Category.objects.acreate(title='Чай')
+        self.catalog.invalidate()
+
+        categories = await self.catalog.categories()
+        self.assertEqual(len(categories), 2)
+
+    def test_model_signals_invalidate_catalog(self):
+        """Тест сброса кеша каталога сигналами при изменении товара"""
+        from bot.catalog import catalog
+
+        version = catalog.version
+        self.product.price = 200
+        self.product.save()
+        self.assertGreater(catalog.version, version)
+
+        version = catalog.version
+        self.category.delete()
+        self.assertGreater(catalog.version, version)
+
+    def test_categories_load_lazily(self):
+        """Тест: загружаются только товары открытой категории"""
+        other = Category.objects.create(title='Чай')
+        Product.objects.create(title='Улун', category=other, price=100, image='p.jpg')
+
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(self.catalog.categories)()
+            products = async_to_sync(self.catalog.products)(self.category.id)
+
+        self.assertEqual([product.id for product in products], [self.product.id])
+        self.assertEqual(len(queries), 2)
+        self.assertIn(f'"category_id" = {self.category.id}', queries[1]['sql'])
+
+    def test_concurrent_requests_share_one_load(self):
+        """Тест: одновременные запросы устаревшего каталога выполняют одну загрузку"""
+        async def browse():
+            return await asyncio.gather(*(self.catalog.products(self.category.id) for _ in range(10)))
+
+        with self.assertNumQueries(1):
+            results = async_to_sync(browse)()
+
+        self.assertTrue(all(products is results[0] for products in results))
+
+    @pytest.mark.asyncio
+    async def test_unknown_product(self):
+        """Тест запроса несуществующего товара"""
+        self.assertIsNone(await self.catalog.product(10**6))
+
+    def test_products_pages(self):
+        """Тест страниц товаров категории по ключу id без запросов к БД"""
+        Product.objects.bulk_create(
+            Product(title=f'Товар {i}', category=self.category, price=100, image='p.jpg') for i in range(6)
+        )
+        ids = list(Product.objects.filter(category=self.category).values_list('id', flat=True))
+
+        with self.assertNumQueries(1):
+            first, start, total = async_to_sync(self.catalog.products_page)(self.category.id, limit=3)
+        with self.assertNumQueries(0):
+            second, second_start, _ = async_to_sync(self.catalog.products_page)(
+                self.category.id, first[-1].id, limit=3)
+            back, back_start, _ = async_to_sync(self.catalog.products_page)(
+                self.category.id, second[0].id, before=True, limit=3)
+            last, last_start, _ = async_to_sync(self.catalog.products_page)(self.category.id, ids[-2], limit=3)
+
+        self.assertEqual(total, 7)
+        self.assertEqual(([product.id for product in first], start), (ids[:3], 0))
+        self.assertEqual(([product.id for product in second], second_start), (ids[3:6], 3))
+        self.assertEqual(([product.id for product in back], back_start), (ids[:3], 0))
+        self.assertEqual(([product.id for product in last], last_start), (ids[-1:], 6))
+
+
+class TestProductSearch(TestCase):
+    """Тесты поиска товаров"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Кофе')
+        cls.espresso = Product.objects.create(title='Эспрессо', category=category, price=100, image='e.jpg',
+                                              description='Крепкий кофе из зерен арабики')
+        cls.beans = Product.objects.create(title='Кофейные зерна', category=category, price=500, image='b.jpg',
+                                           description='Обжарка для эспрессо')
+        Product.objects.bulk_create(
+            Product(title=f'Чай {i}', category=category, price=50, image='t.jpg', description='Листовой чай')
+            for i in range(5000)
+        )
+        with connection.cursor() as cursor:
+            # Строки из очереди GIN (fastupdate) переносятся в индекс, как это сделал бы autovacuum
+            cursor.execute("SELECT gin_clean_pending_list('product_search_idx')")
+            cursor.execute('ANALYZE bot_product')
+
+    def titles(self, text):
+        return [product.title for product in search.search_products(text)]
+
+    def test_russian_morphology(self):
+        """Тест поиска по словоформам: «кофейный» находит «Кофейные», «зерно» - «зерна»"""
+        self.assertEqual(self.titles('кофейный зерно'), ['Кофейные зерна'])
+
+    def test_title_outranks_description(self):
+        """Тест: совпадение в названии выше совпадения в описании"""
+        self.assertEqual(self.titles('эспрессо'), ['Эспрессо', 'Кофейные зерна'])
+
+    def test_prefix_fallback(self):
+        """Тест поиска по недописанному слову"""
+        self.assertEqual(self.titles('эспре'), ['Эспрессо', 'Кофейные зерна'])
+
+    def test_empty_query_skips_db(self):
+        """Тест запроса без слов"""
+        with self.assertNumQueries(0):
+            self.assertEqual(search.search_products('?!'), [])
+
+    def test_typo_without_trigram_extension(self):
+        """Тест: без pg_trgm опечатка не приводит к ошибке"""
+        with patch('bot.search.trigram_available', return_value=False):
+            self.assertEqual(self.titles('эспрэссо'), [])
+
+    def test_typo_with_trigram_extension(self):
+        """Тест поиска с опечаткой по триграммам"""
+        if not search.trigram_available():
+            self.skipTest('расширение pg_trgm недоступно')
+        self.assertEqual(self.titles('эспрэссо')[0], 'Эспрессо')
+
+    def test_search_uses_gin_index(self):
+        """Тест: полнотекстовый поиск идет по GIN-индексу"""
+        plan = Product.objects.filter(search_vector=search.full_text_query('эспрессо')).explain()
+        self.assertIn('product_search_idx', plan)
+
+    def test_admin_search_uses_index(self):
+        """Тест поиска в админке по search_vector"""
+        from django.contrib.admin.sites import site
+
+        product_admin = site._registry[Product]
+        queryset, may_have_duplicates = product_admin.get_search_results(None, Product.objects.all(), 'арабика')
+
+        self.assertEqual(list(queryset), [self.espresso])
+        self.assertFalse(may_have_duplicates)
+        self.assertIn('search_vector', str(queryset.query))
+
+    @pytest.mark.asyncio
+    async def test_free_text_search_flow(self):
+        """Тест: кнопка поиска, затем свободный текст возвращает найденные товары"""
+        user = {'id': 123456, 'is_bot': False, 'first_name': 'Test'}
+        chat = {'id': 123456, 'type': 'private'}
+        callback_update = types.Update(update_id=1, callback_query={
+            'id': '1', 'from': user, 'chat_instance': '1', 'data': 'search',
+            'message': {'message_id': 10, 'date': 0, 'chat': chat, 'text': 'Меню'},
+        })
+        message_update = types.Update(update_id=2, message={
+            'message_id': 11, 'date': 0, 'chat': chat, 'from': user, 'text': 'арабика',
+        })
+
+        with patch.object(Bot, '__call__', new_callable=AsyncMock) as api_call:
+            await bot.dp.feed_update(bot.bot, callback_update)
+            await bot.dp.feed_update(bot.bot, message_update)
+
+        sent = [call.args[0] for call in api_call.await_args_list if isinstance(call.args[0], SendMessage)]
+        self.assertIn('арабика', sent[-1].text)
+        self.assertEqual(sent[-1].reply_markup.inline_keyboard[0][0].callback_data, f'product_{self.espresso.id}')
+        state = await bot.dp.fsm.get_context(bot.bot, chat_id=123456, user_id=123456).get_state()
+        self.assertIsNone(state)
+
+
+class TestInlineMode(TestCase):
+    """Тесты inline-режима каталога"""
+
+    def setUp(self):
+        category = Category.objects.create(title='Кофе')
+        self.espresso = Product.objects.create(title='Эспрессо', category=category, price=100, image='e.jpg',
+                                               image_file_id='photo-file-id')
+        self.products = Product.objects.bulk_create(
+            Product(title=f'Кофе {i}', category=category, price=200, image='c.jpg') for i in range(30)
+        )
+        inline_results_cache.clear()
+
+    def inline_update(self, update_id, query, offset=''):
+        return types.Update(update_id=update_id, inline_query={
+            'id': str(update_id), 'from': {'id': 123456, 'is_bot': False, 'first_name': 'Test'},
+            'query': query, 'offset': offset,
+        })
+
+    def answer(self, update):
+        with patch.object(Bot, '__call__', new_callable=AsyncMock) as api_call:
+            async_to_sync(bot.dp.feed_update)(bot.bot, update)
+        return api_call.await_args.args[0]
+
+    def test_paged_answer(self):
+        """Тест ответа страницами по offset с cache_time"""
+        first = self.answer(self.inline_update(1, 'кофе'))
+        second = self.answer(self.inline_update(2, 'кофе', offset=first.next_offset))
+
+        self.assertIsInstance(first, AnswerInlineQuery)
+        self.assertEqual(len(first.results), settings.INLINE_PAGE_SIZE)
+        self.assertEqual(first.next_offset, str(settings.INLINE_PAGE_SIZE))
+        self.assertEqual(first.cache_time, settings.INLINE_CACHE_TIME)
+        self.assertEqual(len(second.results), 30 - settings.INLINE_PAGE_SIZE)
+        self.assertEqual(second.next_offset, '')
+        ids = [result.id for result in first.results + second.results]
+        self.assertEqual(len(set(ids)), 30)
+
+    def test_repeated_query_served_from_cache(self):
+        """Тест: повторный запрос, отличающийся регистром и пробелами, не обращается к БД"""
+        self.answer(self.inline_update(1, 'Эспрессо'))
+        hits = inline_results_cache.hits
+
+        with self.assertNumQueries(0):
+            answer = self.answer(self.inline_update(2, '  эспрессо '))
+
+        self.assertEqual(answer.results[0].id, str(self.espresso.id))
+        self.assertEqual(inline_results_cache.hits, hits + 1)
+
+    def test_catalog_change_invalidates_results(self):
+        """Тест: изменение товара сбрасывает результаты через версию каталога"""
+        self.answer(self.inline_update(1, 'эспрессо'))
+        self.espresso.title = 'Эспрессо двойной'
+        self.espresso.save()
+
+        answer = self.answer(self.inline_update(2, 'эспрессо'))
+        self.assertEqual(answer.results[0].title, 'Эспрессо двойной')
+
+    def test_render_uses_uploaded_photo_as_thumbnail(self):
+        """Тест: товар с загруженным фото отдается фото-результатом"""
+        photo = render_result(self.espresso, 'Эспрессо')
+        article = render_result(self.products[0], 'Кофе 0')
+
+        self.assertEqual(photo.type, 'photo')
+        self.assertEqual(photo.photo_file_id, 'photo-file-id')
+        self.assertEqual(article.type, 'article')
+        self.assertEqual(article.description, '200 ₽')
+
+    @override_settings(SITE_URL='https://shop.example')
+    def test_article_thumbnail_from_media_url(self):
+        """Тест: карточка без загруженного фото получает миниатюру по адресу картинки на сайте"""
+        article = render_result(self.products[0], 'Кофе 0')
+        self.assertEqual(article.thumbnail_url, f'https://shop.example{settings.MEDIA_URL}c.jpg')
+
+    @override_settings(SITE_URL='')
+    def test_article_without_site_url_has_no_thumbnail(self):
+        """Тест: без адреса сайта миниатюра не задается"""
+        self.assertIsNone(render_result(self.products[0], 'Кофе 0').thumbnail_url)
+
+    def test_results_page_offsets(self):
+        """Тест разбора offset"""
+        results = list(range(5))
+        self.assertEqual(results_page(results, '', 2), ([0, 1], '2'))
+        self.assertEqual(results_page(results, '4', 2), ([4], ''))
+        self.assertEqual(results_page(results, 'bad', 2), ([0, 1], '2'))
+
+    def test_cache_is_bounded(self):
+        """Тест вытеснения давно не использованных запросов"""
+        cache = InlineResultsCache(ttl=60, max_size=2)
+
+        async def build():
+            return ['result']
+
+        for key in ('a', 'b', 'a', 'c'):
+            async_to_sync(cache.get)(key, build)
+
+        self.assertEqual(list(cache._results), ['a', 'c'])
+        self.assertEqual(cache.hits, 1)
+
+
+class TestCustomerCache(TestCase):
+    """Тесты кеша заказчиков"""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(first_name='Test', last_name='User', phone='+79991234567',
+                                                address='Test Address', telegram_id=123456)
+        self.cache = CustomerCache(ttl=60, max_size=2)
+
+    def test_cached_lookup_does_not_touch_db(self):
+        """Тест повторного получения заказчика без запросов к БД"""
+        async_to_sync(self.cache.get)(123456)
+        async_to_sync(self.cache.get)(654321)
+
+        with self.assertNumQueries(0):
+            customer = async_to_sync(self.cache.get)(123456)
+            missing = async_to_sync(self.cache.get)(654321)  # отсутствие заказчика тоже кешируется
+
+        self.assertEqual(customer.pk, self.customer.pk)
+        self.assertIsNone(missing)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_cache_is_bounded(self):
+        """Тест вытеснения старых записей"""
+        for telegram_id in (1, 2, 3):
+            async_to_sync(self.cache.get)(telegram_id)
+
+        self.assertEqual(list(self.cache._customers), [2, 3])
+
+    def test_invalidated_on_address_update(self):
+        """Тест сброса записи при сохранении адреса"""
+        user = Mock(id=123456)
+        with patch('bot.signals.customer_cache', self.cache):
+            async_to_sync(self.cache.get)(123456)
+            async_to_sync(update_address)(user, 'New Address')
+            customer = async_to_sync(self.cache.get)(123456)
+
+        self.assertEqual(customer.address, 'New Address')
+
+    def test_registered(self):
+        """Тест проверки регистрации заказчика"""
+        self.assertIs(registered(self.customer), self.customer)
+        with self.assertRaises(Customer.DoesNotExist):
+            registered(None)
+
+    @pytest.mark.asyncio
+    async def test_middleware_injects_customer(self):
+        """Тест передачи заказчика обработчику"""
+        handler = AsyncMock()
+        middleware = CustomerMiddleware(self.cache)
+
+        await middleware(handler, Mock(inline_query=None), {'event_from_user': Mock(id=123456)})
+
+        self.assertEqual(handler.await_args.args[1]['customer'].pk, self.customer.pk)
+
+    @pytest.mark.asyncio
+    async def test_middleware_skips_inline_queries(self):
+        """Тест: inline-запрос не загружает заказчика"""
+        handler = AsyncMock()
+        middleware = CustomerMiddleware(self.cache)
+
+        await middleware(handler, Mock(inline_query=Mock()), {'event_from_user': Mock(id=123456)})
+
+        self.assertIsNone(handler.await_args.args[1]['customer'])
+        self.assertEqual(self.cache.misses, 0)
+
+
+class TestKeyboards(TestCase):
+    """Тесты реестра клавиатур"""
+
+    def test_static_keyboards_are_reused(self):
+        """Тест повторного использования статичных клавиатур"""
+        self.assertIs(bot.get_inline_menu(), bot.get_inline_menu())
+        self.assertEqual(
+            [row[0].callback_data for row in DELIVERY_MENU.inline_keyboard],
+            [f'delivery_{method}' for method, _ in Order.DELIVERY_METHOD_CHOICES]
+        )
+
+    def test_parametrized_keyboard_is_memoized(self):
+        """Тест кеширования параметризованной клавиатуры"""
+        self.assertIs(product_keyboard(1, 2), product_keyboard(1, 2))
+        self.assertEqual(product_keyboard(1, 2).inline_keyboard[1][0].callback_data, 'category_2')
+
+    def test_products_page_navigation(self):
+        """Тест кнопок перехода между страницами товаров"""
+        products = [Mock(id=product_id, title=f'Товар {product_id}') for product_id in (11, 12)]
+
+        first = products_keyboard(5, products, 0, 6, generation=-1)
+        middle = products_keyboard(5, products, 2, 6, generation=-1)
+        single = products_keyboard(5, products, 0, 2, generation=-1)
+
+        self.assertEqual([button.callback_data for button in first.inline_keyboard[2]], ['cat_5_next_12'])
+        self.assertEqual([button.callback_data for button in middle.inline_keyboard[2]],
+                         ['cat_5_prev_11', 'cat_5_next_12'])
+        self.assertEqual(len(single.inline_keyboard), 3)
+        self.assertLessEqual(max(len(button.callback_data.encode()) for row in middle.inline_keyboard
+                                 for button in row), 64)
+
+    def test_cache_is_bounded(self):
+        """Тест вытеснения давно не использованных клавиатур"""
+        cache = KeyboardCache(max_size=2)
+        cache.get('a', lambda: 'A')
+        cache.get('b', lambda: 'B')
+        cache.get('a', lambda: 'A2')
+        cache.get('c', lambda: 'C')
+
+        self.assertEqual(cache.get('a', lambda: 'A3'), 'A')
+        self.assertEqual(cache.get('b', lambda: 'B2'), 'B2')
+        self.assertEqual(cache.hits, 2)
 
 
 class TestOrderFunctions(TestCase):
@@ -245,71 +888,582 @@ class TestOrderFunctions(TestCase):
         mock_order.order_number = "AB1234010125"
         mock_order.get_delivery_method_display.return_value = "Самовывоз"
 
-        mock_cart_items = [Mock(), Mock()]
+        with patch('bot.bot_utils.data.place_order', AsyncMock(return_value=(mock_order, 2))):
+            result = await new_order(self.customer, "self_pickup")
+            self.assertIn("Заказ успешно создан", result)
+            self.assertIn("AB1234010125", result)
 
-        with patch('bot.bot_utils.order_number_generator') as mock_generator:
-            mock_generator.return_value = "AB1234010125"
+    @pytest.mark.asyncio
+    async def test_new_order_error(self):
+        """Тест ошибки при создании заказа"""
+        with patch('bot.bot_utils.data.place_order', AsyncMock(side_effect=Exception("Database error"))):
+            result = await new_order(self.customer, "self_pickup")
+            self.assertIn("Ошибка при создании заказа", result)
 
-            with patch('bot.bot_utils.Order.objects.create') as mock_order_create:
-                mock_order_create.return_value = mock_order
 
-                with patch('bot.bot_utils.CartItem.objects.filter') as mock_filter:
-                    mock_filter.return_value.select_related.return_value = mock_cart_items
+class TestOrderTotals(TestCase):
+    """Тесты итогов заказа, посчитанных в БД"""
 
-                    with patch('bot.bot_utils.OrderItem.objects.create') as mock_order_item_create:
-                        with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                            mock_sync.side_effect = [
-                                AsyncMock(return_value="AB1234010125"),  # order_number_generator
-                                AsyncMock(return_value=mock_order),  # Order.objects.create
-                                AsyncMock(return_value=mock_cart_items),  # CartItem.objects.filter
-                                AsyncMock(return_value=None),  # OrderItem.objects.create
-                                AsyncMock(return_value=None)  # OrderItem.objects.create (второй раз)
-                            ]
+    def setUp(self):
+        customer = Customer.objects.create(first_name='Test', last_name='User', phone='+79991234567',
+                                           address='Test Address', telegram_id=123456)
+        category = Category.objects.create(title='Кофе')
+        espresso = Product.objects.create(title='Эспрессо', category=category, price=100, image='coffee.jpg')
+        latte = Product.objects.create(title='Латте', category=category, price='150.50', image='latte.jpg')
+        self.order = Order.objects.create(order_number='AB1234010125', customer=customer)
+        OrderItem.objects.create(order=self.order, product=espresso, quantity=2)
+        OrderItem.objects.create(order=self.order, product=latte, quantity=1)
+        Order.objects.create(order_number='AB1235010125', customer=customer)
+
+    def test_with_totals_single_query(self):
+        """Тест итогов всех заказов одним запросом"""
+        with self.assertNumQueries(1):
+            orders = {order.order_number: order for order in Order.objects.with_totals()}
+            self.assertEqual(orders['AB1234010125'].total_items, 3)
+            self.assertEqual(orders['AB1234010125'].total_price, Decimal('350.50'))
+            self.assertEqual(orders['AB1235010125'].total_items, 0)
+            self.assertEqual(orders['AB1235010125'].total_price, 0)
+
+    def test_totals_without_annotation(self):
+        """Тест подсчета итогов по элементам без with_totals"""
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(order.total_items, 3)
+        self.assertEqual(order.total_price, Decimal('350.50'))
+
+
+class TestOrderPages(TestCase):
+    """Тесты постраничной истории заказов"""
 
-                            result = await new_order(self.customer, self.cart, "self_pickup")
-                            self.assertIn("Заказ успешно создан", result)
-                            self.assertIn("AB1234010125", result)
+    def setUp(self):
+        self.customer = Customer.objects.create(first_name='Test', last_name='User', phone='+79991234567',
+                                                address='Test Address', telegram_id=123456)
+        other = Customer.objects.create(first_name='Other', last_name='User', phone='+79990000000',
+                                        address='Other Address', telegram_id=654321)
+        category = Category.objects.create(title='Кофе')
+        self.product = Product.objects.create(title='Эспрессо', category=category, price=100, image='coffee.jpg')
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        for i in range(12):
+            order = Order.objects.create(order_number=f'AB{i:04d}010125', customer=self.customer, status='pending')
+            OrderItem.objects.create(order=order, product=self.product, quantity=i + 1)
+            # Заказы парами с одинаковым временем: порядок внутри пары задает id
+            Order.objects.filter(pk=order.pk).update(order_date_time=start + timedelta(minutes=i // 2))
+        Order.objects.create(order_number='XX0001010125', customer=other)
+        self.expected = list(Order.objects.filter(customer=self.customer)
+                             .order_by('-order_date_time', '-id').values_list('order_number', flat=True))
+
+    def page(self, cursor=None, newer=False, limit=5):
+        return async_to_sync(data.customer_orders_page)(self.customer, cursor, newer=newer, limit=limit)
+
+    def test_walk_older_pages(self):
+        """Тест обхода всех заказов от новых к старым без пропусков и повторов"""
+        seen = []
+        orders, has_older, has_newer = self.page()
+        self.assertFalse(has_newer)
+        while True:
+            seen += [order.order_number for order in orders]
+            if not has_older:
+                break
+            orders, has_older, has_newer = self.page((orders[-1].order_date_time, orders[-1].id))
+            self.assertTrue(has_newer)
+
+        self.assertEqual(seen, self.expected)
+
+    def test_newer_page_returns_back(self):
+        """Тест возврата к более новой странице"""
+        first, _, _ = self.page()
+        second, _, _ = self.page((first[-1].order_date_time, first[-1].id))
+
+        orders, has_older, has_newer = self.page((second[0].order_date_time, second[0].id), newer=True)
+
+        self.assertEqual([order.pk for order in orders], [order.pk for order in first])
+        self.assertTrue(has_older)
+        self.assertFalse(has_newer)
+
+    def test_page_is_single_query_with_totals(self):
+        """Тест страницы с итогами одним запросом"""
+        with self.assertNumQueries(1):
+            orders, _, _ = self.page(limit=3)
+            totals = [(order.total_items, order.total_price) for order in orders]
+
+        self.assertEqual(totals, [(12, Decimal('1200')), (11, Decimal('1100')), (10, Decimal('1000'))])
+
+    def test_cursor_round_trip(self):
+        """Тест кодирования ключа заказа в callback_data"""
+        order = Order.objects.filter(customer=self.customer).latest('order_date_time')
+        order.order_date_time += timedelta(microseconds=123457)
+
+        self.assertEqual(parse_order_cursor(order_cursor(order)), (order.order_date_time, order.id))
+
+    def test_orders_view(self):
+        """Тест рендера страницы заказов одним сообщением"""
+        orders, has_older, has_newer = self.page()
+        text, orders_menu = bot.get_orders_view(orders, has_older, has_newer)
+
+        self.assertEqual(text.count('📦'), 5)
+        navigation = orders_menu.inline_keyboard[-1]
+        self.assertEqual([button.text for button in navigation], ['Старее ➡️'])
+        self.assertEqual(navigation[0].callback_data, f'orders_older_{order_cursor(orders[-1])}')
 
     @pytest.mark.asyncio
-    async def test_new_order_error(self):
-        """Тест ошибки при создании заказа"""
-        with patch('bot.bot_utils.sync_to_async') as mock_sync:
-            mock_sync.side_effect = Exception("Database error")
-
-            result = await new_order(self.customer, self.cart, "self_pickup")
-            self.assertIn("Ошибка при создании заказа", result)
+    async def test_navigation_edits_message(self):
+        """Тест перехода к следующей странице редактированием сообщения"""
+        user = {'id': 123456, 'is_bot': False, 'first_name': 'Test'}
+        chat = {'id': 123456, 'type': 'private'}
+        first = [order async for order in Order.objects.filter(customer=self.customer)
+                 .order_by('-order_date_time', '-id')[:settings.ORDERS_PAGE_SIZE]]
+        update = types.Update(update_id=1, callback_query={
+            'id': '1', 'from': user, 'chat_instance': '1', 'data': f'orders_older_{order_cursor(first[-1])}',
+            'message': {'message_id': 10, 'date': 0, 'chat': chat, 'text': 'Заказы'},
+        })
+
+        with patch.object(Bot, '__call__', new_callable=AsyncMock) as api_call:
+            await bot.dp.feed_update(bot.bot, update)
+
+        edited = [call.args[0] for call in api_call.await_args_list if isinstance(call.args[0], EditMessageText)]
+        self.assertEqual(len(edited), 1)
+        self.assertEqual(edited[0].message_id, 10)
+        self.assertIn(self.expected[settings.ORDERS_PAGE_SIZE], edited[0].text)
+        self.assertNotIn(first[0].order_number, edited[0].text)
 
 
 class TestServices(TestCase):
     """Тесты сервисных функций"""
 
-    def test_order_number_generator_success(self):
-        """Тест успешной генерации номера заказа"""
-        with patch('bot.services.random.randint') as mock_randint, \
-                patch('bot.services.random.choices') as mock_choices, \
-                patch('bot.services.datetime') as mock_datetime:
-            mock_choices.return_value = ['A', 'B']
-            mock_randint.return_value = 1234
+    def test_format_order_number(self):
+        """Тест формата номера заказа из значения последовательности"""
+        date = datetime(2025, 1, 1)
+        numbers = {format_order_number(value, date) for value in range(1, 10001)}
+
+        self.assertEqual(len(numbers), 10000)
+        self.assertRegex(format_order_number(1, date), r'^[A-Z]{2}\d{4}010125$')
+
+    def test_order_number_allocator_uses_blocks(self):
+        """Тест выдачи номеров из блока без обращения к БД"""
+        allocator = OrderNumberAllocator(block_size=20)
+        with self.assertNumQueries(1):
+            numbers = {allocator.allocate() for _ in range(20)}
+
+        self.assertEqual(len(numbers), 20)
+
+
+    @override_settings(STOCK_RESERVATION=True)
+    def test_create_order_from_cart(self):
+        """Тест создания заказа из корзины фиксированным числом запросов"""
+        customer = Customer.objects.create(first_name='Test', last_name='User', phone='+79991234567',
+                                           address='Test Address', telegram_id=123456)
+        category = Category.objects.create(title='Кофе')
+        cart = Cart.objects.create(customer=customer)
+        for number in range(30):
+            product = Product.objects.create(title=f'Товар {number}', category=category, price=10, image='p.jpg',
+                                             remainder=10)
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+        # Элементы корзины, резерв по товару, блок номеров, транзакция (savepoint), заказ, bulk_create
+        with patch('bot.services.order_numbers', OrderNumberAllocator(block_size=10)), \
+                self.assertNumQueries(36):
+            order, items_count = create_order_from_cart(customer, cart, 'courier')
+
+        self.assertEqual(items_count, 30)
+        self.assertEqual(Order.objects.with_totals().get(pk=order.pk).total_items, 60)
+        self.assertEqual(order.address, 'Test Address')
+
+    def test_create_order_from_cart_is_atomic(self):
+        """Тест отката заказа при ошибке создания его элементов"""
+        customer = Customer.objects.create(first_name='Test', last_name='User', phone='+79991234567',
+                                           address='Test Address', telegram_id=123456)
+        category = Category.objects.create(title='Кофе')
+        product = Product.objects.create(title='Эспрессо', category=category, price=10, image='p.jpg', remainder=5)
+        cart = Cart.objects.create(customer=customer)
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+        with patch('bot.services.OrderItem.objects.bulk_create', side_effect=Exception('Database error')):
+            with self.assertRaises(Exception):
+                create_order_from_cart(customer, cart, 'courier')
+
+        self.assertFalse(Order.objects.exists())
+        product.refresh_from_db()
+        self.assertEqual(product.remainder, 5)
+
+
+@override_settings(STOCK_RESERVATION=True)
+class TestInventory(TestCase):
+    """Тесты резервирования остатков"""
 
-            mock_now = Mock()
-            mock_now.day = 1
-            mock_now.month = 1
-            mock_now.year = 2024
-            mock_datetime.now.return_value = mock_now
-
-            result = order_number_generator()
-            self.assertTrue(result.startswith("AB"))
-            self.assertIn("1234", result)
-
-    def test_order_number_generator_fallback(self):
-        """Тест резервной генерации номера заказа при ошибке"""
-        with patch('bot.services.random.randint') as mock_randint, \
-                patch('bot.services.random.choices') as mock_choices:
-            mock_choices.side_effect = Exception("Random error")
-            mock_randint.return_value = 9999
+    def setUp(self):
+        self.customer = Customer.objects.create(first_name='Test', last_name='User', phone='+79991234567',
+                                                address='Test Address', telegram_id=123456)
+        category = Category.objects.create(title='Кофе')
+        self.espresso = Product.objects.create(title='Эспрессо', category=category, price=100, image='e.jpg',
+                                               remainder=5)
+        self.latte = Product.objects.create(title='Латте', category=category, price=150, image='l.jpg',
+                                            remainder=1)
+        self.cart = Cart.objects.create(customer=self.customer)
+        CartItem.objects.create(cart=self.cart, product=self.espresso, quantity=2)
+
+    def remainders(self):
+        return dict(Product.objects.values_list('title', 'remainder'))
+
+    def test_order_reserves_stock(self):
+        """Тест списания остатков при создании заказа"""
+        order, _ = create_order_from_cart(self.customer, self.cart, 'courier')
+
+        self.assertTrue(order.stock_reserved)
+        self.assertIsNotNone(order.reserved_until)
+        self.assertEqual(self.remainders(), {'Эспрессо': 3, 'Латте': 1})
+
+    def test_out_of_stock_reserves_nothing(self):
+        """Тест отказа в заказе без частичного списания при нехватке товара"""
+        CartItem.objects.create(cart=self.cart, product=self.latte, quantity=2)
+
+        with self.assertRaises(OutOfStock) as error:
+            create_order_from_cart(self.customer, self.cart, 'courier')
+
+        self.assertEqual(error.exception.product_id, self.latte.id)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.remainders(), {'Эспрессо': 5, 'Латте': 1})
 
-            result = order_number_generator()
-            self.assertTrue(result.startswith("EM"))
+    @pytest.mark.asyncio
+    async def test_new_order_out_of_stock_message(self):
+        """Тест сообщения о нехватке товара"""
+        await CartItem.objects.acreate(cart=self.cart, product=self.latte, quantity=2)
+
+        result = await new_order(self.customer, 'courier')
+        self.assertIn('Латте', result)
+        self.assertIn('недостаточно на складе', result)
+
+    def test_commit_keeps_stock(self):
+        """Тест подтверждения резерва"""
+        order, _ = create_order_from_cart(self.customer, self.cart, 'courier')
+
+        self.assertTrue(commit_reservation(order))
+        self.assertFalse(commit_reservation(order))
+        order.refresh_from_db()
+        self.assertTrue(order.is_confirmed)
+        self.assertIsNone(order.reserved_until)
+        self.assertEqual(self.remainders()['Эспрессо'], 3)
+
+    def test_release_returns_stock_once(self):
+        """Тест однократного возврата остатков при отмене"""
+        order, _ = create_order_from_cart(self.customer, self.cart, 'courier')
+
+        self.assertTrue(release_reservation(order))
+        self.assertFalse(release_reservation(order))
+        self.assertEqual(self.remainders()['Эспрессо'], 5)
+
+    def test_expired_reservation_released(self):
+        """Тест отмены заказа с истекшим резервом"""
+        with override_settings(ORDER_RESERVATION_TTL=-1):
+            expired, _ = create_order_from_cart(self.customer, self.cart, 'courier')
+        active, _ = create_order_from_cart(self.customer, self.cart, 'courier')
+
+        self.assertFalse(commit_reservation(expired))
+        self.assertEqual(release_expired_reservations(), 1)
+        expired.refresh_from_db()
+        self.assertEqual(expired.status, 'cancelled')
+        self.assertTrue(Order.objects.get(pk=active.pk).stock_reserved)
+        self.assertEqual(self.remainders()['Эспрессо'], 3)
+
+    @override_settings(STOCK_RESERVATION=False)
+    def test_reservation_disabled(self):
+        """Тест: без STOCK_RESERVATION остатки не списываются, заказ подтверждается"""
+        CartItem.objects.create(cart=self.cart, product=self.latte, quantity=2)
+        order, _ = create_order_from_cart(self.customer, self.cart, 'courier')
+
+        self.assertFalse(order.stock_reserved)
+        self.assertEqual(self.remainders(), {'Эспрессо': 5, 'Латте': 1})
+        self.assertTrue(commit_reservation(order))
+
+    def test_confirm_outcomes(self):
+        """Тест: подтверждение различает истекший резерв, повторное подтверждение и отмененный заказ"""
+        confirm = async_to_sync(data.confirm_latest_order)
+        order, _ = create_order_from_cart(self.customer, self.cart, 'courier')
+        self.assertEqual(confirm(self.customer), 'confirmed')
+        self.assertEqual(confirm(self.customer), 'already_confirmed')
+
+        with override_settings(ORDER_RESERVATION_TTL=-1):
+            expired, _ = create_order_from_cart(self.customer, self.cart, 'courier')
+        self.assertEqual(confirm(self.customer), 'expired')
+        expired.refresh_from_db()
+        # Истекший резерв освобожден сразу, без команды release_reservations
+        self.assertEqual((expired.status, expired.stock_reserved), ('cancelled', False))
+        self.assertEqual(self.remainders()['Эспрессо'], 3)
+        self.assertEqual(confirm(self.customer), 'cancelled')
+
+
+class TestInventoryConcurrency(TransactionTestCase):
+    """Нагрузочный тест резервирования одного товара из многих потоков"""
+
+    def test_concurrent_reservations_never_oversell(self):
+        """Тест: параллельные заказы не списывают больше остатка"""
+        category = Category.objects.create(title='Кофе')
+        product = Product.objects.create(title='Эспрессо', category=category, price=100, image='e.jpg',
+                                         remainder=50)
+
+        def reserve():
+            try:
+                reserve_stock([(product.id, 1)])
+                return True
+            except OutOfStock:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(lambda _: reserve(), range(200)))
+
+        self.assertEqual(sum(results), 50)
+        product.refresh_from_db()
+        self.assertEqual(product.remainder, 0)
+
+
+def allocate_order_numbers(count):
+    """Выдача номеров заказов в отдельном процессе"""
+    allocator = OrderNumberAllocator(block_size=7)
+    try:
+        return [allocator.allocate() for _ in range(count)]
+    finally:
+        connection.close()
+
+
+class TestOrderNumberConcurrency(TransactionTestCase):
+    """Уникальность номеров заказов при выдаче из нескольких процессов"""
+
+    def test_processes_get_unique_numbers(self):
+        """Тест отсутствия повторов между процессами"""
+        # Соединение родителя не должно наследоваться дочерними процессами
+        connection.close()
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            results = pool.map(allocate_order_numbers, [100] * 8)
+
+        numbers = [number for result in results for number in result]
+        self.assertEqual(len(numbers), 800)
+        self.assertEqual(len(set(numbers)), 800)
+
+
+class TestDatabaseExecutor(TransactionTestCase):
+    """Пул потоков БД: отдельные соединения и параллельные запросы"""
+
+    @staticmethod
+    def backend_pid():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid(), pg_sleep(0.05)')
+            return cursor.fetchone()[0]
+
+    def test_threads_use_own_connections(self):
+        """Тест: каждый поток пула работает через свое соединение"""
+        executor = DatabaseExecutor(threads=4)
+
+        async def run():
+            return await asyncio.gather(*(executor.run(self.backend_pid) for _ in range(8)))
+
+        try:
+            pids = async_to_sync(run)()
+        finally:
+            executor.shutdown()
+
+        self.assertEqual(len(set(pids)), 4)
+        self.assertEqual(executor.stats()['completed'], 8)
+
+    def test_concurrent_queries_scale_with_threads(self):
+        """Тест: медленные запросы из разных обновлений выполняются параллельно"""
+        executor = DatabaseExecutor(threads=8)
+
+        async def run():
+            start = asyncio.get_running_loop().time()
+            await asyncio.gather(*(executor.run(self.backend_pid) for _ in range(16)))
+            return asyncio.get_running_loop().time() - start
+
+        try:
+            elapsed = async_to_sync(run)()
+        finally:
+            executor.shutdown()
+
+        # Последовательно 16 запросов по 50 мс заняли бы 0.8 с
+        self.assertLess(elapsed, 0.5)
+
+    def test_failed_call_is_counted(self):
+        """Тест: исключение из функции доходит до вызывающего и учитывается в статистике"""
+        executor = DatabaseExecutor(threads=1)
+
+        def fail():
+            raise Customer.DoesNotExist
+
+        try:
+            with self.assertRaises(Customer.DoesNotExist):
+                async_to_sync(executor.run)(fail)
+        finally:
+            executor.shutdown()
+
+        self.assertEqual(executor.stats()['failed'], 1)
+        self.assertEqual(executor.stats()['in_flight'], 0)
+
+
+class TestDatabasePool(TransactionTestCase):
+    """Пул соединений psycopg: прогрев и метрики"""
+
+    def make_pool(self, **options):
+        from psycopg_pool import ConnectionPool
+
+        params = connection.get_connection_params()
+        params['autocommit'] = True
+        return ConnectionPool(kwargs=params, open=False, check=ConnectionPool.check_connection, **options)
+
+    def test_stats_without_pool(self):
+        """Тест метрик в профиле постоянных соединений"""
+        self.assertFalse(database_stats()['pool'])
+
+    def test_warm_up_fills_pool(self):
+        """Тест: прогрев открывает min_size соединений до первого запроса"""
+        pool = self.make_pool(min_size=3, max_size=4)
+        try:
+            with patch('bot.db.connection_pool', return_value=pool):
+                async_to_sync(warm_up_database)()
+                stats = database_stats()
+        finally:
+            pool.close()
+
+        self.assertEqual(stats['size'], 3)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['requests'], 0)
+
+    def test_saturation_and_acquire_wait(self):
+        """Тест метрик заполненности пула и ожидания соединения"""
+        pool = self.make_pool(min_size=1, max_size=2, timeout=0.1)
+        pool.open(wait=True)
+        try:
+            held = [pool.getconn(), pool.getconn()]
+            with patch('bot.db.connection_pool', return_value=pool):
+                saturated = database_stats()
+                # Третий запрос ждет свободное соединение и получает таймаут
+                with self.assertRaises(Exception):
+                    pool.getconn()
+                stats = database_stats()
+            for conn in held:
+                pool.putconn(conn)
+        finally:
+            pool.close()
+
+        self.assertEqual(saturated['saturation'], 1.0)
+        self.assertEqual(saturated['in_use'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreaterEqual(stats['acquire_wait_ms_total'], 100)
+        self.assertGreater(stats['acquire_wait_ms_avg'], 0)
+
+    def test_warm_up_skipped_without_pool_and_executor(self):
+        """Тест: без пула соединений и пула потоков прогрев ничего не открывает"""
+        executor = DatabaseExecutor(threads=3)
+        with patch('bot.db.db_executor', executor), \
+                patch('bot.db.asyncio.to_thread') as to_thread, patch.object(executor, 'warm_up') as warm_up:
+            async_to_sync(warm_up_database)()
+            warm_up_database_blocking()
+
+        to_thread.assert_not_called()
+        warm_up.assert_not_called()
+
+    @override_settings(DB_EXECUTOR_THREADS=3)
+    def test_warm_up_opens_executor_connections(self):
+        """Тест: прогрев открывает соединение в каждом потоке пула БД"""
+        executor = DatabaseExecutor(threads=3)
+
+        def opened():
+            return connection.connection is not None
+
+        async def run():
+            await warm_up_database()
+            return await asyncio.gather(*(executor.run(opened) for _ in range(6)))
+
+        try:
+            with patch('bot.db.db_executor', executor):
+                results = async_to_sync(run)()
+        finally:
+            executor.shutdown()
+
+        self.assertTrue(all(results))
+
+
+class TestIndexes(TestCase):
+    """Планы запросов горячих путей на заполненной базе (EXPLAIN)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Кофе')
+        products = Product.objects.bulk_create(
+            Product(title=f'Товар {i}', category=category, price=100, image='p.jpg', remainder=100)
+            for i in range(20)
+        )
+        customers = Customer.objects.bulk_create(
+            Customer(first_name='Test', last_name=str(i), phone=f'+7{i:010d}', address='Address',
+                     telegram_id=1000 + i)
+            for i in range(2000)
+        )
+        Order.objects.bulk_create(
+            Order(order_number=f'N{customer.id}-{i}', customer=customer)
+            for customer in customers for i in range(5)
+        )
+        carts = Cart.objects.bulk_create(Cart(customer=customer) for customer in customers)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=2)
+            for cart in carts for product in products[:3]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE bot_customer, bot_order, bot_cart, bot_cartitem')
+        cls.customer = customers[1500]
+        cls.cart = carts[1500]
+        cls.product = products[3]
+
+    def test_customer_orders_use_composite_index(self):
+        """Тест: заказы заказчика по дате читаются по индексу (customer, order_date_time)"""
+        plan = Order.objects.filter(customer=self.customer).order_by('-order_date_time').explain()
+        self.assertIn('order_customer_date_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_customer_admin_search_uses_prefix_indexes(self):
+        """Тест: поиск заказчика в админке (и автодополнение) читает индексы по началу полей"""
+        from django.contrib.admin.sites import site
+
+        customer_admin = site._registry[Customer]
+        queryset, _ = customer_admin.get_search_results(None, Customer.objects.order_by(), 'Ив')
+        plan = queryset.explain()
+
+        self.assertIn('customer_first_name_upper_idx', plan)
+        self.assertIn('customer_last_name_upper_idx', plan)
+        self.assertIn('customer_phone_upper_idx', plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_latest_order_uses_composite_index(self):
+        """Тест: latest('order_date_time') для заказчика - обратный проход по индексу"""
+        plan = Order.objects.filter(customer=self.customer).order_by('-order_date_time')[:1].explain()
+        self.assertIn('Index Scan Backward using order_customer_date_idx', plan)
+
+    def test_order_page_keyset_uses_composite_index(self):
+        """Тест: следующая страница заказов - диапазон индекса без сортировки"""
+        last = Order.objects.filter(customer=self.customer).order_by('-order_date_time', '-id')[2]
+        plan = (Order.objects.filter(customer=self.customer, order_date_time__lte=last.order_date_time)
+                .exclude(order_date_time=last.order_date_time, id__gte=last.id)
+                .order_by('-order_date_time', '-id')[:6].explain())
+        self.assertIn('Index Scan Backward using order_customer_date_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_cart_lookup_is_index_only(self):
+        """Тест: корзина заказчика находится без обращения к таблице"""
+        plan = Cart.objects.filter(customer=self.customer).order_by().values_list('id', flat=True).explain()
+        self.assertIn('Index Only Scan using cart_customer_covering_idx', plan)
+
+    def test_cart_items_use_covering_index(self):
+        """Тест: содержимое корзины читается из покрывающего индекса"""
+        plan = CartItem.objects.filter(cart=self.cart).order_by('id').values_list('product_id', 'quantity').explain()
+        self.assertIn('Index Only Scan using cartitem_cart_covering_idx', plan)
+
+    def test_cart_item_by_product_uses_unique_index(self):
+        """Тест: позиция корзины по (cart, product) ищется по уникальному индексу"""
+        plan = CartItem.objects.filter(cart=self.cart, product=self.product).explain()
+        self.assertRegex(plan, r'Index (Only )?Scan using \S+_uniq')
+
+    def test_customer_by_telegram_id_uses_index(self):
+        """Тест: поиск заказчика по числовому telegram_id идет по уникальному индексу"""
+        plan = Customer.objects.filter(telegram_id=2500).order_by().explain()
+        self.assertIn('Index Scan', plan)
+        self.assertNotIn('::text', plan)
 
 
 class TestErrorHandling(TestCase):
@@ -318,13 +1472,407 @@ class TestErrorHandling(TestCase):
     @pytest.mark.asyncio
     async def test_network_errors(self):
         """Тест обработки сетевых ошибок"""
-        with patch('bot.bot_utils.sync_to_async') as mock_sync:
-            mock_sync.side_effect = TimeoutError("Network timeout")
-
+        with patch('bot.bot_utils.data.register_phone', AsyncMock(side_effect=TimeoutError("Network timeout"))):
             result = await update_phone(Mock(), "+79991234567")
             self.assertIn("Ошибка при сохранении", result)
 
 
+class TestWebhook(TestCase):
+    """Тесты обработчиков вебхуков"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        dedup_patcher = patch('bot.views.dedup', UpdateDeduplicator())
+        dedup_patcher.start()
+        self.addCleanup(dedup_patcher.stop)
+        self.update = {
+            'update_id': 1,
+            'message': {
+                'message_id': 1,
+                'date': 0,
+                'chat': {'id': 123456, 'type': 'private'},
+                'from': {'id': 123456, 'is_bot': False, 'first_name': 'Test'},
+                'text': '/menu',
+            },
+        }
+
+    def make_request(self, body):
+        return self.factory.post('/webhook/async/', data=body, content_type='application/json')
+
+    def make_asgi_request(self, body):
+        return AsyncRequestFactory().post('/webhook/async/', data=body, content_type='application/json')
+
+    @pytest.mark.asyncio
+    async def test_async_webhook_success(self):
+        """Тест обработки обновления асинхронным вебхуком"""
+        with patch('bot.views.bot.dp.feed_update', new_callable=AsyncMock) as mock_feed:
+            response = await async_webhook(self.make_request(json.dumps(self.update)))
+
+            self.assertEqual(response.status_code, 200)
+            mock_feed.assert_awaited_once()
+            self.assertEqual(mock_feed.await_args.args[1].update_id, 1)
+
+    @pytest.mark.asyncio
+    async def test_async_webhook_invalid_json(self):
+        """Тест обработки невалидного JSON"""
+        response = await async_webhook(self.make_request('not json'))
+        self.assertEqual(response.status_code, 400)
+
+    @pytest.mark.asyncio
+    async def test_async_webhook_ack_first_queue_full(self):
+        """Тест ответа 503 при переполненной очереди в режиме ack-first"""
+        with override_settings(TELEGRAM_WEBHOOK_ACK_FIRST=True), \
+                patch('bot.views.pool.submit', new_callable=AsyncMock) as mock_submit:
+            mock_submit.return_value = False
+            response = await async_webhook(self.make_asgi_request(json.dumps(self.update)))
+
+            self.assertEqual(response.status_code, 503)
+
+    @pytest.mark.asyncio
+    async def test_async_webhook_redelivery_after_queue_full(self):
+        """Тест: обновление, отклоненное при переполненной очереди, принимается при повторной доставке"""
+        with override_settings(TELEGRAM_WEBHOOK_ACK_FIRST=True), \
+                patch('bot.views.pool.submit', new_callable=AsyncMock) as mock_submit:
+            mock_submit.side_effect = [False, True]
+            rejected = await async_webhook(self.make_asgi_request(json.dumps(self.update)))
+            redelivered = await async_webhook(self.make_asgi_request(json.dumps(self.update)))
+
+            self.assertEqual(rejected.status_code, 503)
+            self.assertEqual(redelivered.status_code, 200)
+            self.assertEqual(mock_submit.await_count, 2)
+
+    @pytest.mark.asyncio
+    async def test_async_webhook_ack_first_under_wsgi_processes_before_reply(self):
+        """Тест: под WSGI режим ack-first не ставит обновление в очередь, которая не переживет запрос"""
+        with override_settings(TELEGRAM_WEBHOOK_ACK_FIRST=True), \
+                patch('bot.views.pool.submit', new_callable=AsyncMock) as mock_submit, \
+                patch('bot.views.pool.process', new_callable=AsyncMock) as mock_process:
+            response = await async_webhook(self.make_request(json.dumps(self.update)))
+
+            self.assertEqual(response.status_code, 200)
+            mock_submit.assert_not_awaited()
+            mock_process.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_async_webhook_drops_duplicate_update(self):
+        """Тест отбрасывания повторной доставки обновления"""
+        with patch('bot.views.bot.dp.feed_update', new_callable=AsyncMock) as mock_feed:
+            first = await async_webhook(self.make_request(json.dumps(self.update)))
+            second = await async_webhook(self.make_request(json.dumps(self.update)))
+
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(second.status_code, 200)
+            mock_feed.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_async_webhook_handler_error_returns_ok(self):
+        """Тест ответа 200 при ошибке обработчика, чтобы Telegram не повторял доставку"""
+        with patch('bot.views.bot.dp.feed_update', new_callable=AsyncMock) as mock_feed:
+            mock_feed.side_effect = Exception("Handler error")
+            response = await async_webhook(self.make_request(json.dumps(self.update)))
+
+            self.assertEqual(response.status_code, 200)
+
+    def test_webhook_closes_own_session(self):
+        """Тест: WSGI-вебхук обрабатывает обновление своим Bot и закрывает его сессию, не трогая общую"""
+        once_bot = Mock()
+        once_bot.session.close = AsyncMock()
+        with patch('bot.views.bot.dp.feed_update', new_callable=AsyncMock) as mock_feed, \
+                patch('bot.views.bot.create_bot', return_value=once_bot), \
+                patch('bot.views.bot.bot.session.close', new_callable=AsyncMock) as shared_close:
+            response = webhook(self.make_request(json.dumps(self.update)))
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIs(mock_feed.await_args.args[0], once_bot)
+            once_bot.session.close.assert_awaited_once()
+            shared_close.assert_not_awaited()
+
+
+class TestMetrics(TestCase):
+    """Тесты доступа к /metrics/"""
+
+    def test_anonymous_request_is_forbidden(self):
+        """Тест: без токена и входа в админку метрики не отдаются"""
+        response = self.client.get(reverse('bot:metrics'))
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('worker_pool', response.json())
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_header(self):
+        """Тест: доступ по заголовку X-Metrics-Token, неверный токен отклоняется"""
+        ok = self.client.get(reverse('bot:metrics'), headers={'X-Metrics-Token': 'secret'})
+        wrong = self.client.get(reverse('bot:metrics'), headers={'X-Metrics-Token': 'wrong'})
+
+        self.assertEqual(ok.status_code, 200)
+        self.assertIn('worker_pool', ok.json())
+        self.assertEqual(wrong.status_code, 403)
+
+    def test_empty_token_does_not_grant_access(self):
+        """Тест: пустой METRICS_TOKEN не совпадает с пустым заголовком"""
+        response = self.client.get(reverse('bot:metrics'), headers={'X-Metrics-Token': ''})
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff_user(self):
+        """Тест: сотрудник, вошедший в админку, видит метрики"""
+        self.client.force_login(User.objects.create_user('staff', password='password', is_staff=True))
+        response = self.client.get(reverse('bot:metrics'))
+        self.assertEqual(response.status_code, 200)
+
+
+class TestLifespan(TestCase):
+    """Тесты остановки ASGI-приложения"""
+
+    @pytest.mark.asyncio
+    async def test_shutdown_drains_accepted_updates(self):
+        """Тест: при lifespan shutdown обновления, принятые в ack-first, обрабатываются до конца"""
+        bot_mock = Mock()
+        processed = []
+
+        async def feed_update(bot, update):
+            await asyncio.sleep(0.01)
+            processed.append(update.update_id)
+
+        bot_mock.dp.feed_update = feed_update
+        pool = UpdateWorkerPool(bot_mock, workers=2, queue_size=10)
+        for update_id in range(5):
+            await pool.submit(Mock(update_id=update_id, event=Mock(from_user=Mock(id=update_id))))
+
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        app = LifespanMiddleware(AsyncMock(), on_shutdown=[pool.stop])
+        await app({'type': 'lifespan'}, receive, send)
+
+        self.assertEqual(sorted(processed), list(range(5)))
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+    @pytest.mark.asyncio
+    async def test_other_scopes_pass_through(self):
+        """Тест: HTTP-запросы передаются приложению Django"""
+        django_app = AsyncMock()
+        await LifespanMiddleware(django_app)({'type': 'http'}, None, None)
+        django_app.assert_awaited_once()
+
+
+class TestWorkerPool(TestCase):
+    """Тесты пула воркеров для фоновой обработки обновлений"""
+
+    def setUp(self):
+        self.bot = Mock()
+        self.bot.dp.feed_update = AsyncMock()
+
+    @pytest.mark.asyncio
+    async def test_submit_processes_update(self):
+        """Тест обработки обновления из очереди"""
+        pool = UpdateWorkerPool(self.bot, workers=2, queue_size=10)
+        update = self.make_update(1, user_id=1)
+
+        self.assertTrue(await pool.submit(update))
+        await pool.stop()
+
+        self.bot.dp.feed_update.assert_awaited_once_with(self.bot.bot, update)
+        stats = pool.stats()
+        self.assertEqual(stats['processed'], 1)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    @pytest.mark.asyncio
+    async def test_submit_rejects_when_queue_is_full(self):
+        """Тест отклонения обновления при переполненной очереди"""
+        release = asyncio.Event()
+
+        async def slow_feed(bot, update):
+            await release.wait()
+
+        self.bot.dp.feed_update = slow_feed
+        pool = UpdateWorkerPool(self.bot, workers=1, queue_size=1, enqueue_timeout=0.01)
+
+        self.assertTrue(await pool.submit(self.make_update(1, user_id=1)))
+        await asyncio.sleep(0)  # воркер забирает первое обновление
+        self.assertTrue(await pool.submit(self.make_update(2, user_id=1)))
+        self.assertFalse(await pool.submit(self.make_update(3, user_id=1)))
+        self.assertEqual(pool.stats()['rejected'], 1)
+
+        release.set()
+        await pool.stop()
+        self.assertEqual(pool.stats()['processed'], 2)
+
+
+    @pytest.mark.asyncio
+    async def test_same_user_updates_are_ordered(self):
+        """Тест последовательной обработки обновлений одного пользователя"""
+        active = []
+        handled = []
+
+        async def feed(bot, update):
+            active.append(update.update_id)
+            self.assertEqual(len(active), 1)
+            await asyncio.sleep(0.01)
+            handled.append(update.update_id)
+            active.remove(update.update_id)
+
+        self.bot.dp.feed_update = feed
+        pool = UpdateWorkerPool(self.bot, workers=4, queue_size=40)
+        updates = [self.make_update(update_id, user_id=7) for update_id in range(5)]
+
+        await asyncio.gather(*(pool.process(update) for update in updates))
+        self.assertEqual(handled, list(range(5)))
+
+    @pytest.mark.asyncio
+    async def test_different_users_run_in_parallel(self):
+        """Тест параллельной обработки обновлений разных пользователей"""
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def feed(bot, update):
+            if update.update_id == 1:
+                started.set()
+                await release.wait()
+            else:
+                release.set()
+
+        self.bot.dp.feed_update = feed
+        pool = UpdateWorkerPool(self.bot, workers=2, queue_size=10)
+
+        first = asyncio.create_task(pool.process(self.make_update(1, user_id=0)))
+        await started.wait()
+        await asyncio.wait_for(pool.process(self.make_update(2, user_id=1)), 1)
+        await first
+
+    def test_update_lane_key(self):
+        """Тест ключа шардирования по id пользователя"""
+        self.assertEqual(update_lane_key(self.make_update(1, user_id=42)), 42)
+
+    def make_update(self, update_id, user_id):
+        return Mock(update_id=update_id, event=Mock(from_user=Mock(id=user_id)))
+
+
+class TestUpdateDeduplicator(TestCase):
+    """Тесты отсечения повторных доставок обновлений"""
+
+    @pytest.mark.asyncio
+    async def test_duplicate_is_counted_as_hit(self):
+        """Тест учета повторной доставки как попадания"""
+        dedup = UpdateDeduplicator()
+
+        self.assertFalse(await dedup.is_duplicate(1))
+        self.assertTrue(await dedup.is_duplicate(1))
+        self.assertFalse(await dedup.is_duplicate(2))
+        self.assertEqual(dedup.stats()['hits'], 1)
+        self.assertEqual(dedup.stats()['misses'], 2)
+
+    @pytest.mark.asyncio
+    async def test_local_cache_is_bounded(self):
+        """Тест вытеснения старых update_id при переполнении"""
+        dedup = UpdateDeduplicator(max_size=2)
+        for update_id in range(3):
+            await dedup.is_duplicate(update_id)
+
+        self.assertEqual(dedup.stats()['size'], 2)
+        self.assertFalse(await dedup.is_duplicate(0))
+
+    @pytest.mark.asyncio
+    async def test_expired_update_id_is_forgotten(self):
+        """Тест истечения TTL"""
+        dedup = UpdateDeduplicator(ttl=0)
+        await dedup.is_duplicate(1)
+        self.assertFalse(await dedup.is_duplicate(1))
+
+    @pytest.mark.asyncio
+    async def test_shared_cache_catches_other_process_delivery(self):
+        """Тест отсечения повтора, полученного другим процессом, через общий кеш"""
+        other_process = UpdateDeduplicator(cache_alias='default')
+        this_process = UpdateDeduplicator(cache_alias='default')
+
+        self.assertFalse(await other_process.is_duplicate(10**9))
+        self.assertTrue(await this_process.is_duplicate(10**9))
+
+    @pytest.mark.asyncio
+    async def test_forget_clears_local_and_shared_marks(self):
+        """Тест снятия отметки с непринятого обновления в локальном и общем кеше"""
+        dedup = UpdateDeduplicator(cache_alias='default')
+        other_process = UpdateDeduplicator(cache_alias='default')
+        await dedup.is_duplicate(10**9 + 1)
+        await dedup.forget(10**9 + 1)
+
+        self.assertFalse(await other_process.is_duplicate(10**9 + 1))
+        await other_process.forget(10**9 + 1)
+        self.assertFalse(await dedup.is_duplicate(10**9 + 1))
+
+
+class TestSender(TestCase):
+    """Тесты подсистемы исходящих сообщений"""
+
+    def setUp(self):
+        self.bot = Mock()
+        self.bot.send_message = AsyncMock()
+        self.bot.send_photo = AsyncMock()
+
+    @pytest.mark.asyncio
+    async def test_outbox_coalesces_consecutive_texts(self):
+        """Тест склеивания подряд идущих текстов в одно сообщение"""
+        outbox = Outbox(self.bot, 1)
+        await outbox.answer('Первый')
+        await outbox.answer('Второй')
+        await outbox.answer('Выберите действие:', reply_markup='menu')
+        await outbox.flush()
+
+        self.bot.send_message.assert_awaited_once_with(
+            1, 'Первый\nВторой\nВыберите действие:', parse_mode=None, reply_markup='menu'
+        )
+
+    @pytest.mark.asyncio
+    async def test_outbox_splits_on_parse_mode_change(self):
+        """Тест отдельной отправки текстов с разным parse_mode"""
+        outbox = Outbox(self.bot, 1)
+        await outbox.answer('*Жирный*', parse_mode='Markdown')
+        await outbox.answer('Обычный')
+        await outbox.flush()
+
+        self.assertEqual(self.bot.send_message.await_count, 2)
+
+    @pytest.mark.asyncio
+    async def test_outbox_flushes_before_photo(self):
+        """Тест отправки накопленного текста перед фото"""
+        outbox = Outbox(self.bot, 1)
+        await outbox.answer('Текст')
+        await outbox.answer_photo(photo='file_id', caption='Фото')
+
+        self.bot.send_message.assert_awaited_once()
+        self.bot.send_photo.assert_awaited_once_with(1, 'file_id', caption='Фото')
+
+    @pytest.mark.asyncio
+    async def test_token_bucket_limits_rate(self):
+        """Тест ожидания токена после исчерпания запаса"""
+        bucket = TokenBucket(rate=100, capacity=1)
+        start = asyncio.get_running_loop().time()
+        for _ in range(3):
+            await bucket.acquire()
+
+        self.assertGreaterEqual(asyncio.get_running_loop().time() - start, 0.015)
+
+    @pytest.mark.asyncio
+    async def test_throttling_retries_after_retry_after(self):
+        """Тест повтора запроса после ответа 429"""
+        from aiogram.exceptions import TelegramRetryAfter
+
+        method = Mock(chat_id=1)
+        make_request = AsyncMock(side_effect=[
+            TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=0),
+            'response',
+        ])
+        throttle = ThrottlingRequestMiddleware(global_rate=1000, chat_rate=1000, chat_burst=10)
+
+        self.assertEqual(await throttle(make_request, self.bot, method), 'response')
+        self.assertEqual(make_request.await_count, 2)
+        self.assertEqual(throttle.retries, 1)
+
+
 # Дополнительные тесты для полного покрытия
 class TestAdditionalCases(TestCase):
     """Дополнительные тестовые случаи"""
@@ -337,7 +1885,7 @@ class TestAdditionalCases(TestCase):
         mock_customer.last_name = "User"
         mock_customer.phone = "+79991234567"
         mock_customer.address = "Test Address"
-        mock_customer.telegram_id = "123456"
+        mock_customer.telegram_id = 123456
 
         result = await get_profile(mock_customer)
         self.assertIn("Test User", result)
@@ -347,53 +1895,138 @@ class TestAdditionalCases(TestCase):
     async def test_get_cart_data_empty(self):
         """Тест получения данных пустой корзины"""
         mock_customer = Mock()
-        mock_cart = Mock()
-        mock_cart.total_items = 0
-        mock_cart.total_price = 0
-
-        with patch('bot.bot_utils.Cart.objects.get') as mock_cart_get:
-            mock_cart_get.return_value = mock_cart
 
-            with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                mock_sync.side_effect = [
-                    AsyncMock(return_value=mock_cart),
-                    AsyncMock(return_value=[]),  # cart_data
-                    AsyncMock(return_value=0),  # total_items
-                    AsyncMock(return_value=0)  # total_price
-                ]
-
-                cart_data, total_items, total_price = await get_cart_data(mock_customer)
-                self.assertEqual(cart_data, [])
-                self.assertEqual(total_items, 0)
-                self.assertEqual(total_price, 0)
+        with patch('bot.bot_utils.data.cart_summary', AsyncMock(return_value=([], 0, 0))):
+            cart_data, total_items, total_price = await get_cart_data(mock_customer)
+            self.assertEqual(cart_data, [])
+            self.assertEqual(total_items, 0)
+            self.assertEqual(total_price, 0)
 
     @pytest.mark.asyncio
     async def test_change_cart_item_quantity_success(self):
         """Тест успешного изменения количества товара"""
         mock_customer = Mock()
-        mock_cart = Mock()
-        mock_product = Mock()
-        mock_cart_item = Mock()
-
-        with patch('bot.bot_utils.Cart.objects.get') as mock_cart_get:
-            mock_cart_get.return_value = mock_cart
 
-            with patch('bot.bot_utils.Product.objects.get') as mock_product_get:
-                mock_product_get.return_value = mock_product
+        with patch('bot.bot_utils.data.set_cart_item_quantity', AsyncMock(return_value=True)):
+            result = await change_cart_item_quantity(mock_customer, "1", 5)
+            self.assertIn("Количество изменено", result)
+
+
+class TestAdminPerformance(TestCase):
+    """Списки и формы админки: число запросов не зависит от числа строк, COUNT(*) не выполняется"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.category = Category.objects.create(title='Кофе')
+        cls.products = Product.objects.bulk_create(
+            Product(title=f'Товар {i}', category=cls.category, price=100, image='p.jpg', remainder=100)
+            for i in range(3)
+        )
+        cls.customers = cls.create_customers(0, 10)
+
+    @classmethod
+    def create_customers(cls, start, count):
+        """Заказчики с заказом и корзиной, по две позиции в каждом"""
+        customers = Customer.objects.bulk_create(
+            Customer(first_name='Test', last_name=str(i), phone=f'+7{i:010d}', address='Address',
+                     telegram_id=5000 + i)
+            for i in range(start, start + count)
+        )
+        orders = Order.objects.bulk_create(Order(order_number=f'A{customer.id}', customer=customer)
+                                           for customer in customers)
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=2)
+                                      for order in orders for product in cls.products[:2])
+        carts = Cart.objects.bulk_create(Cart(customer=customer) for customer in customers)
+        CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=1)
+                                     for cart in carts for product in cls.products[:2])
+        return customers
 
-                with patch('bot.bot_utils.CartItem.objects.get') as mock_cart_item_get:
-                    mock_cart_item_get.return_value = mock_cart_item
-
-                    with patch('bot.bot_utils.sync_to_async') as mock_sync:
-                        mock_sync.side_effect = [
-                            AsyncMock(return_value=mock_cart),
-                            AsyncMock(return_value=mock_product),
-                            AsyncMock(return_value=mock_cart_item),
-                            AsyncMock(return_value=None)  # save
-                        ]
-
-                        result = await change_cart_item_quantity(mock_customer, "1", 5)
-                        self.assertIn("Количество изменено", result)
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def changelist_queries(self, model):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:bot_{model}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """Тест: число запросов списка не зависит от числа строк на странице и укладывается в бюджет"""
+        models = ('customer', 'product', 'order', 'cart')
+        before = {model: len(self.changelist_queries(model)) for model in models}
+        self.create_customers(10, 40)
+        Product.objects.bulk_create(
+            Product(title=f'Товар {i}', category=self.category, price=100, image='p.jpg', remainder=100)
+            for i in range(3, 40)
+        )
+
+        for model in models:
+            with self.subTest(model=model):
+                self.assertEqual(len(self.changelist_queries(model)), before[model])
+                self.assertLessEqual(before[model], 8)
+
+    def test_order_totals_in_changelist(self):
+        """Тест: итоги заказов считаются в запросе списка"""
+        response = self.client.get(reverse('admin:bot_order_changelist'))
+        order = response.context['cl'].result_list[0]
+        self.assertEqual(order.annotated_total_items, 4)
+        self.assertEqual(order.annotated_total_price, Decimal('400'))
+
+    def test_large_tables_are_not_counted(self):
+        """Тест: при оценке выше порога список не выполняет COUNT(*)"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE bot_customer, bot_order, bot_cart, bot_product')
+
+        with patch.object(EstimatedCountPaginator, 'exact_count_limit', 1):
+            for model in ('customer', 'product', 'order', 'cart'):
+                with self.subTest(model=model):
+                    sql = ' '.join(query['sql'] for query in self.changelist_queries(model))
+                    self.assertNotIn('COUNT(', sql.upper())
+
+    def test_paginator_estimates(self):
+        """Тест: оценка по статистике таблицы и по плану запроса, точный подсчет ниже порога"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE bot_order')
+
+        with patch.object(EstimatedCountPaginator, 'exact_count_limit', 1):
+            self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 5).count, 10)
+            self.assertGreaterEqual(EstimatedCountPaginator(Order.objects.filter(status='created'), 5).count, 1)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(customer=self.customers[0]), 5).count, 1)
+
+    def test_search_by_prefix_and_exact_fields(self):
+        """Тест: поиск по началу имени, фамилии и телефона и по точному telegram_id или номеру заказа"""
+        customer = self.customers[3]
+        cases = [
+            ('order', customer.phone, 1),
+            ('order', str(customer.telegram_id), 1),
+            ('order', f'A{customer.id}', 1),
+            ('order', customer.phone[:5], 10),
+            ('order', 'test 3', 1),
+            ('customer', str(customer.telegram_id), 1),
+            ('customer', 'tes', 10),
+            ('customer', 'Test 3', 1),
+            ('customer', 'Test 3 Иван', 0),
+            ('customer', 'est', 0),
+            ('cart', customer.phone, 1),
+            ('cart', 'TEST', 10),
+        ]
+        for model, term, expected in cases:
+            with self.subTest(model=model, term=term):
+                response = self.client.get(reverse(f'admin:bot_{model}_changelist'), {'q': term})
+                self.assertEqual(len(response.context['cl'].result_list), expected)
+
+    def test_change_forms_do_not_list_related_rows(self):
+        """Тест: формы заказа и корзины выбирают заказчика автодополнением, а не списком всех заказчиков"""
+        order = Order.objects.get(customer=self.customers[0])
+        cart = Cart.objects.get(customer=self.customers[0])
+        for url in (reverse('admin:bot_order_change', args=[order.id]),
+                    reverse('admin:bot_cart_change', args=[cart.id])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, self.customers[0].phone)
+                self.assertNotContains(response, self.customers[-1].phone)
 
 
 # Запуск тестов
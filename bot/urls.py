@@ -6,4 +6,6 @@ app_name = 'bot'
 
 urlpatterns = [
     path('webhook/', views.webhook, name='telegram_webhook'),
+    path('webhook/async/', views.async_webhook, name='telegram_webhook_async'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,40 +1,171 @@
 # views.py (обновленный с логированием)
 import asyncio
-import types
+import functools
+import hmac
 import logging
+from aiogram import types
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 import json
+from pydantic import ValidationError
 from .bot import DjangoBot
+from .db import database_stats, db_executor
+from .dedup import UpdateDeduplicator
+from .workers import UpdateWorkerPool
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
 bot = DjangoBot()
 
+pool = UpdateWorkerPool(
+    bot,
+    workers=settings.TELEGRAM_WORKERS,
+    queue_size=settings.TELEGRAM_QUEUE_SIZE,
+    enqueue_timeout=settings.TELEGRAM_ENQUEUE_TIMEOUT,
+)
+
+dedup = UpdateDeduplicator(
+    ttl=settings.TELEGRAM_DEDUP_TTL,
+    max_size=settings.TELEGRAM_DEDUP_SIZE,
+    cache_alias=settings.TELEGRAM_DEDUP_CACHE or None,
+)
+
+
+def log_update(update):
+    """Логирует тип полученного обновления"""
+    if 'message' in update:
+        logger.info(f"Получено сообщение от пользователя {update['message']['from']['id']}")
+    elif 'callback_query' in update:
+        logger.info(f"Получен callback от пользователя {update['callback_query']['from']['id']}")
+
+
+def parse_update(body):
+    """Разбор тела вебхука в объект Update"""
+    logger.info("Получен вебхук от Telegram")
+    update = json.loads(body)
+    log_update(update)
+    return types.Update(**update)
+
+
+@functools.cache
+def warn_ack_first_without_asgi():
+    logger.warning("TG_WEBHOOK_ACK_FIRST работает только под ASGI-сервером: "
+                   "обновления обрабатываются до ответа Telegram")
+
+
+async def shutdown():
+    """Остановка при завершении ASGI-сервера: обработка принятых обновлений и закрытие сессии бота"""
+    await pool.stop()
+    await bot.bot.session.close()
+    logger.info("Очереди обновлений обработаны, сессия бота закрыта")
+
+
+async def feed_update_once(update):
+    """Обработка обновления в одноразовом цикле событий (для WSGI)"""
+    if await dedup.is_duplicate(update.update_id):
+        return
+    # Свой Bot на этот цикл: общий bot.bot и его сессия принадлежат циклу ASGI-сервера
+    # и могут в это же время обслуживать /webhook/async/
+    once_bot = bot.create_bot()
+    try:
+        await bot.dp.feed_update(once_bot, update)
+    finally:
+        # Сессия aiohttp привязана к циклу событий, который закроет asyncio.run
+        await once_bot.session.close()
+
 
 @csrf_exempt
 @require_POST
 def webhook(request):
-    """Обработчик вебхуков от Telegram"""
-    try:
-        logger.info("Получен вебхук от Telegram")
-        update = json.loads(request.body)
+    """Обработчик вебхуков от Telegram (WSGI)
 
-        # Логируем тип обновления
-        if 'message' in update:
-            logger.info(f"Получено сообщение от пользователя {update['message']['from']['id']}")
-        elif 'callback_query' in update:
-            logger.info(f"Получен callback от пользователя {update['callback_query']['from']['id']}")
+    Каждое обновление обрабатывается в новом цикле событий через asyncio.run.
+    Для продакшена используйте async_webhook под ASGI-сервером.
+    """
+    try:
+        update = parse_update(request.body)
+    except json.JSONDecodeError as e:
+        logger.error(f"Ошибка декодирования JSON: {e}")
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    except ValidationError as e:
+        logger.error(f"Некорректное обновление: {e}")
+        return JsonResponse({"error": "Invalid update"}, status=400)
 
-        asyncio.run(bot.dp.feed_update(bot.bot, types.Update(**update)))
+    try:
+        asyncio.run(feed_update_once(update))
         logger.info("Вебхук успешно обработан")
-        return HttpResponse("OK")
+    except Exception as e:
+        # Ошибка обработчика не должна приводить к повторной доставке обновления
+        logger.error(f"Критическая ошибка обработки вебхука: {e}")
+    return HttpResponse("OK")
+
+
+@csrf_exempt
+@require_POST
+async def async_webhook(request):
+    """Асинхронный обработчик вебхуков от Telegram (ASGI)
 
+    Выполняется в постоянном цикле событий ASGI-сервера (settings.asgi),
+    поэтому бот и его HTTP-сессия переиспользуются между обновлениями.
+    Обновления проходят через пул воркеров: по порядку для одного пользователя,
+    параллельно для разных. При TELEGRAM_WEBHOOK_ACK_FIRST ответ Telegram
+    отправляется сразу после постановки в очередь. Это возможно только под
+    ASGI-сервером: под WSGI цикл событий живет один запрос, и очередь пропала бы
+    вместе с ним, поэтому там обновление обрабатывается до ответа. Очереди
+    обрабатываются до конца при остановке сервера (shutdown, settings.asgi).
+    Повторные доставки отбрасываются по update_id до передачи в Dispatcher.
+    """
+    try:
+        update = parse_update(request.body)
     except json.JSONDecodeError as e:
         logger.error(f"Ошибка декодирования JSON: {e}")
         return JsonResponse({"error": "Invalid JSON"}, status=400)
+    except ValidationError as e:
+        logger.error(f"Некорректное обновление: {e}")
+        return JsonResponse({"error": "Invalid update"}, status=400)
+
+    if await dedup.is_duplicate(update.update_id):
+        return HttpResponse("OK")
+
+    if settings.TELEGRAM_WEBHOOK_ACK_FIRST and not isinstance(request, ASGIRequest):
+        warn_ack_first_without_asgi()
+    elif settings.TELEGRAM_WEBHOOK_ACK_FIRST:
+        if not await pool.submit(update):
+            # Обновление не принято: повторная доставка не должна быть отброшена как дубликат
+            await dedup.forget(update.update_id)
+            return JsonResponse({"error": "Queue is full"}, status=503)
+        logger.info("Вебхук поставлен в очередь")
+        return HttpResponse("OK")
+
+    try:
+        await pool.process(update)
+        logger.info("Вебхук успешно обработан")
     except Exception as e:
+        # Ошибка обработчика не должна приводить к повторной доставке обновления
         logger.error(f"Критическая ошибка обработки вебхука: {e}")
-        return JsonResponse({"error": str(e)}, status=400)
\ No newline at end of file
+    return HttpResponse("OK")
+
+
+def metrics_allowed(request):
+    """Доступ к метрикам: сотрудник, вошедший в админку, или заголовок X-Metrics-Token с METRICS_TOKEN"""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = request.headers.get('X-Metrics-Token', '')
+    return bool(settings.METRICS_TOKEN) and hmac.compare_digest(token, settings.METRICS_TOKEN)
+
+
+@require_GET
+def metrics(request):
+    """Метрики обработки обновлений"""
+    if not metrics_allowed(request):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    return JsonResponse({
+        "worker_pool": pool.stats(),
+        "dedup": dedup.stats(),
+        "db_executor": db_executor.stats(),
+        "database": database_stats(),
+    })
@@ -0,0 +1,132 @@
+# workers.py
+import asyncio
+import logging
+import time
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def update_lane_key(update) -> int:
+    """Ключ шардирования обновления: id пользователя, а если его нет - update_id"""
+    try:
+        user = getattr(update.event, 'from_user', None)
+    except Exception:
+        user = None
+    return user.id if user is not None else update.update_id
+
+
+class UpdateWorkerPool:
+    """Пул асинхронных воркеров для обработки обновлений Telegram
+
+    Обновления распределяются по полосам (lanes) по id пользователя: у каждой
+    полосы своя ограниченная очередь и один воркер. Обновления одного
+    пользователя обрабатываются строго по порядку, разных - параллельно.
+
+    submit ставит обновление в очередь и сразу возвращает управление (режим
+    ack-first). Если очередь полосы заполнена дольше enqueue_timeout секунд,
+    обновление отклоняется и Telegram доставит его повторно.
+    process дожидается результата обработки.
+    """
+
+    def __init__(self, bot, workers=8, queue_size=1000, enqueue_timeout=1.0):
+        self.bot = bot
+        self.workers = workers
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self._loop = None
+        self._queues = []
+        self._tasks = []
+        self.dequeued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def start(self):
+        """Запуск воркеров в текущем цикле событий"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+
+        self._loop = loop
+        lane_size = max(1, -(-self.queue_size // self.workers))
+        self._queues = [asyncio.Queue(maxsize=lane_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(number, queue))
+                       for number, queue in enumerate(self._queues)]
+        logger.info(f"Запущен пул из {self.workers} воркеров, размер очереди {self.queue_size}")
+
+    def _lane(self, update):
+        return self._queues[update_lane_key(update) % self.workers]
+
+    async def submit(self, update) -> bool:
+        """Постановка обновления в очередь. Возвращает False, если очередь переполнена"""
+        self.start()
+        queue = self._lane(update)
+        item = (time.monotonic(), update, None)
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(queue.put(item), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                logger.warning(f"Очередь обновлений переполнена, обновление {update.update_id} отклонено")
+                return False
+        return True
+
+    async def process(self, update):
+        """Обработка обновления в его полосе с ожиданием результата"""
+        self.start()
+        future = self._loop.create_future()
+        await self._lane(update).put((time.monotonic(), update, future))
+        return await future
+
+    async def _worker(self, number, queue):
+        while True:
+            enqueued_at, update, future = await queue.get()
+            wait_time = time.monotonic() - enqueued_at
+            self.dequeued += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            try:
+                result = await self.bot.dp.feed_update(self.bot.bot, update)
+                self.processed += 1
+                if future is not None and not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Воркер {number}: ошибка обработки обновления {update.update_id}: {e}")
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
+
+    async def stop(self):
+        """Дожидается обработки очередей и останавливает воркеров"""
+        if not self._queues:
+            return
+        for queue in self._queues:
+            await queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._loop = None
+        self._queues = []
+        self._tasks = []
+
+    def stats(self):
+        """Метрики пула: глубина очередей и время ожидания в них"""
+        depths = [queue.qsize() for queue in self._queues]
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'queue_depth': sum(depths),
+            'lane_depth_max': max(depths, default=0),
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'wait_time_avg': self.wait_time_total / self.dequeued if self.dequeued else 0.0,
+            'wait_time_max': self.wait_time_max,
+        }
@@ -9,8 +9,26 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings.settings")
 
 application = get_asgi_application()
+
+if settings.DEBUG:
+    # Статика админки при разработке под uvicorn (как у runserver)
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
+
+# При остановке сервера обновления, принятые в режиме ack-first, обрабатываются до конца
+from bot.lifespan import LifespanMiddleware  # noqa: E402
+from bot.views import shutdown  # noqa: E402
+
+application = LifespanMiddleware(application, on_shutdown=[shutdown])
+
+# Соединения с БД открываются до первого вебхука
+from bot.db import warm_up_database_blocking  # noqa: E402
+
+warm_up_database_blocking()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
 from pathlib import Path
+from urllib.parse import urlsplit
 
 from dotenv import load_dotenv
 
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "bot",
 ]
 
@@ -136,15 +138,39 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "django.db.backends.postgresql",
         "NAME": os.getenv("DB_NAME"),
         "USER": os.getenv("DB_USER"),
         "PASSWORD": os.getenv("DB_PASSWORD"),
         "HOST": 'db' if is_running_in_docker() else os.getenv('DB_HOST', 'localhost'),
         "PORT": os.getenv("DB_PORT", default="5432"),
+        # Соединения переиспользуются потоками пула БД (bot.db) и проверяются перед использованием
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Продакшен-профиль: общий пул соединений psycopg 3 вместо постоянных соединений на поток.
+# Соединение берется из пула на время запроса (задачи пула БД) и возвращается обратно,
+# поэтому число потоков не ограничено числом соединений с сервером БД.
+DB_POOL = os.getenv('DB_POOL', 'false').lower() == 'true'
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+if DB_POOL:
+    DATABASES["default"]["CONN_MAX_AGE"] = 0  # Django не допускает постоянные соединения вместе с пулом
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv('DB_POOL_MIN_SIZE', 4)),
+            "max_size": int(os.getenv('DB_POOL_MAX_SIZE', 16)),
+            "timeout": DB_POOL_TIMEOUT,  # ожидание свободного соединения, с
+            "max_idle": float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+            "max_lifetime": float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+        },
+    }
+
+# Открытие соединений с БД при запуске вебхука и polling (в профиле DB_POOL
+# или при включенном пуле потоков DB_EXECUTOR_THREADS)
+DB_WARM_UP = os.getenv('DB_WARM_UP', 'true').lower() == 'true'
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
 
@@ -153,3 +179,93 @@ DJANGO_ALLOW_ASYNC_UNSAFE = True
 TELEGRAM_BOT_TOKEN = os.getenv('TG_BOT_TOKEN')
 TELEGRAM_WEBHOOK_URL = os.getenv('TG_WEBHOOK_URL', '')
 TELEGRAM_WEBHOOK_SECRET = os.getenv('TG_WEBHOOK_SECRET', '')
+
+# Публичный адрес сайта (https://домен) для ссылок на медиафайлы, например миниатюр
+# inline-результатов. По умолчанию - адрес, на котором принимается вебхук
+SITE_URL = os.getenv('SITE_URL', '') or (
+    '{0.scheme}://{0.netloc}'.format(urlsplit(TELEGRAM_WEBHOOK_URL)) if TELEGRAM_WEBHOOK_URL else ''
+)
+
+# Режим "сначала ответить": вебхук ставит обновление в очередь и сразу отвечает Telegram
+TELEGRAM_WEBHOOK_ACK_FIRST = os.getenv('TG_WEBHOOK_ACK_FIRST', 'false').lower() == 'true'
+TELEGRAM_WORKERS = int(os.getenv('TG_WORKERS', 8))
+TELEGRAM_QUEUE_SIZE = int(os.getenv('TG_QUEUE_SIZE', 1000))
+TELEGRAM_ENQUEUE_TIMEOUT = float(os.getenv('TG_ENQUEUE_TIMEOUT', 1))
+
+# Отсечение повторных доставок обновлений по update_id
+TELEGRAM_DEDUP_TTL = int(os.getenv('TG_DEDUP_TTL', 3600))
+TELEGRAM_DEDUP_SIZE = int(os.getenv('TG_DEDUP_SIZE', 10000))
+# Алиас общего кеша из CACHES для отсечения повторов между процессами (пусто - только локально)
+TELEGRAM_DEDUP_CACHE = os.getenv('TG_DEDUP_CACHE', '')
+
+# Токен доступа к /metrics/ (заголовок X-Metrics-Token); без него метрики видны только сотрудникам
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+REDIS_URL = os.getenv('REDIS_URL', '')
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Ограничения частоты исходящих запросов к Bot API
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.getenv('TG_CHAT_RATE', 1))
+TELEGRAM_CHAT_BURST = int(os.getenv('TG_CHAT_BURST', 3))
+
+# Время жизни кеша каталога в памяти процесса, секунды
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', 300))
+
+# Размер LRU-кеша параметризованных клавиатур
+KEYBOARD_CACHE_SIZE = int(os.getenv('KEYBOARD_CACHE_SIZE', 1024))
+
+# Товаров на одной странице списка товаров категории
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 8))
+
+# Найденных товаров в ответе на поисковый запрос
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', 10))
+
+# Inline-режим: результатов в одном ответе, всего по запросу и срок кеша ответа на стороне Telegram, с
+INLINE_PAGE_SIZE = int(os.getenv('INLINE_PAGE_SIZE', 20))
+INLINE_MAX_RESULTS = int(os.getenv('INLINE_MAX_RESULTS', 100))
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))
+# Кеш готовых результатов inline-запросов в памяти процесса
+INLINE_RESULTS_CACHE_TTL = int(os.getenv('INLINE_RESULTS_CACHE_TTL', 300))
+INLINE_RESULTS_CACHE_SIZE = int(os.getenv('INLINE_RESULTS_CACHE_SIZE', 1000))
+
+# Заказов на одной странице истории заказов
+ORDERS_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', 5))
+
+# Списки админки: до этого числа строк (по оценке PostgreSQL) считаются точно через COUNT(*)
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', 10000))
+
+# Хранилище состояний диалогов: memory (в памяти процесса) или redis (общее, требует REDIS_URL)
+TELEGRAM_FSM_STORAGE = os.getenv('TG_FSM_STORAGE', 'memory')
+TELEGRAM_FSM_STATE_TTL = int(os.getenv('TG_FSM_STATE_TTL', 600))
+
+# Списание остатков (remainder) при оформлении заказа. Включайте после того, как
+# в админке заданы реальные остатки: по умолчанию у товаров remainder=1
+STOCK_RESERVATION = os.getenv('STOCK_RESERVATION', 'false').lower() == 'true'
+
+# Срок резерва остатков под неподтвержденный заказ, секунд
+ORDER_RESERVATION_TTL = int(os.getenv('ORDER_RESERVATION_TTL', 900))
+
+# Сколько номеров заказов процесс забирает из последовательности БД за один запрос
+ORDER_NUMBER_BLOCK_SIZE = int(os.getenv('ORDER_NUMBER_BLOCK_SIZE', 50))
+
+# Кеш заказчиков по telegram_id: время жизни записи, секунд, и максимальный размер
+CUSTOMER_CACHE_TTL = int(os.getenv('CUSTOMER_CACHE_TTL', 60))
+CUSTOMER_CACHE_SIZE = int(os.getenv('CUSTOMER_CACHE_SIZE', 10000))
+
+# Потоки для запросов к БД из бота, у каждого свое соединение. 0 - общий поток
+# sync_to_async (одно соединение)
+DB_EXECUTOR_THREADS = int(os.getenv('DB_EXECUTOR_THREADS', 8))
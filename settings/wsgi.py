@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings.settings")
 
 application = get_wsgi_application()
+
+# Соединения с БД открываются до первого вебхука
+from bot.db import warm_up_database_blocking  # noqa: E402
+
+warm_up_database_blocking()